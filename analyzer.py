@@ -1,28 +1,77 @@
 ﻿import argparse
+import hashlib
 import json
-from datetime import datetime, time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import yaml
-from business_duration import businessDuration
 
-REQUIRED_APPROVALS = 2
-
-
-def business_hours_delta(start, end):
-    if not start or not end:
-        return None
-    return round(
-        businessDuration(
-            start,
-            end,
-            starttime=time(9, 0),
-            endtime=time(17, 0),
-            weekendlist=[6, 7],  # Saturday & Sunday
-            holidaylist=[],
-            unit="hour"
-        ), 2
-    )
+from business_hours import WorkingCalendar
+from event_index import event_timings
+from instrumentation import add_arguments, count, instrumented, timed
+from json_codec import dump
+from metrics_db import FORMATS, write_metrics_db
+from metrics_store import DEFAULT_STORE, MetricsStore
+from pull_request_record import PullRequestRecord, to_iso
+from quantile_sketch import PERCENTILES, RELATIVE_ACCURACY, bin_indexes, encode_sketch, sketch_percentiles
+from raw_data import read_raw_data
+from review_timeline import (
+    DEFAULT_APPROVAL_RULE, ApprovalRule, build_reviewer_load, repo_rules, review_timeline, rule_for
+)
+
+# Bumped when the per-PR metric record changes shape, so stored metrics are rebuilt
+METRIC_VERSION = 7
+DEFAULT_WORKERS = 1
+# Pull requests handed to a worker process at a time
+SHARD_SIZE = 2000
+DEFAULT_CALENDAR = "default"
+DEFAULT_WORKING_CALENDAR = WorkingCalendar()
+
+SUMMED_METRICS = ["lines_added", "lines_deleted", "files_changed", "comment_count", "review_rounds"]
+PERIODS = {
+    "per_day": "%Y-%m-%d",
+    "per_week": "%Y-%W",
+    # ISO weeks run Monday to Sunday and never split at a year boundary
+    "per_iso_week": "%G-W%V",
+    "per_month": "%Y-%m",
+}
+
+# Business-hour metrics and the timings each one runs between
+DURATIONS = {
+    "first_commit_to_production": ("first_commit_at", "merged_at"),
+    "code_complete_to_production": ("last_commit_at", "merged_at"),
+    "feedback_delay": ("ready_for_review_at", "first_feedback_at"),
+    "code_review_duration": ("ready_for_review_at", "review_completed_at"),
+    "active_development_duration": ("first_commit_at", "last_commit_at"),
+    "time_to_first_approval": ("ready_for_review_at", "first_approved_at"),
+    "rereview_latency": ("changes_requested_at", "rereviewed_at"),
+    "review_request_latency": ("review_requested_at", "first_feedback_at"),
+}
+# Business-hour metrics summed over every period a state held, and the timing listing those periods
+INTERVAL_DURATIONS = {
+    "draft_duration": "draft_intervals",
+}
+DURATION_METRICS = [*DURATIONS, *INTERVAL_DURATIONS]
+# Durations most pull requests do not have, averaged over the pull requests that do rather than over the bucket
+SPARSE_DURATIONS = ["time_to_first_approval", "rereview_latency", "review_request_latency", "draft_duration"]
+BUCKET_KEY = ["team", "period", "bucket"]
+ROLLING_WINDOWS = {"7d": 7, "28d": 28, "90d": 90}
+# Bucket columns counting the pull requests that have each sparse duration
+PRESENT_COUNTS = [f"{metric}_count" for metric in SPARSE_DURATIONS]
+BUCKET_METRICS = [*SUMMED_METRICS, *DURATION_METRICS, *PRESENT_COUNTS]
+# Cycle-time metrics whose distribution is kept per bucket as a quantile sketch
+SKETCHED_METRICS = ["first_commit_to_production", "feedback_delay", "code_review_duration"]
+
+
+@timed()
+def business_hours_deltas(starts, ends, calendar=None):
+    hours = (calendar or DEFAULT_WORKING_CALENDAR).hours_between(starts, ends)
+    return [None if np.isnan(value) else round(float(value), 2) for value in hours.tolist()]
 
 
 def load_teams(path):
@@ -30,138 +79,458 @@ def load_teams(path):
         return yaml.safe_load(f)
 
 
-def main(pull_requests, team_pull_requests):
-    team_lookup = {
-        member: team for team, members in team_pull_requests.items() for member in members
-    }
+def load_calendars(path):
+    with open(path) as f:
+        return {name: WorkingCalendar.from_config(config) for name, config in yaml.safe_load(f).items()}
 
-    pull_request_metrics = {}
-    for pr in pull_requests:
-        team = team_lookup.get(pr["author"], "unknown")
-        pr_metric = build_metric(pr, team)
-        pull_request_metrics[pr_metric["number"]] = pr_metric
 
-    team_pull_requests = {}
-    for pr_number, pr in pull_request_metrics.items():
-        team = pr["team"]
-        if team not in team_pull_requests: team_pull_requests[team] = []
-        team_pull_requests[team].append(pr)
+def load_approval_rules(path):
+    with open(path) as f:
+        return {repo: ApprovalRule.from_config(config) for repo, config in yaml.safe_load(f).items()}
+
+
+def team_members(team_config):
+    # A team is either a list of members or a mapping with "members" and an optional "calendar"
+    return team_config["members"] if isinstance(team_config, dict) else team_config
+
+
+def team_calendars(teams, calendars):
+    calendars = {DEFAULT_CALENDAR: DEFAULT_WORKING_CALENDAR, **(calendars or {})}
+    lookup = {}
+    for team, team_config in teams.items():
+        name = team_config.get("calendar", DEFAULT_CALENDAR) if isinstance(team_config, dict) else DEFAULT_CALENDAR
+        if name not in calendars:
+            raise ValueError(f"Team {team} uses calendar '{name}', which is not defined")
+        lookup[team] = calendars[name]
+    lookup["unknown"] = calendars[DEFAULT_CALENDAR]
+    return lookup
 
-    team_metrics = {}
-    for team, team_prs in team_pull_requests.items():
-        team_metrics[team] = {
-            "per_day": build_team_metrics_per_day(team_prs),
-            "per_week": build_team_metrics_per_week(team_prs),
-            "per_month": build_team_metrics_per_month(team_prs)
-        }
 
-    save_metrics({
+def main(pull_requests, team_pull_requests, calendars=None, workers=DEFAULT_WORKERS, store_path=None,
+         output_format="sqlite", output_file=None, approval_rules=None):
+    metrics = analyze(pull_requests, team_pull_requests, calendars, workers, store_path, approval_rules)
+    save_metrics(metrics, output_format, output_file or FORMATS[output_format])
+
+
+def analyze(pull_requests, team_pull_requests, calendars=None, workers=DEFAULT_WORKERS, store_path=None,
+            approval_rules=None):
+    """
+    Metrics for every pull request and team, as saved by main. pull_requests may be any iterable: without a store
+    it is consumed a shard at a time, so metrics are computed while later pull requests are still arriving.
+    """
+    team_lookup = {
+        member: team for team, team_config in team_pull_requests.items() for member in team_members(team_config)
+    }
+    calendars_by_team = team_calendars(team_pull_requests, calendars)
+    rules = repo_rules(approval_rules)
+
+    if store_path:
+        store = MetricsStore(BUCKET_METRICS, store_path)
+        try:
+            if store.prepare(settings_fingerprint(team_pull_requests, calendars_by_team, rules)):
+                print("Teams, calendars or approval rules changed, recomputing every pull request")
+            pull_request_metrics = update_store(store, pull_requests, team_lookup, calendars_by_team, rules, workers)
+            bucket_sums = store.bucket_sums()
+            bucket_sketches = store.bucket_sketches()
+        finally:
+            store.close()
+    else:
+        pull_request_metrics = {}
+        records = map(PullRequestRecord.from_raw, pull_requests)
+        for pr_metric in build_all_metrics(records, team_lookup, calendars_by_team, rules, workers):
+            pull_request_metrics[pull_request_key(pr_metric)] = pr_metric
+        bucket_sums, bucket_sketches = build_bucket_aggregates(build_metrics_frame(pull_request_metrics.values()))
+
+    team_metrics = add_trend_metrics(build_team_metrics(bucket_sums, bucket_sketches), bucket_sums)
+    for team, reviewer_load in build_reviewer_load(pull_request_metrics.values()).items():
+        # a team with only unmerged pull requests has no buckets, and so no section of its own
+        if team in team_metrics:
+            team_metrics[team]["reviewer_load"] = reviewer_load
+    return {
         "pull_requests": pull_request_metrics,
+        "team_pull_requests": build_team_index(pull_request_metrics),
         "teams": team_metrics,
-    })
-
-
-def build_team_metrics_per_day(pull_requests):
-    prs_by_day = {}
-    for pr in pull_requests:
-        day = datetime.fromisoformat(pr["merged_at"]).date().isoformat()
-        if day not in prs_by_day: prs_by_day[day] = []
-        prs_by_day[day].append(pr)
-
-    return build_metrics_for_collection(prs_by_day)
-
-
-def build_metrics_for_collection(prs_by_time_period):
-    data = {}
-    for day, prs in prs_by_time_period.items():
-        count = len(prs)
-        totals = {
-            "lines_added": sum([pr["lines_added"] for pr in prs]),
-            "lines_deleted": sum([pr["lines_deleted"] for pr in prs]),
-            "files_changed": sum([pr["files_changed"] for pr in prs]),
-            "comment_count": sum([pr["comment_count"] for pr in prs]),
-            "first_commit_to_production": round(sum([pr["first_commit_to_production"] for pr in prs])),
-            "code_complete_to_production": round(sum([pr["code_complete_to_production"] for pr in prs])),
-            "feedback_delay": round(sum([pr["feedback_delay"] for pr in prs])),
-            "code_review_duration": round(sum([pr["code_review_duration"] for pr in prs])),
-            "active_development_duration": round(sum([pr["active_development_duration"] for pr in prs])),
-        }
-        averages = {
-            "lines_added": round(totals.get("lines_added") / count),
-            "lines_deleted": round(totals.get("lines_deleted") / count),
-            "files_changed": round(totals.get("files_changed") / count),
-            "comment_count": round(totals.get("comment_count") / count),
-            "first_commit_to_production": round(totals.get("first_commit_to_production") / count),
-            "code_complete_to_production": round(totals.get("code_complete_to_production") / count),
-            "feedback_delay": round(totals.get("feedback_delay") / count),
-            "code_review_duration": round(totals.get("code_review_duration") / count),
-            "active_development_duration": round(totals.get("active_development_duration") / count),
-        }
-        data[day] = {
-            "count": count,
-            "totals": totals,
-            "averages": averages,
-        }
-    return data
+    }
+
+
+def build_team_index(pull_request_metrics):
+    team_index = {}
+    for key, pr_metric in pull_request_metrics.items():
+        team_index.setdefault(pr_metric["team"], []).append(key)
+    return team_index
+
+
+@timed()
+def update_store(store, pull_requests, team_lookup, calendars_by_team, rules, workers=DEFAULT_WORKERS):
+    stored_hashes = store.hashes()
+    current_hashes = {}
+    changed = {}
+    for pull_request in pull_requests:
+        key = pull_request_key(pull_request)
+        current_hashes[key] = content_hash(pull_request)
+        # the last record for a key wins, as in a full run
+        if stored_hashes.get(key) == current_hashes[key]:
+            changed.pop(key, None)
+        else:
+            changed[key] = PullRequestRecord.from_raw(pull_request)
+
+    removed_keys = [key for key in stored_hashes if key not in current_hashes]
+    previous_metrics = store.metrics([*removed_keys, *(key for key in changed if key in stored_hashes)])
+    changed_metrics = {
+        pull_request_key(pr_metric): pr_metric
+        for pr_metric in build_all_metrics(changed.values(), team_lookup, calendars_by_team, rules, workers)
+    }
+    count("pull_requests_recomputed", len(changed))
+    count("pull_requests_unchanged", len(current_hashes) - len(changed))
+    print(f"{len(changed)} new or changed, {len(removed_keys)} removed and "
+          f"{len(current_hashes) - len(changed)} unchanged pull requests")
+
+    # Only the buckets these pull requests fall in move: add the new contributions and take back the old ones
+    added_sums, added_sketches = build_bucket_aggregates(build_metrics_frame(changed_metrics.values()))
+    taken_sums, taken_sketches = build_bucket_aggregates(build_metrics_frame(previous_metrics.values()))
+    sketch_deltas = added_sketches.sub(taken_sketches, fill_value=0).astype("int64")
+    store.update(
+        removed_keys,
+        [(key, current_hashes[key], pr_metric) for key, pr_metric in changed_metrics.items()],
+        added_sums.sub(taken_sums, fill_value=0).astype("int64"),
+        sketch_deltas[sketch_deltas != 0],
+    )
+
+    stored_metrics = store.metrics()
+    return {key: stored_metrics[key] for key in current_hashes}
 
 
-def build_team_metrics_per_week(pull_requests):
-    prs_by_week = {}
-    for pr in pull_requests:
-        week = datetime.fromisoformat(pr["merged_at"]).date().strftime("%Y-%W")
-        if week not in prs_by_week: prs_by_week[week] = []
-        prs_by_week[week].append(pr)
+def content_hash(pull_request):
+    return hashlib.sha256(json.dumps(pull_request, sort_keys=True).encode()).hexdigest()
 
-    return build_metrics_for_collection(prs_by_week)
+
+def settings_fingerprint(teams, calendars_by_team, rules):
+    settings = {
+        "teams": teams,
+        "calendars": {team: calendar.settings() for team, calendar in calendars_by_team.items()},
+        "approval_rules": {repo: rule.settings() for repo, rule in rules.items()},
+        "metric_version": METRIC_VERSION,
+        "periods": PERIODS,
+        "sketched_metrics": SKETCHED_METRICS,
+        "sketch_accuracy": RELATIVE_ACCURACY,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
 
 
-def build_team_metrics_per_month(pull_requests):
-    prs_by_month = {}
-    for pr in pull_requests:
-        month = datetime.fromisoformat(pr["merged_at"]).date().strftime("%Y-%m")
-        if month not in prs_by_month: prs_by_month[month] = []
-        prs_by_month[month].append(pr)
+def build_all_metrics(pull_requests, team_lookup, calendars_by_team, rules=None, workers=DEFAULT_WORKERS):
+    if workers <= 1:
+        for shard in shards(pull_requests, SHARD_SIZE):
+            yield from build_metrics(shard, team_lookup, calendars_by_team, rules)
+        return
 
-    return build_metrics_for_collection(prs_by_month)
+    # Shards are collected in submission order, so the metrics come out in the same order as a serial run
+    # and deduplication and aggregation see exactly the same sequence
+    # spawned rather than forked: in the pipeline the collector thread is still running, and a forked worker could
+    # inherit one of its locks held mid-request and wait on it forever
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        in_flight = deque()
+        for shard in shards(pull_requests, SHARD_SIZE):
+            in_flight.append(executor.submit(build_metrics, shard, team_lookup, calendars_by_team, rules))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
 
+        while in_flight:
+            yield from in_flight.popleft().result()
 
-def save_metrics(metrics):
-    Path("data").mkdir(exist_ok=True)
-    with open("data/metrics.json", "w") as file_stream:
-        json.dump(metrics, file_stream, indent=2)
 
-    print("Metrics written to data/metrics.json")
+def shards(items, size):
+    items = iter(items)
+    while shard := list(islice(items, size)):
+        yield shard
 
 
-def time_of_approval(reviews):
-    approved_at = None
-    approved_by = []
-    changes_requested_by = []
+def pull_request_key(pull_request):
+    # PR numbers are only unique within a repository, so multi-repo data is keyed by "owner/name#number"
+    return f"{pull_request['repo']}#{pull_request['number']}" if pull_request.get("repo") else pull_request["number"]
+
+
+@timed()
+def build_metrics_frame(pr_metrics):
+    frame = pd.DataFrame.from_records(
+        list(pr_metrics), columns=["team", "merged_at", *SUMMED_METRICS, *DURATION_METRICS]
+    )
+    merged_on = pd.to_datetime(frame["merged_at"], format="ISO8601", utc=True).dt.tz_localize(None).dt.floor("D")
+    # unmerged pull requests fall in no bucket
+    merged = merged_on.notna().to_numpy()
+    frame = frame[merged].reset_index(drop=True)
+    # Only the distinct merge days are formatted; every PR then takes its day's labels
+    day_codes, days = pd.factorize(merged_on[merged])
+    for period, period_format in PERIODS.items():
+        frame[period] = days.strftime(period_format).to_numpy()[day_codes]
+
+    frame[SUMMED_METRICS] = frame[SUMMED_METRICS].fillna(0).astype("int64")
+    # Durations are kept in hundredths of an hour, so sums are exact and independent of summation order
+    durations = (frame[DURATION_METRICS].astype("float64") * 100).round()
+    for metric in SKETCHED_METRICS:
+        # missing durations count as zero in totals, but are left out of the distribution
+        frame[sketch_column(metric)] = bin_indexes(durations[metric])
+    for metric, present in zip(SPARSE_DURATIONS, PRESENT_COUNTS):
+        frame[present] = durations[metric].notna().astype("int64")
+    frame[DURATION_METRICS] = durations.fillna(0).astype("int64")
+    return frame
+
+
+def sketch_column(metric):
+    return f"{metric}_bin"
+
+
+@timed()
+def build_bucket_aggregates(frame):
+    """Sums and counts per team bucket, and the sketch bin counts of each bucket's SKETCHED_METRICS."""
+    # Stack the day/week/month bucket of every PR, then aggregate all teams and periods in a single groupby
+    buckets = pd.concat(
+        [frame.assign(period=period, bucket=frame[period]) for period in PERIODS], ignore_index=True
+    )
+    grouped = buckets.groupby(BUCKET_KEY, sort=False)
+    sums = grouped[BUCKET_METRICS].sum()
+    sums.insert(0, "count", grouped.size())
+
+    bins = buckets[[*BUCKET_KEY, *map(sketch_column, SKETCHED_METRICS)]].rename(
+        columns={sketch_column(metric): metric for metric in SKETCHED_METRICS}
+    ).melt(id_vars=BUCKET_KEY, var_name="metric", value_name="bin").dropna(subset=["bin"])
+    sketches = bins.astype({"bin": "int64"}).groupby([*BUCKET_KEY, "metric", "bin"], sort=False).size()
+    return sums, sketches
+
+
+def summarise_sums(sums):
+    counts = sums["count"]
+    totals = sums.drop(columns=["count", *PRESENT_COUNTS])
+    # np.round rounds halves to even, like round() did on the summed values
+    totals[DURATION_METRICS] = np.round(totals[DURATION_METRICS] / 100).astype("int64")
+    averages = totals.div(counts, axis=0)
+    for metric, present in zip(SPARSE_DURATIONS, PRESENT_COUNTS):
+        # a bucket where no pull request has the duration averages to 0, as its total is 0
+        averages[metric] = totals[metric].div(sums[present].where(sums[present] > 0, 1))
+    return counts, totals, np.round(averages).astype("int64")
+
+
+@timed()
+def build_team_metrics(sums, sketches):
+    counts, totals, averages = summarise_sums(sums)
+
+    bucket_sketches = {}
+    for (team, period, bucket, metric, index), bin_count in zip(sketches.index, sketches.tolist()):
+        bucket_sketches.setdefault((team, period, bucket), {}).setdefault(metric, {})[index] = bin_count
+    bucket_percentiles = {}
+    if len(sketches):
+        percentiles = sketch_percentiles(sketches)
+        for (team, period, bucket, metric), values in zip(percentiles.index, percentiles.to_numpy().tolist()):
+            bucket_percentiles.setdefault((team, period, bucket), {})[metric] = dict(zip(PERCENTILES, values))
+
+    no_percentiles = dict.fromkeys(PERCENTILES)
+    metric_names = list(totals.columns)
+    team_metrics = {}
+    for key, bucket_count, total_values, average_values in zip(
+            totals.index, counts.tolist(), totals.to_numpy().tolist(), averages.to_numpy().tolist()):
+        team, period, bucket = key
+        if team not in team_metrics:
+            team_metrics[team] = {period: {} for period in PERIODS}
+        percentiles = bucket_percentiles.get(key, {})
+        team_metrics[team][period][bucket] = {
+            "count": bucket_count,
+            "totals": dict(zip(metric_names, total_values)),
+            "averages": dict(zip(metric_names, average_values)),
+            "percentiles": {metric: percentiles.get(metric, no_percentiles) for metric in SKETCHED_METRICS},
+            "sketches": {metric: encode_sketch(bins) for metric, bins in bucket_sketches.get(key, {}).items()},
+        }
+    return team_metrics
 
-    for review in reviews:
-        user = review["user"]
-        state = review["state"]
-        if state == "APPROVED":
-            if user not in approved_by: approved_by.append(user)
-            if user in changes_requested_by: changes_requested_by.remove(user)
-        if state == "DISMISSED":
-            if user in approved_by: approved_by.remove(user)
-            if user in changes_requested_by: changes_requested_by.remove(user)
-        if state == "CHANGES_REQUESTED":
-            if user in approved_by: approved_by.remove(user)
-            if user not in changes_requested_by: changes_requested_by.append(user)
 
-        if len(approved_by) == REQUIRED_APPROVALS:
-            approved_at = review["submitted_at"]
+@timed()
+def add_trend_metrics(team_metrics, sums):
+    # every team gets both sections, empty when it has too little history for them
+    rolling = build_rolling_metrics(sums)
+    week_over_week = build_week_over_week(sums)
+    for team, sections in team_metrics.items():
+        sections["rolling"] = rolling.get(team, {})
+        sections["week_over_week"] = week_over_week.get(team, {})
+    return team_metrics
 
-    if (len(approved_by) >= REQUIRED_APPROVALS) and (len(changes_requested_by) == 0):
-        return datetime.fromisoformat(approved_at)
 
-    return None
+def period_sums(sums, period):
+    # with no merged pull requests there are no buckets, and so no period level to select from
+    if sums.empty or period not in sums.index.get_level_values("period"):
+        return None
+    return sums.xs(period, level="period")
+
+
+def build_rolling_metrics(sums):
+    """Count and averages over the trailing ROLLING_WINDOWS for every day, from running sums of the daily buckets."""
+    rolling = {}
+    daily_sums = period_sums(sums, "per_day")
+    if daily_sums is None or daily_sums.empty:
+        return rolling
+
+    # every team's series runs to the latest merge in the data, so recent windows are reported for quiet teams too
+    last_day = pd.Timestamp(daily_sums.index.get_level_values("bucket").max())
+    for team, daily in daily_sums.groupby(level="team", sort=False):
+        daily = daily.droplevel("team")
+        daily.index = pd.to_datetime(daily.index)
+        # one row per calendar day, so a window is a fixed number of rows and each window sum is a difference of
+        # two running sums
+        days = pd.date_range(daily.index.min(), last_day, freq="D")
+        running = daily.reindex(days, fill_value=0).astype("int64").cumsum()
+
+        rolling[team] = {}
+        for window, days in ROLLING_WINDOWS.items():
+            window_sums = running - running.shift(days, fill_value=0)
+            window_sums = window_sums[window_sums["count"] > 0]
+            counts, _, averages = summarise_sums(window_sums)
+            metric_names = list(averages.columns)
+            rolling[team][window] = {
+                day: {"count": count, "averages": dict(zip(metric_names, average_values))}
+                for day, count, average_values in zip(
+                    window_sums.index.strftime("%Y-%m-%d"), counts.tolist(), averages.to_numpy().tolist()
+                )
+            }
+    return rolling
+
+
+def build_week_over_week(sums):
+    """Change in count and averages from the previous ISO week, for weeks where both weeks have pull requests."""
+    weekly_sums = period_sums(sums, "per_iso_week")
+    if weekly_sums is None:
+        return {}
+    counts, _, averages = summarise_sums(weekly_sums)
+    weekly = averages.assign(count=counts)[["count", *averages.columns]]
+    teams = weekly.index.get_level_values("team")
+    weeks = weekly.index.get_level_values("bucket")
+    previous_weeks = (pd.to_datetime(weeks + "-1", format="%G-W%V-%u") - pd.Timedelta(days=7)).strftime("%G-W%V")
+    previous = weekly.reindex(pd.MultiIndex.from_arrays([teams, previous_weeks]))
+    has_previous = previous["count"].notna().to_numpy()
+
+    deltas = weekly[has_previous] - previous[has_previous].to_numpy()
+    metric_names = list(averages.columns)
+    week_over_week = {}
+    for (team, week), delta_values in zip(deltas.index, deltas.astype("int64").to_numpy().tolist()):
+        week_over_week.setdefault(team, {})[week] = {
+            "count": delta_values[0],
+            "averages": dict(zip(metric_names, delta_values[1:])),
+        }
+    return week_over_week
+
+
+@timed()
+def save_metrics(metrics, output_format, output_file):
+    if output_format == "sqlite":
+        write_metrics_db(metrics, output_file)
+    else:
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, "wb") as file_stream:
+            dump(metrics, file_stream, indent=True)
+
+    print(f"Metrics written to {output_file}")
+
+
+@timed()
+def build_metrics(pull_requests, team_lookup, calendars_by_team=None, rules=None):
+    pull_requests = list(pull_requests)
+    rules = repo_rules(rules)
+    teams = [team_lookup.get(pr.author, "unknown") for pr in pull_requests]
+    timings = [pull_request_timings(pr, rule_for(rules, pr.repo)) for pr in pull_requests]
+
+    # PRs are grouped by their team's calendar, and each duration is computed for a whole group in one
+    # vectorised call
+    indexes_by_calendar = {}
+    for index, team in enumerate(teams):
+        calendar = (calendars_by_team or {}).get(team)
+        indexes_by_calendar.setdefault(calendar, []).append(index)
+
+    durations = [None for _ in pull_requests]
+    for calendar, indexes in indexes_by_calendar.items():
+        for index, duration in zip(indexes, build_durations([timings[index] for index in indexes], calendar)):
+            durations[index] = duration
+
+    return [
+        build_metric(pr, team, timing, duration)
+        for pr, team, timing, duration in zip(pull_requests, teams, timings, durations)
+    ]
+
+
+def build_durations(timings, calendar=None):
+    """Every business-hour metric of a group of pull requests sharing a calendar, one vectorised call per metric."""
+    durations = [{"label_durations": {}} for _ in timings]
+    for metric, (start, end) in DURATIONS.items():
+        values = business_hours_deltas([timing[start] for timing in timings], [timing[end] for timing in timings],
+                                       calendar)
+        for duration, value in zip(durations, values):
+            duration[metric] = value
+
+    for metric, periods_key in INTERVAL_DURATIONS.items():
+        for duration, value in zip(durations, interval_hours([timing[periods_key] for timing in timings], calendar)):
+            duration[metric] = value
+
+    labelled = [
+        (duration, label, periods)
+        for duration, timing in zip(durations, timings) for label, periods in timing["label_intervals"].items()
+    ]
+    for (duration, label, _), value in zip(labelled, interval_hours([entry[2] for entry in labelled], calendar)):
+        if value is not None:
+            duration["label_durations"][label] = value
+    return durations
+
+
+def interval_hours(period_lists, calendar=None):
+    """Business hours summed over each list of (start, end) periods, or None for an empty list."""
+    owners = [position for position, periods in enumerate(period_lists) for _ in periods]
+    hours = business_hours_deltas(
+        [start for periods in period_lists for start, _ in periods],
+        [end for periods in period_lists for _, end in periods],
+        calendar
+    )
+    totals = [None] * len(period_lists)
+    for owner, value in zip(owners, hours):
+        if value is not None:
+            totals[owner] = round((totals[owner] or 0) + value, 2)
+    return totals
+
+
+@timed()
+def pull_request_timings(pull_request, rule=None):
+    # timings are epoch microseconds, as held by the PullRequestRecord
+    merged_at = pull_request.merged_at
+    reviews = review_timeline(pull_request.reviews(), rule or DEFAULT_APPROVAL_RULE)
+    approved_at = reviews["approved_at"]
+    first_reviewed_at = reviews["first_reviewed_at"]
+    events = event_timings(pull_request, merged_at if merged_at is not None else pull_request.closed_at)
+    ready_for_review_at = events["ready_for_review_at"]
+    if first_reviewed_at is not None and first_reviewed_at < ready_for_review_at:
+        # reviewed while still a draft, so the review itself is when it was first looked at
+        ready_for_review_at = first_reviewed_at
+    review_requested_at = events["review_requested_at"]
+    if review_requested_at is not None and first_reviewed_at is not None and first_reviewed_at < review_requested_at:
+        # reviewed before anyone was asked, so there is no request latency to measure
+        review_requested_at = None
+    return {
+        "first_commit_at": pull_request.commit_times[0] if pull_request.commit_times else None,
+        "last_commit_at": pull_request.commit_times[-1] if pull_request.commit_times else None,
+        "merged_at": merged_at,
+        "ready_for_review_at": ready_for_review_at,
+        "draft_intervals": events["draft_intervals"],
+        "review_requested_at": review_requested_at,
+        "label_intervals": events["label_intervals"],
+        "first_feedback_at": first_reviewed_at,
+        "approved_at": approved_at,
+        "review_completed_at": approved_at if approved_at is not None else merged_at,
+        "first_approved_at": reviews["first_approved_at"],
+        "changes_requested_at": reviews["changes_requested_at"],
+        "rereviewed_at": reviews["rereviewed_at"],
+        "review_rounds": reviews["review_rounds"],
+        "review_counts": reviews["review_counts"],
+    }
 
 
-def build_metric(pull_request, team):
+@timed()
+def build_metric(pull_request, team, timings=None, durations=None):
     """
+    The metrics of one PullRequestRecord (see PullRequestRecord.from_raw for a raw pull request). build_metrics
+    passes in timings and durations computed for a whole shard; without them they are computed here.
+
     What we're looking to show:
         - decreasing time to production
             - Need: time between first commit and merge
@@ -173,82 +542,84 @@ def build_metric(pull_request, team):
             - Need: time between ready for review and approval
         - decreasing duration of active development
             - Need: time between first commit and last commit
+        - decreasing time spent as a draft
+            - Need: time between opening as, or converting to, a draft and becoming ready for review
         - understand of engagement on PRs
             - Need: total number of comments on PR
     """
 
-    first_commit_at = time_of_first_commit(pull_request)
-    last_commit_at = time_of_last_commit(pull_request)
-    merged_at = time_of_merge(pull_request)
-    ready_for_review_at = time_when_ready_for_review(pull_request)
-    first_feedback_at = time_of_first_feedback(pull_request)
-    approved_at = time_of_approval(pull_request["reviews"])
+    timings = timings or pull_request_timings(pull_request)
+    durations = durations or build_durations([timings])[0]
+
+    first_commit_at = timings["first_commit_at"]
+    last_commit_at = timings["last_commit_at"]
+    merged_at = timings["merged_at"]
+    ready_for_review_at = timings["ready_for_review_at"]
+    first_feedback_at = timings["first_feedback_at"]
+    approved_at = timings["approved_at"]
+    first_approved_at = timings["first_approved_at"]
 
     return {
-        "number": pull_request["number"],
-        "author": pull_request["author"],
-        "created_at": pull_request["created_at"],
+        "repo": pull_request.repo,
+        "number": pull_request.number,
+        "author": pull_request.author,
+        "created_at": to_iso(pull_request.created_at),
         "team": team,
-
-        "first_commit_at": first_commit_at.isoformat() if first_feedback_at else None,
-        "last_commit_at": last_commit_at.isoformat() if last_commit_at else None,
-        "merged_at": merged_at.isoformat() if merged_at else None,
-        "ready_for_review_at": ready_for_review_at.isoformat() if ready_for_review_at else None,
-        "first_feedback_at": first_feedback_at.isoformat() if first_feedback_at else None,
-        "approved_at": approved_at.isoformat() if approved_at else None,
-
-        "first_commit_to_production": business_hours_delta(first_commit_at, merged_at),
-        "code_complete_to_production": business_hours_delta(last_commit_at, merged_at),
-        "feedback_delay": business_hours_delta(ready_for_review_at, first_feedback_at),
-        "code_review_duration": business_hours_delta(ready_for_review_at, approved_at if approved_at else merged_at),
-        # "code_review_duration_with_feedback": business_hours_delta(
-        #     ready_for_review_at,
-        #     approved_at if approved_at else merged_at if merged_at else first_feedback_at
-        # ),
-        "active_development_duration": business_hours_delta(first_commit_at, last_commit_at),
-
-        "lines_added": pull_request.get("additions", 0),
-        "lines_deleted": pull_request.get("deletions", 0),
-        "files_changed": pull_request.get("changed_files", 0),
-        "comment_count": pull_request.get("comments", 0)
+        "labels": list(pull_request.labels),
+
+        "first_commit_at": to_iso(first_commit_at) if first_feedback_at is not None else None,
+        "last_commit_at": to_iso(last_commit_at),
+        "merged_at": to_iso(merged_at),
+        "ready_for_review_at": to_iso(ready_for_review_at),
+        "first_feedback_at": to_iso(first_feedback_at),
+        "approved_at": to_iso(approved_at),
+        "first_approved_at": to_iso(first_approved_at),
+
+        "first_commit_to_production": durations["first_commit_to_production"],
+        "code_complete_to_production": durations["code_complete_to_production"],
+        "feedback_delay": durations["feedback_delay"],
+        "code_review_duration": durations["code_review_duration"],
+        "active_development_duration": durations["active_development_duration"],
+        "time_to_first_approval": durations["time_to_first_approval"],
+        "rereview_latency": durations["rereview_latency"],
+        "review_request_latency": durations["review_request_latency"],
+        "draft_duration": durations["draft_duration"],
+        "label_durations": durations["label_durations"],
+        "review_rounds": timings["review_rounds"],
+        "review_counts": timings["review_counts"],
+
+        "lines_added": pull_request.additions,
+        "lines_deleted": pull_request.deletions,
+        "files_changed": pull_request.changed_files,
+        "comment_count": pull_request.comments
     }
 
 
-def time_when_ready_for_review(pull_request):
-    return datetime.fromisoformat(
-        pull_request.get("ready_for_review_at") if pull_request.get("ready_for_review_at") else pull_request.get(
-            "created_at"))
-
-
-def time_of_first_feedback(pull_request):
-    reviews = pull_request.get("reviews")
-    return datetime.fromisoformat(reviews[0].get("submitted_at")) if len(reviews) > 0 else None
-
-
-def time_of_merge(pull_request):
-    return datetime.fromisoformat(pull_request.get("merged_at")) if pull_request.get("merged_at") else None
-
-
-def time_of_last_commit(pull_request):
-    commits = pull_request.get("commits")
-    return datetime.fromisoformat(commits[-1].get("timestamp")) if len(commits) > 0 else None
-
-
-def time_of_first_commit(pull_request):
-    commits = pull_request.get("commits")
-    return datetime.fromisoformat(commits[0].get("timestamp")) if len(commits) > 0 else None
-
-
 def load_pr_data(file_url: str):
-    with open(file_url) as f:
-        raw_data = json.load(f)
-    return raw_data
+    return read_raw_data(file_url)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", required=True)
     parser.add_argument("--teams", required=True)
+    parser.add_argument("--calendars")
+    parser.add_argument("--approval-rules")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--store", nargs="?", const=DEFAULT_STORE)
+    parser.add_argument("--format", choices=FORMATS, default="sqlite")
+    parser.add_argument("--output")
+    add_arguments(parser, "analyzer")
     args = parser.parse_args()
 
-    main(load_pr_data(args.input), load_teams(args.teams))
+    with instrumented("analyzer", args.instrument, args.profile):
+        main(
+            load_pr_data(args.input),
+            load_teams(args.teams),
+            load_calendars(args.calendars) if args.calendars else None,
+            args.workers,
+            args.store,
+            args.format,
+            args.output,
+            load_approval_rules(args.approval_rules) if args.approval_rules else None,
+        )
@@ -0,0 +1,399 @@
+﻿import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from graphql_collector import TIMELINE_EVENTS, _item_type
+from raw_data import UNKNOWN_USER, read_raw_data
+
+DEFAULT_PORT = 8765
+DEFAULT_PER_PAGE = 30
+# REST issue event names back to the GraphQL timeline item types
+TIMELINE_TYPES = {action: type_name for type_name, action in TIMELINE_EVENTS.items()}
+CONNECTION_PAGE = re.compile(r"(\w+)\(first: (\d+)")
+ITEM_TYPES = re.compile(r"itemTypes: \[([^\]]*)\]")
+REST_ROUTES = [
+    (re.compile(r"^/orgs/([^/]+)$"), "organisation"),
+    (re.compile(r"^/orgs/([^/]+)/repos$"), "organisation_repos"),
+    (re.compile(r"^/repos/([^/]+/[^/]+)$"), "repository"),
+    (re.compile(r"^/repos/([^/]+/[^/]+)/pulls$"), "pull_requests"),
+    (re.compile(r"^/repos/([^/]+/[^/]+)/pulls/(\d+)$"), "pull_request"),
+    (re.compile(r"^/repos/([^/]+/[^/]+)/pulls/(\d+)/reviews$"), "reviews"),
+    (re.compile(r"^/repos/([^/]+/[^/]+)/pulls/(\d+)/commits$"), "commits"),
+    (re.compile(r"^/repos/([^/]+/[^/]+)/issues/(\d+)/events$"), "events"),
+]
+
+
+class FakeGitHub:
+    """
+    A local stand-in for the parts of the GitHub REST and GraphQL APIs the collector uses, serving raw records
+    (as collector.py writes them) back in GitHub's own shapes. Every response waits latency seconds first. With a
+    rate_limit, responses carry GitHub's rate limit headers and a request over the limit in a rate_window gets a
+    403, just as a real token would; REST ("core") and GraphQL calls count against separate quotas, as on GitHub.
+    """
+
+    def __init__(self, pull_requests, latency: float = 0.0, rate_limit: int | None = None, rate_window: float = 3600.0,
+                 per_page: int = DEFAULT_PER_PAGE):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.per_page = per_page
+        self.lock = threading.Lock()
+        # resource -> [window start, requests used in the window]
+        self.quotas = {}
+        # statuses the next requests are answered with, as GitHub's secondary rate limit would; see throttle
+        self.throttled = []
+        self.retry_after = None
+        self.requests = 0
+        self.server = None
+        self.base_url = None
+        # (repo, state, sort, direction) -> pull requests in that order, sorted once on first request
+        self.listings = {}
+
+        # pull requests are kept newest first, the order the collector asks for them in
+        self.repositories = {}
+        self.pull_requests = {}
+        for pull_request in pull_requests:
+            repo = pull_request.get("repo")
+            self.repositories.setdefault(repo, []).append(pull_request)
+            self.pull_requests[(repo, pull_request["number"])] = pull_request
+        for listed in self.repositories.values():
+            listed.sort(key=lambda item: item["created_at"], reverse=True)
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.server = ThreadingHTTPServer((host, port), handler_for(self))
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def throttle(self, *statuses: int, retry_after: int | None = None):
+        """Answers the next requests with statuses (403 or 429), sending Retry-After when retry_after is given."""
+        with self.lock:
+            self.throttled.extend(statuses)
+            self.retry_after = retry_after
+
+    def take_throttle(self) -> int | None:
+        with self.lock:
+            return self.throttled.pop(0) if self.throttled else None
+
+    def take_request(self, resource: str = "core") -> tuple[bool, dict]:
+        """Counts a request against resource's rate limit; returns whether it is allowed and the headers to send."""
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return True, {}
+
+            now = time.time()
+            quota = self.quotas.setdefault(resource, [now, 0])
+            if now >= quota[0] + self.rate_window:
+                quota[:] = [now, 0]
+            allowed = quota[1] < self.rate_limit
+            if allowed:
+                quota[1] += 1
+            return allowed, {
+                "X-RateLimit-Limit": str(self.rate_limit),
+                "X-RateLimit-Remaining": str(self.rate_limit - quota[1]),
+                "X-RateLimit-Used": str(quota[1]),
+                "X-RateLimit-Reset": str(int(quota[0] + self.rate_window) + 1),
+                "X-RateLimit-Resource": resource,
+            }
+
+    def rest(self, path: str, query: dict) -> tuple[int, object, dict]:
+        for pattern, name in REST_ROUTES:
+            match = pattern.match(path)
+            if not match:
+                continue
+            if name == "organisation":
+                return 200, {"login": match.group(1), "url": f"{self.base_url}/orgs/{match.group(1)}"}, {}
+            if name == "organisation_repos":
+                repos = sorted(repo for repo in self.repositories if repo and repo.split("/")[0] == match.group(1))
+                return self.page(path, query, repos, self.repository_payload)
+
+            repo = match.group(1)
+            if repo not in self.repositories:
+                break
+            if name == "repository":
+                return 200, self.repository_payload(repo), {}
+            if name == "pull_requests":
+                return self.page(path, query, self.listing(repo, query), self.pull_request_payload)
+
+            pull_request = self.pull_requests.get((repo, int(match.group(2))))
+            if not pull_request:
+                break
+            if name == "pull_request":
+                return 200, self.pull_request_payload(pull_request, complete=True), {}
+            payload = {"reviews": review_payload, "commits": commit_payload, "events": event_payload}[name]
+            return self.page(path, query, pull_request[name], payload)
+        return 404, {"message": "Not Found"}, {}
+
+    def listing(self, repo: str, query: dict) -> list[dict]:
+        # GitHub's defaults: open pull requests, newest first when sorted by creation and oldest first otherwise
+        state = query.get("state", ["open"])[0]
+        sort = query.get("sort", ["created"])[0]
+        direction = query.get("direction", ["desc" if sort == "created" else "asc"])[0]
+        key = (repo, state, sort, direction)
+        if key not in self.listings:
+            listed = [
+                pull_request for pull_request in self.repositories[repo]
+                if state == "all" or pull_request["state"] == state
+            ]
+            listed.sort(key=updated_at if sort == "updated" else lambda item: item["created_at"],
+                        reverse=direction == "desc")
+            self.listings[key] = listed
+        return self.listings[key]
+
+    def page(self, path: str, query: dict, items: list, payload) -> tuple[int, list, dict]:
+        # only the requested page is converted, so listing thousands of pull requests stays linear
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", [str(self.per_page)])[0])
+        start = (page - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            following = {**{key: values[0] for key, values in query.items()}, "page": str(page + 1)}
+            parameters = "&".join(f"{key}={value}" for key, value in following.items())
+            headers["Link"] = f'<{self.base_url}{path}?{parameters}>; rel="next"'
+        return 200, [payload(item) for item in items[start:start + per_page]], headers
+
+    def repository_payload(self, repo: str) -> dict:
+        owner, name = repo.split("/")
+        return {
+            "id": int(hashlib.sha1(repo.encode()).hexdigest()[:8], 16),
+            "name": name,
+            "full_name": repo,
+            "owner": {"login": owner},
+            "url": f"{self.base_url}/repos/{repo}",
+            "archived": False,
+        }
+
+    def pull_request_payload(self, pull_request: dict, complete: bool = False) -> dict:
+        repo = pull_request.get("repo")
+        url = f"{self.base_url}/repos/{repo}/pulls/{pull_request['number']}"
+        payload = {
+            "url": url,
+            "issue_url": f"{self.base_url}/repos/{repo}/issues/{pull_request['number']}",
+            "number": pull_request["number"],
+            "title": pull_request["title"],
+            "user": {"login": pull_request["author"]},
+            "state": pull_request["state"],
+            "created_at": github_time(pull_request["created_at"]),
+            "updated_at": github_time(updated_at(pull_request)),
+            "closed_at": github_time(pull_request["closed_at"]),
+            "merged_at": github_time(pull_request["merged_at"]),
+            "draft": pull_request["draft"],
+            "assignees": [{"login": login} for login in pull_request["assignees"]],
+            "labels": [{"name": name} for name in pull_request["labels"]],
+            "base": {"repo": self.repository_payload(repo)},
+        }
+        # the list endpoint leaves these out, so the collector completes every pull request with a second request
+        if complete:
+            payload.update({
+                "additions": pull_request["additions"],
+                "deletions": pull_request["deletions"],
+                "changed_files": pull_request["changed_files"],
+                "comments": pull_request["comments"],
+                "merged": bool(pull_request["merged_at"]),
+            })
+        return payload
+
+    def graphql(self, body: dict) -> tuple[int, dict, dict]:
+        query = body["query"]
+        variables = body.get("variables") or {}
+        page_sizes = {name: int(size) for name, size in CONNECTION_PAGE.findall(query)}
+        # timeline items are filtered to the requested types, as GitHub does
+        item_types = ITEM_TYPES.search(query)
+        requested = set(item_types.group(1).split(", ")) if item_types else None
+        actions = {
+            action for type_name, action in TIMELINE_EVENTS.items() if _item_type(type_name) in requested
+        } if requested is not None else None
+        if "repository(" in query:
+            repo = f"{variables['owner']}/{variables['name']}"
+            listed = self.repositories.get(repo, [])
+            start = int(variables.get("cursor") or 0)
+            size = variables["pageSize"]
+            nodes = [self.graphql_node(pr, page_sizes, actions) for pr in listed[start:start + size]]
+            return 200, {"data": {"repository": {"pullRequests": {
+                "pageInfo": page_info(start + size, len(listed)),
+                "nodes": nodes,
+            }}}}, {}
+
+        repo, number = variables["id"].rsplit("#", 1)
+        pull_request = self.pull_requests[(repo or None, int(number))]
+        name, size = next(iter(page_sizes.items()))
+        return 200, {"data": {"node": {
+            name: connection(graphql_items(pull_request, name, actions), size, int(variables.get("cursor") or 0))
+        }}}, {}
+
+    def graphql_node(self, pull_request: dict, page_sizes: dict, actions: set[str] | None = None) -> dict:
+        node = {
+            "id": f"{pull_request.get('repo') or ''}#{pull_request['number']}",
+            "number": pull_request["number"],
+            "title": pull_request["title"],
+            "author": {"login": pull_request["author"]},
+            "createdAt": github_time(pull_request["created_at"]),
+            "mergedAt": github_time(pull_request["merged_at"]),
+            "closedAt": github_time(pull_request["closed_at"]),
+            "state": "MERGED" if pull_request["merged_at"] else pull_request["state"].upper(),
+            "isDraft": pull_request["draft"],
+            "additions": pull_request["additions"],
+            "deletions": pull_request["deletions"],
+            "changedFiles": pull_request["changed_files"],
+            "comments": {"totalCount": pull_request["comments"]},
+        }
+        for name, size in page_sizes.items():
+            if name != "pullRequests":
+                node[name] = connection(graphql_items(pull_request, name, actions), size)
+        return node
+
+
+def handler_for(fake: FakeGitHub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out in separate writes; without this each response waits on a delayed ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            self.respond(lambda: fake.rest(url.path, parse_qs(url.query)))
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            self.respond(lambda: fake.graphql(body))
+
+        def respond(self, build):
+            if fake.latency:
+                time.sleep(fake.latency)
+            allowed, headers = fake.take_request("graphql" if self.command == "POST" else "core")
+            throttled = fake.take_throttle()
+            if throttled:
+                status, payload = throttled, {"message": "You have exceeded a secondary rate limit"}
+                if fake.retry_after is not None:
+                    headers["Retry-After"] = str(fake.retry_after)
+            elif allowed:
+                status, payload, extra_headers = build()
+                headers.update(extra_headers)
+            else:
+                status, payload = 403, {"message": "API rate limit exceeded"}
+
+            body = json.dumps(payload).encode()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if status == 200 and self.command == "GET" and self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status in (200, 304):
+                self.send_header("ETag", etag)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def updated_at(pull_request: dict) -> str:
+    return pull_request["closed_at"] or pull_request["created_at"]
+
+
+def graphql_items(pull_request: dict, name: str, actions: set[str] | None = None) -> list[dict]:
+    if name == "assignees":
+        return [{"login": login} for login in pull_request["assignees"]]
+    if name == "labels":
+        return [{"name": label} for label in pull_request["labels"]]
+    if name == "reviews":
+        return [
+            {"author": {"login": review["user"]}, "submittedAt": github_time(review["submitted_at"]),
+             "state": review["state"]}
+            for review in pull_request["reviews"]
+        ]
+    if name == "commits":
+        return [
+            {"commit": {
+                "author": {"user": commit_user(commit), "date": github_time(commit["timestamp"])},
+                "committedDate": github_time(commit["timestamp"]),
+            }}
+            for commit in pull_request["commits"]
+        ]
+    return [
+        {
+            "__typename": TIMELINE_TYPES[event["action"]],
+            "actor": {"login": event["actor"]},
+            "createdAt": github_time(event["timestamp"]),
+            **({"label": {"name": event["label"]}} if event["label"] else {}),
+        }
+        for event in pull_request["events"]
+        if event["action"] in TIMELINE_TYPES and (actions is None or event["action"] in actions)
+    ]
+
+
+def connection(items: list, size: int, start: int = 0) -> dict:
+    return {"pageInfo": page_info(start + size, len(items)), "nodes": items[start:start + size]}
+
+
+def page_info(end: int, total: int) -> dict:
+    return {"hasNextPage": end < total, "endCursor": str(end)}
+
+
+def review_payload(review: dict) -> dict:
+    return {"user": {"login": review["user"]}, "submitted_at": github_time(review["submitted_at"]),
+            "state": review["state"]}
+
+
+def commit_payload(commit: dict) -> dict:
+    return {
+        "author": commit_user(commit),
+        "commit": {"author": {"name": commit["author"], "date": github_time(commit["timestamp"])}},
+    }
+
+
+def commit_user(commit: dict) -> dict | None:
+    # GitHub leaves the user out when a commit's email belongs to no account
+    return None if commit["author"] == UNKNOWN_USER else {"login": commit["author"]}
+
+
+def event_payload(event: dict) -> dict:
+    return {
+        "actor": {"login": event["actor"]},
+        "event": event["action"],
+        "created_at": github_time(event["timestamp"]),
+        "label": {"name": event["label"]} if event["label"] else None,
+    }
+
+
+def github_time(value: str) -> str | None:
+    # GitHub sends whole-second UTC times with a Z suffix
+    if not value:
+        return None
+    return datetime.fromisoformat(value).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int)
+    parser.add_argument('--rate-window', type=float, default=3600.0)
+    args = parser.parse_args()
+
+    fake = FakeGitHub(read_raw_data(args.input), args.latency_ms / 1000, args.rate_limit, args.rate_window)
+    print(f"Serving {len(fake.pull_requests)} pull requests at {fake.start(port=args.port)} "
+          f"(REST base URL, GraphQL at /graphql)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
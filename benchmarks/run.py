@@ -0,0 +1,256 @@
+﻿import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.synthetic_data import DEFAULT_REPO, generate_pull_requests, write_dataset
+from instrumentation import peak_rss_mb
+from markdown_writer import render_table
+
+STAGES = ["collect", "analyze", "report", "visualize"]
+DEFAULT_RESULTS = "data/benchmarks.jsonl"
+DEFAULT_PULL_REQUESTS = 10000
+DEFAULT_COLLECT_PULL_REQUESTS = 1000
+DEFAULT_WORKERS = 4
+DEFAULT_RATE_WINDOW = 60.0
+# The busiest synthetic team, whose report and charts are timed
+BENCHMARK_TEAM = "Team01"
+
+
+def main(pull_request_count: int = DEFAULT_PULL_REQUESTS, collect_count: int = DEFAULT_COLLECT_PULL_REQUESTS,
+         stages: list[str] = STAGES, engine: str = "rest", workers: int = DEFAULT_WORKERS, latency: float = 0.0,
+         rate_limit: int | None = None, rate_window: float = DEFAULT_RATE_WINDOW, seed: int = 0,
+         work_dir: str | None = None, results_file: str = DEFAULT_RESULTS, max_slowdown: float | None = None) -> bool:
+    """
+    Times each stage in a fresh process on synthetic data and appends the results to results_file. Returns False
+    when a stage is more than max_slowdown percent slower than the last run with the same settings.
+    """
+    settings = {
+        "pull_requests": pull_request_count, "collect_pull_requests": collect_count, "engine": engine,
+        "workers": workers, "latency": latency, "rate_limit": rate_limit, "rate_window": rate_window, "seed": seed,
+    }
+    work = Path(work_dir) if work_dir else Path(tempfile.mkdtemp(prefix="github-metrics-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    paths = {name: str(work / name) for name in ("raw.jsonl", "teams.yaml", "metrics.db", "report.md", "charts")}
+
+    try:
+        if any(stage != "collect" for stage in stages):
+            print(f"Generating {pull_request_count} synthetic pull requests in {work}")
+            write_dataset(paths["raw.jsonl"], paths["teams.yaml"], pull_request_count, seed)
+        if "analyze" not in stages and {"report", "visualize"} & set(stages):
+            # the later stages read the analyzer's output, which is built here without being timed
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                setup_analyze(paths, settings, None)()
+
+        results = {}
+        # spawned rather than forked, so each stage starts from a clean interpreter and its peak memory is its own
+        context = multiprocessing.get_context("spawn")
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            fake = None
+            if stage == "collect":
+                fake = FakeGitHub(generate_pull_requests(collect_count, seed), latency, rate_limit, rate_window)
+                fake.start()
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    results[stage] = executor.submit(
+                        run_stage, stage, paths, settings, fake.base_url if fake else None
+                    ).result()
+            finally:
+                if fake:
+                    fake.stop()
+                    results[stage]["requests"] = fake.requests
+            print(f"{stage}: {results[stage]['seconds']:.2f}s")
+    finally:
+        if not work_dir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    previous = previous_result(results_file, settings)
+    record = {
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "settings": settings,
+        "stages": results,
+    }
+    Path(results_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, "a") as file_stream:
+        file_stream.write(json.dumps(record) + "\n")
+
+    print(render_table(summary_rows(results, previous)))
+    print(f"Results appended to {results_file}")
+    return within_slowdown(results, previous, max_slowdown)
+
+
+def run_stage(stage: str, paths: dict, settings: dict, api_url: str | None) -> dict:
+    # the stages print progress per pull request, which would only add noise to the timings
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        setup = STAGE_SETUPS[stage](paths, settings, api_url)
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        records = setup()
+        seconds = time.perf_counter() - started
+    return {
+        "seconds": round(seconds, 3),
+        "records": records,
+        "records_per_second": round(records / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stage_rss_mb": round(peak_rss_mb() - baseline, 1),
+    }
+
+
+def setup_collect(paths: dict, settings: dict, api_url: str):
+    from collector import filter_pull_request_data
+    from github_session import RequestScheduler, connect
+    from graphql_collector import GraphQLClient, fetch_pull_request_data
+
+    start = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2100, 1, 1, tzinfo=timezone.utc)
+    workers = settings["workers"]
+    if settings["engine"] == "graphql":
+        client = GraphQLClient("", f"{api_url}/graphql", RequestScheduler())
+        return lambda: sum(1 for _ in fetch_pull_request_data(client, DEFAULT_REPO, end, start))
+
+    gh = connect(None, workers, RequestScheduler(), api_url)
+
+    def collect():
+        pulls = gh.get_repo(DEFAULT_REPO).get_pulls(state='all', sort='created', direction='desc')
+        return sum(1 for _ in filter_pull_request_data(pulls, end, start, workers))
+    return collect
+
+
+def setup_analyze(paths: dict, settings: dict, api_url: str | None):
+    import analyzer
+    from raw_data import read_raw_data
+
+    def analyze():
+        analyzer.main(read_raw_data(paths["raw.jsonl"]), analyzer.load_teams(paths["teams.yaml"]),
+                      output_file=paths["metrics.db"])
+        return settings["pull_requests"]
+    return analyze
+
+
+def setup_report(paths: dict, settings: dict, api_url: str | None):
+    import reporter
+
+    records = team_pull_requests(paths["metrics.db"])
+
+    def report():
+        reporter.main(paths["metrics.db"], paths["report.md"], BENCHMARK_TEAM)
+        return records
+    return report
+
+
+def setup_visualize(paths: dict, settings: dict, api_url: str | None):
+    import visualizer
+
+    # a fresh directory, so the chart cache never skips the drawing being timed
+    shutil.rmtree(paths["charts"], ignore_errors=True)
+    Path(paths["charts"]).mkdir(parents=True)
+    records = team_pull_requests(paths["metrics.db"])
+
+    def visualize():
+        visualizer.main(paths["metrics.db"], paths["charts"], BENCHMARK_TEAM)
+        return records
+    return visualize
+
+
+STAGE_SETUPS = {
+    "collect": setup_collect,
+    "analyze": setup_analyze,
+    "report": setup_report,
+    "visualize": setup_visualize,
+}
+
+
+def team_pull_requests(metrics_file: str) -> int:
+    with contextlib.closing(sqlite3.connect(metrics_file)) as connection:
+        return connection.execute(
+            "SELECT COUNT(*) FROM pull_requests WHERE team = ?", (BENCHMARK_TEAM,)
+        ).fetchone()[0]
+
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_result(results_file: str, settings: dict) -> dict | None:
+    if not os.path.exists(results_file):
+        return None
+    previous = None
+    with open(results_file) as file_stream:
+        for line in file_stream:
+            record = json.loads(line)
+            if record["settings"] == settings:
+                previous = record
+    return previous
+
+
+def summary_rows(results: dict, previous: dict | None) -> list[dict]:
+    rows = []
+    for stage, result in results.items():
+        before = (previous or {}).get("stages", {}).get(stage)
+        rows.append({
+            "Stage": stage,
+            "Seconds": f"{result['seconds']:.2f}",
+            "Pull Requests": result["records"],
+            "Pull Requests/s": result["records_per_second"],
+            "Peak RSS (MB)": result["peak_rss_mb"],
+            "Stage RSS (MB)": result["stage_rss_mb"],
+            "Change": f"{(result['seconds'] / before['seconds'] - 1) * 100:+.1f}%" if before else "",
+        })
+    return rows
+
+
+def within_slowdown(results: dict, previous: dict | None, max_slowdown: float | None) -> bool:
+    if max_slowdown is None or not previous:
+        return True
+    slower = [
+        stage for stage, result in results.items()
+        if stage in previous["stages"]
+        and result["seconds"] > previous["stages"][stage]["seconds"] * (1 + max_slowdown / 100)
+    ]
+    for stage in slower:
+        print(f"{stage} is more than {max_slowdown}% slower than the run at {previous['commit']}")
+    return not slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prs', type=int, default=DEFAULT_PULL_REQUESTS)
+    parser.add_argument('--collect-prs', type=int, default=DEFAULT_COLLECT_PULL_REQUESTS)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--engine', choices=["rest", "graphql"], default="rest")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int)
+    parser.add_argument('--rate-window', type=float, default=DEFAULT_RATE_WINDOW)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir')
+    parser.add_argument('--results', default=DEFAULT_RESULTS)
+    parser.add_argument('--max-slowdown', type=float)
+    args = parser.parse_args()
+
+    passed = main(
+        args.prs, args.collect_prs, args.stages, args.engine, args.workers, args.latency_ms / 1000, args.rate_limit,
+        args.rate_window, args.seed, args.work_dir, args.results, args.max_slowdown
+    )
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,185 @@
+﻿import argparse
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator
+
+import yaml
+
+from raw_data import RawDataWriter
+
+DEFAULT_REPO = "bench-org/bench-repo"
+DEFAULT_USERS = 40
+DEFAULT_TEAM_SIZE = 8
+DEFAULT_DAYS = 365
+LABELS = {"bug": 0.25, "feature": 0.35, "chore": 0.15, "dependencies": 0.1, "documentation": 0.05}
+# Share of pull requests opened as drafts, and of reviews asking for changes
+DRAFT_RATE = 0.2
+CHANGES_REQUESTED_RATE = 0.25
+COMMENT_REVIEW_RATE = 0.3
+DISMISSAL_RATE = 0.03
+HOUR = 3600
+
+
+def generate_pull_requests(count: int, seed: int = 0, repo: str = DEFAULT_REPO, users: int = DEFAULT_USERS,
+                           end: datetime | None = None, days: int = DEFAULT_DAYS) -> Iterator[dict]:
+    """
+    count merged pull requests in the collector's raw schema, roughly newest first as the collector writes them.
+    Authors follow a long-tailed distribution, work happens mostly in weekday office hours, sizes and waits are
+    log-normal, and a share of pull requests go through drafts, change requests and re-reviews. The same seed always
+    gives the same records.
+    """
+    rng = random.Random(seed)
+    end = end or datetime(2024, 12, 31, tzinfo=timezone.utc)
+    logins = user_logins(users)
+    # a few authors open most pull requests
+    author_weights = [1 / (rank + 1) ** 0.8 for rank in range(users)]
+    spacing = days * 86400 / max(count, 1)
+
+    for index in range(count):
+        created_at = working_time(rng, end - timedelta(seconds=(index + rng.random()) * spacing))
+        author = rng.choices(logins, author_weights)[0]
+        reviewers = [login for login in logins if login != author]
+        yield build_pull_request(rng, repo, count - index, author, reviewers, created_at)
+
+
+def build_pull_request(rng: random.Random, repo: str, number: int, author: str, reviewers: list[str],
+                       created_at: datetime) -> dict:
+    commit_count = 1 + min(int(rng.expovariate(1 / 3)), 60)
+    commit_times = [created_at - timedelta(hours=rng.lognormvariate(1.5, 1.2))]
+    for _ in range(commit_count - 1):
+        commit_times.append(commit_times[-1] + timedelta(hours=rng.lognormvariate(0.5, 1.0)))
+
+    events = []
+    ready_at = created_at
+    draft = rng.random() < DRAFT_RATE
+    if draft:
+        ready_at = max(commit_times[-1], created_at) + timedelta(hours=rng.lognormvariate(1.5, 1.0))
+        events.append(event(author, "ready_for_review", ready_at))
+
+    assignees = [author] if rng.random() < 0.5 else []
+    for assignee in assignees:
+        events.append(event(author, "assigned", created_at))
+    labels = [label for label, rate in LABELS.items() if rng.random() < rate]
+    for label in labels:
+        events.append(event(author, "labeled", created_at + timedelta(minutes=rng.uniform(0, 30)), label))
+
+    requested = rng.sample(reviewers, min(len(reviewers), rng.choice([1, 2, 2, 3])))
+    for reviewer in requested:
+        requested_at = ready_at + timedelta(minutes=rng.uniform(0, 10))
+        events.append(event(author, "review_requested", requested_at))
+        # GitHub records a subscription and usually a mention for everyone asked to review
+        events.append(event(reviewer, "subscribed", requested_at))
+        if rng.random() < 0.6:
+            events.append(event(reviewer, "mentioned", requested_at))
+
+    reviews = []
+    reviewed_at = ready_at
+    for round_number in range(4):
+        reviewed_at += timedelta(hours=rng.lognormvariate(1.2, 1.1))
+        changes_requested = False
+        for reviewer in requested:
+            reviewed_at += timedelta(minutes=rng.expovariate(1 / 45))
+            if rng.random() < COMMENT_REVIEW_RATE:
+                reviews.append(review(reviewer, "COMMENTED", reviewed_at))
+                reviewed_at += timedelta(minutes=rng.expovariate(1 / 30))
+            if round_number < 3 and rng.random() < CHANGES_REQUESTED_RATE:
+                reviews.append(review(reviewer, "CHANGES_REQUESTED", reviewed_at))
+                changes_requested = True
+            else:
+                reviews.append(review(reviewer, "APPROVED", reviewed_at))
+                if rng.random() < DISMISSAL_RATE:
+                    reviewed_at += timedelta(hours=rng.lognormvariate(0, 1))
+                    reviews.append(review(reviewer, "DISMISSED", reviewed_at))
+        if not changes_requested:
+            break
+        # the author pushes fixes before the next round
+        commit_times.append(reviewed_at + timedelta(hours=rng.lognormvariate(0.5, 0.8)))
+        reviewed_at = commit_times[-1]
+        if rng.random() < 0.5:
+            events.append(event(author, "head_ref_force_pushed", reviewed_at))
+
+    merged_at = max(reviewed_at, commit_times[-1]) + timedelta(hours=rng.lognormvariate(0, 1.2))
+    for action in ("merged", "closed", "head_ref_deleted"):
+        events.append(event(author, action, merged_at))
+    additions = int(rng.lognormvariate(3.5, 1.4))
+    return {
+        "repo": repo,
+        "number": number,
+        "title": f"Synthetic change {number}",
+        "author": author,
+        "created_at": created_at.isoformat(),
+        "merged_at": merged_at.isoformat(),
+        "closed_at": merged_at.isoformat(),
+        "state": "closed",
+        "assignees": assignees,
+        "labels": labels,
+        "draft": False,
+        "additions": additions,
+        "deletions": int(additions * rng.uniform(0, 0.8)),
+        "changed_files": 1 + int(math.sqrt(additions) * rng.uniform(0.2, 1)),
+        "comments": int(rng.expovariate(1 / 4)),
+        "reviews": reviews,
+        "events": sorted(events, key=lambda item: item["timestamp"]),
+        "commits": [{"author": author, "timestamp": time.isoformat()} for time in commit_times],
+    }
+
+
+def working_time(rng: random.Random, moment: datetime) -> datetime:
+    # most activity lands on weekdays between 09:00 and 18:00; the rest keeps its original time
+    if rng.random() < 0.15:
+        return moment
+    while moment.weekday() >= 5:
+        moment -= timedelta(days=1)
+    return moment.replace(hour=9, minute=0, second=0) + timedelta(seconds=rng.uniform(0, 9 * HOUR))
+
+
+def event(actor: str, action: str, timestamp: datetime, label: str = "") -> dict:
+    return {"actor": actor, "action": action, "timestamp": timestamp.isoformat(), "label": label}
+
+
+def review(user: str, state: str, submitted_at: datetime) -> dict:
+    return {"user": user, "submitted_at": submitted_at.isoformat(), "state": state}
+
+
+def user_logins(users: int) -> list[str]:
+    return [f"dev-{index:03d}" for index in range(users)]
+
+
+def build_teams(users: int, team_size: int = DEFAULT_TEAM_SIZE) -> dict[str, list[str]]:
+    logins = user_logins(users)
+    return {
+        f"Team{index // team_size + 1:02d}": logins[index:index + team_size]
+        for index in range(0, len(logins), team_size)
+    }
+
+
+def write_dataset(output_file: str, teams_file: str | None, count: int, seed: int = 0, repo: str = DEFAULT_REPO,
+                  users: int = DEFAULT_USERS, days: int = DEFAULT_DAYS) -> int:
+    # records are written as they are generated, so a million pull requests never sit in memory together
+    with RawDataWriter(output_file) as writer:
+        for pull_request in generate_pull_requests(count, seed, repo, users, days=days):
+            writer.write(pull_request)
+    if teams_file:
+        Path(teams_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(teams_file, "w") as file_stream:
+            yaml.safe_dump(build_teams(users), file_stream)
+    return writer.count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--teams-output')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repo', default=DEFAULT_REPO)
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    args = parser.parse_args()
+
+    written = write_dataset(
+        args.output, args.teams_output, args.count, args.seed, args.repo, args.users, args.days
+    )
+    print(f"{written} synthetic pull requests written to {args.output}")
@@ -0,0 +1,122 @@
+﻿from datetime import date, datetime, time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# Extra days indexed either side of the requested range, so nearby lookups reuse the same index
+INDEX_MARGIN_DAYS = 366
+# The int64 numpy reads as NaT
+NAT = np.iinfo(np.int64).min
+
+
+def _seconds(value: time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+class WorkingCalendar:
+    """
+    Working hours, weekends and holidays in one timezone.
+
+    Working time is looked up in a per-day index of cumulative working seconds, so the working time between
+    two moments is the difference of two lookups. The index grows to cover whatever range is asked for.
+    """
+
+    def __init__(self, timezone: str = "UTC", starttime: time = time(9, 0), endtime: time = time(17, 0),
+                 weekends: list[str] = ("Saturday", "Sunday"), holidays: list[date] = ()):
+        if starttime > endtime:
+            raise ValueError("Working hours that span midnight are not supported")
+
+        self.zone = ZoneInfo(timezone)
+        self.opens_at = _seconds(starttime)
+        self.closes_at = _seconds(endtime)
+        self.weekmask = [day not in weekends for day in DAY_NAMES]
+        self.holidays = np.array(sorted(holidays), dtype="datetime64[D]")
+        self.first_day = None
+        self.working_days = None
+        self.cumulative = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "WorkingCalendar":
+        opens, closes = config.get("working_hours", ["09:00", "17:00"])
+        return cls(
+            timezone=config.get("timezone", "UTC"),
+            starttime=time.fromisoformat(opens),
+            endtime=time.fromisoformat(closes),
+            weekends=config.get("weekends", ["Saturday", "Sunday"]),
+            holidays=[date.fromisoformat(str(holiday)) for holiday in config.get("holidays", [])],
+        )
+
+    def settings(self) -> dict:
+        return {
+            "timezone": self.zone.key,
+            "working_hours": [self.opens_at, self.closes_at],
+            "weekmask": self.weekmask,
+            "holidays": [str(holiday) for holiday in self.holidays],
+        }
+
+    def to_local(self, values: list[int | None]) -> np.ndarray:
+        # Local wall-clock time of epoch microseconds, truncated to whole seconds; None becomes NaT
+        utc = np.array([NAT if value is None else value for value in values], dtype=np.int64) \
+            .view("datetime64[us]").astype("datetime64[s]")
+        if self.zone.key == "UTC":
+            return utc
+        valid = ~np.isnat(utc)
+        seconds = utc[valid].astype(np.int64)
+        local = utc.copy()
+        local[valid] = (seconds + self.utc_offsets(seconds)).astype("datetime64[s]")
+        return local
+
+    def utc_offsets(self, seconds: np.ndarray) -> np.ndarray:
+        # Offsets are looked up once per distinct hour; only an hour holding a transition is looked up per moment
+        hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+        at_start = np.array([self.offset_at(hour * 3600) for hour in hours.tolist()], dtype=np.int64)
+        at_end = np.array([self.offset_at(hour * 3600 + 3599) for hour in hours.tolist()], dtype=np.int64)
+        offsets = at_start[inverse]
+        for position in np.flatnonzero((at_start != at_end)[inverse]):
+            offsets[position] = self.offset_at(int(seconds[position]))
+        return offsets
+
+    def offset_at(self, seconds: int) -> int:
+        return int(datetime.fromtimestamp(seconds, self.zone).utcoffset().total_seconds())
+
+    def index(self, first_day: np.datetime64, last_day: np.datetime64):
+        if self.first_day is not None and first_day >= self.first_day and \
+                last_day < self.first_day + len(self.working_days):
+            return
+
+        if self.first_day is not None:
+            first_day = min(first_day, self.first_day)
+            last_day = max(last_day, self.first_day + len(self.working_days) - 1)
+        first_day -= INDEX_MARGIN_DAYS
+        last_day += INDEX_MARGIN_DAYS
+
+        days = np.arange(first_day, last_day + 1, dtype="datetime64[D]")
+        self.first_day = first_day
+        self.working_days = np.is_busday(days, weekmask=self.weekmask, holidays=self.holidays)
+        # cumulative[i] is the working time before day i starts
+        self.cumulative = np.concatenate(
+            ([0], np.cumsum(self.working_days * (self.closes_at - self.opens_at)))
+        ).astype(np.int64)
+
+    def working_seconds_before(self, moments: np.ndarray) -> np.ndarray:
+        days = moments.astype("datetime64[D]")
+        offsets = (days - self.first_day).astype(np.int64)
+        within_day = np.clip((moments - days).astype(np.int64), self.opens_at, self.closes_at) - self.opens_at
+        return self.cumulative[offsets] + np.where(self.working_days[offsets], within_day, 0)
+
+    def hours_between(self, starts: list[int | None], ends: list[int | None]) -> np.ndarray:
+        """Working hours between each start/end pair; NaN where either is missing or the end comes first."""
+        starts = self.to_local(starts)
+        ends = self.to_local(ends)
+        invalid = np.isnat(starts) | np.isnat(ends) | (starts > ends)
+        if invalid.all():
+            return np.full(len(starts), np.nan)
+
+        # park invalid pairs on a valid moment so the index range and lookups stay in bounds
+        starts = np.where(invalid, starts[~invalid][0], starts)
+        ends = np.where(invalid, starts, ends)
+        self.index(starts.min().astype("datetime64[D]"), ends.max().astype("datetime64[D]"))
+
+        seconds = self.working_seconds_before(ends) - self.working_seconds_before(starts)
+        return np.where(invalid, np.nan, seconds / 60 / 60)
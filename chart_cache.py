@@ -0,0 +1,57 @@
+﻿import hashlib
+import json
+import os
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+
+from instrumentation import Timer, count
+
+CACHE_FILE = ".chart_cache.json"
+
+
+class ChartCache:
+    """
+    Fingerprints of the data and parameters each chart in a directory was drawn from. A chart is only redrawn when
+    its fingerprint changes or its PNG is missing, so charts of closed periods are drawn once.
+    """
+
+    def __init__(self, output_dir: str, version: int = 1):
+        self.output_dir = Path(output_dir)
+        self.version = version
+        self.path = self.output_dir / CACHE_FILE
+        self.fingerprints = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.drawn = 0
+        self.unchanged = 0
+
+    def render(self, file_name: str, data, draw, figsize: tuple[int, int], **parameters) -> Path:
+        chart = self.output_dir / file_name
+        fingerprint = self.fingerprint(file_name, data, figsize, parameters)
+        if chart.exists() and self.fingerprints.get(file_name) == fingerprint:
+            self.unchanged += 1
+            count("charts_unchanged")
+            return chart
+
+        with Timer(f"chart {file_name}"):
+            figure = plt.figure(figsize=figsize)
+            try:
+                draw(data, **parameters)
+                figure.savefig(chart)
+            finally:
+                # every figure is closed, drawn or not, so memory stays flat across hundreds of charts
+                plt.close(figure)
+
+        self.fingerprints[file_name] = fingerprint
+        self.save()
+        self.drawn += 1
+        count("charts_drawn")
+        return chart
+
+    def fingerprint(self, file_name: str, data, figsize: tuple[int, int], parameters: dict) -> str:
+        content = json.dumps([self.version, file_name, data, figsize, parameters], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def save(self):
+        building = self.path.with_suffix(".tmp")
+        building.write_text(json.dumps(self.fingerprints, indent=2, sort_keys=True))
+        os.replace(building, self.path)
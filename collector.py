@@ -1,17 +1,31 @@
 ﻿import argparse
-import json
 import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timezone, date
-from pathlib import Path
+from fnmatch import fnmatch
+from queue import Queue
+from typing import Collection, Iterator
 
-from github import Github
+from github import Consts, Github
 from github.PaginatedList import PaginatedList
 from github.PullRequest import PullRequest
+from github.Repository import Repository
+
+from event_index import ANALYZED_EVENTS
+from github_session import DEFAULT_HTTP_CACHE, RequestScheduler, ResponseCache, connect
+from graphql_collector import GraphQLClient, GRAPHQL_URL, PAGE_SIZE, fetch_pull_request_data
+from instrumentation import add_arguments, count, instrumented, timed
+from pr_cache import DEFAULT_CACHE, PullRequestCache
+from raw_data import DEFAULT_RAW_DIR, DEFAULT_RAW_FILE, NO_LABEL, NO_TIME, UNKNOWN_USER, RawDataWriter
 
 READY_FOR_REVIEW = "ready_for_review"
-UNKNOWN_USER = "unknown"
-NO_TIME = ''
-NO_LABEL = ''
+DEFAULT_WORKERS = 4
+DEFAULT_REPO_CONCURRENCY = 4
+ENGINES = ("rest", "graphql")
+# --events choices: every issue event, or only the types the analyzer reads
+EVENT_SETS = {"all": None, "analyzed": ANALYZED_EVENTS}
 
 
 def extract_events(pr: PullRequest) -> list[dict]:
@@ -47,42 +61,215 @@ def extract_reviews(pr: PullRequest) -> list[dict]:
     return reviews
 
 
-def main(repo_name: str, start: date, end: date):
-    gh = Github(os.getenv('GITHUB_TOKEN'))
-    repo = gh.get_repo(repo_name)
+def main(repo_names: list[str] | None, start: date, end: date, workers: int = DEFAULT_WORKERS, engine: str = "rest",
+         graphql_url: str = GRAPHQL_URL, page_size: int = PAGE_SIZE, cache_path: str | None = None,
+         api_url: str = Consts.DEFAULT_BASE_URL, http_cache_path: str | None = None,
+         output_file: str | None = DEFAULT_RAW_FILE, resume: bool = False, output_dir: str | None = None,
+         organisation: str | None = None, include: list[str] = (), exclude: list[str] = (),
+         repo_concurrency: int = DEFAULT_REPO_CONCURRENCY, records: Queue | None = None,
+         event_types: Collection[str] | None = None):
+    # One scheduler, session and detail pool are shared by every repository, so --workers caps
+    # concurrent requests across the whole run.
+    # Each pull request is written to the raw file and/or put on records as soon as it is fetched; with neither
+    # output_file nor output_dir nothing is written to disk. event_types, when given, are the only events kept.
+    scheduler = RequestScheduler(ResponseCache(http_cache_path) if http_cache_path else None)
+    gh = connect(os.getenv('GITHUB_TOKEN'), workers + repo_concurrency, scheduler, api_url)
+    client = GraphQLClient(os.getenv('GITHUB_TOKEN'), graphql_url, scheduler) if engine == "graphql" else None
+    cache = PullRequestCache(cache_path) if cache_path else None
+
+    if organisation:
+        repo_names = list_organisation_repos(gh, organisation, include, exclude)
+        print(f"Found {len(repo_names)} repositories in {organisation}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=repo_concurrency) as repo_executor:
+        collections = [
+            repo_executor.submit(
+                collect_repository, gh, client, repo_name, start, end, workers, executor, cache, page_size,
+                partition_file(output_dir, repo_name) if output_dir else output_file, resume, records, event_types
+            )
+            for repo_name in repo_names
+        ]
+        total = sum(collection.result() for collection in collections)
+
+    if cache:
+        cache.close()
+    print(f"Total {total} PRs fetched from {len(repo_names)} repositories")
 
-    print(f"Fetching pull requests for {repo_name}...")
-    pulls = repo.get_pulls(state='all', sort='created', direction='desc')
 
-    data = filter_pull_request_data(pulls, end, start)
-    print(f"Total {len(data)} PRs fetched")
+def collect_repository(gh: Github, client: GraphQLClient | None, repo_name: str, start: date, end: date,
+                       workers: int, executor: ThreadPoolExecutor, cache: PullRequestCache | None, page_size: int,
+                       output_file: str | None, resume: bool, records: Queue | None = None,
+                       event_types: Collection[str] | None = None) -> int:
+    with RawDataWriter(output_file, resume) if output_file else nullcontext() as writer:
+        processed = writer.processed if writer else set()
+        if processed:
+            print(f"Resuming with {len(processed)} PRs already in {output_file}")
 
-    Path("data").mkdir(exist_ok=True)
-    with open('data/raw.json', 'w') as file_stream:
-        json.dump(data, file_stream, indent=2)
+        print(f"Fetching pull requests for {repo_name}...")
+        if client:
+            data = fetch_pull_request_data(client, repo_name, end, start, page_size, processed, event_types)
+        else:
+            repo = gh.get_repo(repo_name)
+            if cache:
+                data = collect_with_cache(repo, repo_name, start, end, workers, cache, processed, executor)
+            else:
+                pulls = repo.get_pulls(state='all', sort='created', direction='desc')
+                data = filter_pull_request_data(pulls, end, start, workers, skip=processed, executor=executor)
 
-    print("Raw Data written to data/raw.json")
+        fetched = len(processed)
+        for pull_request_data in data:
+            if event_types is not None:
+                # REST returns every event regardless, and the cache keeps them all, so they are dropped here
+                pull_request_data = keep_events(pull_request_data, event_types)
+            if writer:
+                writer.write(pull_request_data)
+            if records is not None:
+                records.put(pull_request_data)
+            fetched += 1
 
+    count("pull_requests_fetched", fetched - len(processed))
+    print(f"{repo_name}: {fetched} PRs fetched" + (f" and written to {output_file}" if output_file else ""))
+    return fetched
 
-def filter_pull_request_data(pulls: PaginatedList[PullRequest], end: date, start: date) -> list[dict]:
-    data = []
-    for pr in pulls:
-        if not pr.merged_at or pr.merged_at > end:
+
+def keep_events(pull_request_data: dict, event_types: Collection[str]) -> dict:
+    events = [event for event in pull_request_data["events"] if event["action"] in event_types]
+    return {**pull_request_data, "events": events}
+
+
+def list_organisation_repos(gh: Github, organisation: str, include: list[str], exclude: list[str]) -> list[str]:
+    repo_names = []
+    for repo in gh.get_organization(organisation).get_repos(type='all'):
+        if repo.archived:
+            continue
+        if include and not any(fnmatch(repo.name, pattern) for pattern in include):
             continue
+        if any(fnmatch(repo.name, pattern) for pattern in exclude):
+            continue
+        repo_names.append(repo.full_name)
+    return repo_names
+
+
+def partition_file(output_dir: str, repo_name: str) -> str:
+    return os.path.join(output_dir, repo_name.replace("/", "__") + ".jsonl")
+
+
+def read_repo_names(values: list[str]) -> list[str]:
+    # --repos takes repository names, or files listing one repository per line
+    repo_names = []
+    for value in values:
+        if os.path.isfile(value):
+            with open(value) as file_stream:
+                repo_names.extend(line.strip() for line in file_stream if line.strip() and not line.startswith("#"))
+        else:
+            repo_names.append(value)
+    return repo_names
+
+
+def collect_with_cache(repo: Repository, repo_name: str, start: date, end: date, workers: int,
+                       cache: PullRequestCache, skip: set[int] = frozenset(),
+                       executor: ThreadPoolExecutor | None = None) -> Iterator[dict]:
+    synced_at = datetime.now(timezone.utc)
+    last_sync = cache.last_sync(repo_name)
+    if last_sync:
+        last_synced_at, covered_from, covered_to = last_sync
+        # Every PR merged after the last sync has been updated since, so a sync extends the covered
+        # window up to now as long as that window already reached the last sync.
+        continuous = covered_to >= last_synced_at
+        if covered_from <= start and (end <= covered_to or continuous):
+            print(f"Syncing pull requests updated since {last_synced_at}...")
+            pulls = repo.get_pulls(state='closed', sort='updated', direction='desc')
+            sync_pull_request_data(pulls, last_synced_at, workers, cache, repo_name, executor)
+            cache.mark_synced(repo_name, synced_at, covered_from, max(covered_to, synced_at) if continuous else covered_to)
+            yield from (record for record in cache.records(repo_name, start, end) if record["number"] not in skip)
+            return
+
+    pulls = repo.get_pulls(state='all', sort='created', direction='desc')
+    yield from filter_pull_request_data(pulls, end, start, workers, cache, repo_name, skip, executor)
+    cache.mark_synced(repo_name, synced_at, start, end)
+
+
+def sync_pull_request_data(pulls: PaginatedList[PullRequest], since: datetime, workers: int,
+                           cache: PullRequestCache, repo_name: str, executor: ThreadPoolExecutor | None = None):
+    with nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for pr in pulls:
+            if pr.updated_at < since:
+                print(f"Exiting at PR #{pr.number} (updated at {pr.updated_at})")
+                break
+
+            if not pr.merged_at or cache.get(repo_name, pr.number, pr.updated_at):
+                continue
+
+            print(f"Updating PR #{pr.number} (updated at {pr.updated_at})")
+            in_flight.append((pr, None, executor.submit(build_pull_request_data, pr)))
+
+            if len(in_flight) >= workers * 2:
+                resolve_pull_request_data(*in_flight.popleft(), cache, repo_name)
+
+        for entry in in_flight:
+            resolve_pull_request_data(*entry, cache, repo_name)
+
+
+def filter_pull_request_data(pulls: PaginatedList[PullRequest], end: date, start: date,
+                             workers: int = DEFAULT_WORKERS, cache: PullRequestCache | None = None,
+                             repo_name: str | None = None, skip: set[int] = frozenset(),
+                             executor: ThreadPoolExecutor | None = None) -> Iterator[dict]:
+    with nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=workers) as executor:
+        # Detail fetches run ahead of the listing by at most two per worker, and results are
+        # collected in submission order so the output matches the serial walk.
+        in_flight = deque()
+        for pr in pulls:
+            if not pr.merged_at or pr.merged_at > end:
+                continue
 
-        if pr.merged_at < start:
-            print(f"Exiting at PR #{pr.number} (merged at {pr.created_at})")
-            break
+            if pr.merged_at < start:
+                print(f"Exiting at PR #{pr.number} (merged at {pr.created_at})")
+                break
 
-        print(f"Processing PR #{pr.number} (merged at {pr.created_at})")
-        pull_request_data = build_pull_request_data(pr)
+            skipped = pr.number in skip
+            if skipped and not cache:
+                continue
 
-        data.append(pull_request_data)
-    return data
+            # with a cache, skipped PRs are still fetched into it, as the window is marked synced afterwards
+            cached = cache.get(repo_name, pr.number, pr.updated_at) if cache else None
+            if cached:
+                print(f"Using cached PR #{pr.number} (merged at {pr.created_at})")
+                in_flight.append((pr, cached, None, skipped))
+            else:
+                print(f"Processing PR #{pr.number} (merged at {pr.created_at})")
+                in_flight.append((pr, None, executor.submit(build_pull_request_data, pr), skipped))
+
+            if len(in_flight) >= workers * 2:
+                yield from resolved(in_flight.popleft(), cache, repo_name)
+
+        for entry in in_flight:
+            yield from resolved(entry, cache, repo_name)
+
+
+def resolved(entry: tuple, cache: PullRequestCache | None, repo_name: str | None) -> Iterator[dict]:
+    pr, cached, future, skipped = entry
+    pull_request_data = resolve_pull_request_data(pr, cached, future, cache, repo_name)
+    if not skipped:
+        yield pull_request_data
+
+
+def resolve_pull_request_data(pr: PullRequest, cached: dict | None, future: Future | None,
+                              cache: PullRequestCache | None, repo_name: str | None) -> dict:
+    if cached:
+        return cached
+
+    pull_request_data = future.result()
+    if cache:
+        cache.put(repo_name, pull_request_data, pr.updated_at)
+    return pull_request_data
 
 
+@timed()
 def build_pull_request_data(pr: PullRequest) -> dict[str, any]:
     pull_request_data = {
+        "repo": pr.base.repo.full_name,
         "number": pr.number,
         "title": pr.title,
         "author": pr.user.login,
@@ -106,13 +293,49 @@ def build_pull_request_data(pr: PullRequest) -> dict[str, any]:
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--repo', required=True)
+    repositories = parser.add_mutually_exclusive_group(required=True)
+    repositories.add_argument('--repo')
+    repositories.add_argument('--repos', nargs='+')
+    repositories.add_argument('--org')
+    parser.add_argument('--include', nargs='*', default=[])
+    parser.add_argument('--exclude', nargs='*', default=[])
     parser.add_argument('--start', required=True)
     parser.add_argument('--end', required=True)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--repo-concurrency', type=int, default=DEFAULT_REPO_CONCURRENCY)
+    parser.add_argument('--engine', choices=ENGINES, default="rest")
+    parser.add_argument('--graphql-url', default=GRAPHQL_URL)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE)
+    parser.add_argument('--api-url', default=Consts.DEFAULT_BASE_URL)
+    parser.add_argument('--http-cache', nargs='?', const=DEFAULT_HTTP_CACHE)
+    parser.add_argument('--output', default=DEFAULT_RAW_FILE)
+    parser.add_argument('--output-dir', default=DEFAULT_RAW_DIR)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--events', choices=EVENT_SETS, default="all",
+                        help="Keep every issue event, or only those the analyzer uses")
+    add_arguments(parser, "collector")
     args = parser.parse_args()
 
-    main(
-        args.repo,
-        datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc),
-        datetime.fromisoformat(args.end).replace(tzinfo=timezone.utc)
-    )
+    with instrumented("collector", args.instrument, args.profile):
+        main(
+            [args.repo] if args.repo else read_repo_names(args.repos) if args.repos else None,
+            datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc),
+            datetime.fromisoformat(args.end).replace(tzinfo=timezone.utc),
+            args.workers,
+            args.engine,
+            args.graphql_url,
+            args.page_size,
+            args.cache,
+            args.api_url,
+            args.http_cache,
+            args.output,
+            args.resume,
+            None if args.repo else args.output_dir,
+            args.org,
+            args.include,
+            args.exclude,
+            args.repo_concurrency,
+            None,
+            EVENT_SETS[args.events],
+        )
@@ -0,0 +1,200 @@
+﻿import argparse
+import json
+from pathlib import Path
+
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+
+from instrumentation import add_arguments, instrumented, timed
+from metrics_db import load_all_team_metrics
+
+DEFAULT_DASHBOARD = "data/dashboard.html"
+GRANULARITIES = {
+    "per_day": "Day",
+    "per_week": "Week",
+    "per_iso_week": "ISO week",
+    "per_month": "Month",
+}
+AVERAGED_DURATIONS = {
+    "first_commit_to_production": "First commit to production",
+    "code_complete_to_production": "Code complete to production",
+    "feedback_delay": "Feedback delay",
+    "code_review_duration": "Code review",
+    "active_development_duration": "Active development",
+    "time_to_first_approval": "Time to first approval",
+}
+PERCENTILE_DURATIONS = {
+    "first_commit_to_production": "First commit to production",
+    "feedback_delay": "Feedback delay",
+    "code_review_duration": "Code review",
+}
+CHART_PERCENTILES = ["p50", "p90"]
+# Reviewers shown per team, busiest first
+TOP_REVIEWERS = 20
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>PR Metrics</title>
+<script>__PLOTLY__</script>
+<style>
+  body { font-family: sans-serif; margin: 1em 2em; }
+  label { margin-right: 1.5em; }
+  .chart { height: 380px; }
+</style>
+</head>
+<body>
+<h1>PR Metrics</h1>
+<div>
+  <label>Team <select id="team"></select></label>
+  <label>Granularity <select id="granularity"></select></label>
+</div>
+<div id="count" class="chart"></div>
+<div id="averages" class="chart"></div>
+<div id="percentiles" class="chart"></div>
+<div id="reviewers" class="chart"></div>
+<script>
+const DATA = __DATA__;
+const LAYOUTS = __LAYOUTS__;
+const teamSelect = document.getElementById("team");
+const granularitySelect = document.getElementById("granularity");
+
+function fill(select, options) {
+  for (const [value, label] of options) {
+    const option = document.createElement("option");
+    option.value = value;
+    option.textContent = label;
+    select.appendChild(option);
+  }
+}
+
+function lines(series, names, field) {
+  return Object.entries(names).map(([metric, name]) => ({
+    type: "scatter", mode: "lines", name: name, x: series.buckets, y: series[metric] && field(series[metric])
+  }));
+}
+
+function draw() {
+  const series = DATA.teams[teamSelect.value][granularitySelect.value];
+  Plotly.react("count", [{type: "bar", name: "Pull requests", x: series.buckets, y: series.count}], LAYOUTS.count);
+  Plotly.react("averages", lines(series.averages, DATA.averaged, values => values), LAYOUTS.averages);
+  const percentiles = [];
+  for (const percentile of DATA.chart_percentiles) {
+    for (const trace of lines(series.percentiles, DATA.percentile_metrics, values => values[percentile])) {
+      trace.name = trace.name + " " + percentile;
+      percentiles.push(trace);
+    }
+  }
+  Plotly.react("percentiles", percentiles, LAYOUTS.percentiles);
+  const reviewers = DATA.reviewers[teamSelect.value];
+  Plotly.react("reviewers", [
+    {type: "bar", name: "Reviews", x: reviewers.reviewers, y: reviewers.reviews},
+    {type: "bar", name: "Pull requests reviewed", x: reviewers.reviewers, y: reviewers.pull_requests},
+  ], LAYOUTS.reviewers);
+}
+
+fill(teamSelect, Object.keys(DATA.teams).map(team => [team, team]));
+fill(granularitySelect, Object.entries(DATA.granularities));
+granularitySelect.value = "per_week";
+teamSelect.addEventListener("change", draw);
+granularitySelect.addEventListener("change", draw);
+draw();
+</script>
+</body>
+</html>
+"""
+
+
+def main(metrics_file: str, output_file: str):
+    write_dashboard(output_file, load_all_team_metrics(metrics_file, [*GRANULARITIES, "reviewer_load"]))
+
+
+def write_dashboard(output_file: str, all_team_metrics: dict):
+    html = build_dashboard(all_team_metrics)
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, "w") as file_stream:
+        file_stream.write(html)
+    print(f"Dashboard for {len(all_team_metrics)} teams written to {output_file}")
+
+
+@timed()
+def build_dashboard(all_team_metrics: dict) -> str:
+    data = {
+        "granularities": GRANULARITIES,
+        "averaged": AVERAGED_DURATIONS,
+        "percentile_metrics": PERCENTILE_DURATIONS,
+        "chart_percentiles": CHART_PERCENTILES,
+        "teams": {
+            team: {
+                granularity: build_series(team_metrics.get(granularity, {}))
+                for granularity in GRANULARITIES
+            }
+            for team, team_metrics in sorted(all_team_metrics.items())
+        },
+        "reviewers": {
+            team: build_reviewer_series(team_metrics.get("reviewer_load", {}))
+            for team, team_metrics in sorted(all_team_metrics.items())
+        },
+    }
+    layouts = {
+        "count": chart_layout("Pull requests merged", "Pull requests"),
+        "averages": chart_layout("Average cycle times", "Working hours"),
+        "percentiles": chart_layout("Cycle time percentiles", "Working hours"),
+        "reviewers": chart_layout(f"Reviewer load (top {TOP_REVIEWERS})", "Reviews"),
+    }
+    # plotly.js goes in last, so its source is never searched for the other placeholders
+    return PAGE.replace("__LAYOUTS__", to_script_json(layouts)) \
+        .replace("__DATA__", to_script_json(data)) \
+        .replace("__PLOTLY__", get_plotlyjs())
+
+
+def build_series(buckets: dict) -> dict:
+    """One bucket period as parallel arrays in bucket order, holding only what the dashboard draws."""
+    keys = sorted(buckets)
+    return {
+        "buckets": keys,
+        "count": [buckets[key]["count"] for key in keys],
+        "averages": {
+            metric: [buckets[key]["averages"][metric] for key in keys] for metric in AVERAGED_DURATIONS
+        },
+        "percentiles": {
+            metric: {
+                percentile: [buckets[key]["percentiles"][metric][percentile] for key in keys]
+                for percentile in CHART_PERCENTILES
+            }
+            for metric in PERCENTILE_DURATIONS
+        },
+    }
+
+
+def build_reviewer_series(reviewer_load: dict) -> dict:
+    """The busiest reviewers, in the analyzer's order of most reviews first, as parallel arrays."""
+    reviewers = list(reviewer_load)[:TOP_REVIEWERS]
+    return {
+        "reviewers": reviewers,
+        "reviews": [reviewer_load[reviewer]["reviews"] for reviewer in reviewers],
+        "pull_requests": [reviewer_load[reviewer]["pull_requests"] for reviewer in reviewers],
+    }
+
+
+def chart_layout(title: str, y_title: str) -> dict:
+    return go.Layout(
+        title=title, yaxis_title=y_title, margin={"t": 50, "b": 40}, legend={"orientation": "h"}
+    ).to_plotly_json()
+
+
+def to_script_json(value) -> str:
+    # a "</" inside the data would end the script element early
+    return json.dumps(value, separators=(",", ":")).replace("</", "<\\/")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--output', default=DEFAULT_DASHBOARD)
+    add_arguments(parser, "dashboard")
+    args = parser.parse_args()
+
+    with instrumented("dashboard", args.instrument, args.profile):
+        main(args.input, args.output)
@@ -0,0 +1,79 @@
+﻿READY_FOR_REVIEW = "ready_for_review"
+CONVERT_TO_DRAFT = "convert_to_draft"
+REVIEW_REQUESTED = "review_requested"
+LABELED = "labeled"
+UNLABELED = "unlabeled"
+LABEL_EVENTS = (LABELED, UNLABELED)
+# The issue event types the analyzer reads; collecting with --events analyzed keeps only these
+ANALYZED_EVENTS = (READY_FOR_REVIEW, CONVERT_TO_DRAFT, REVIEW_REQUESTED, LABELED, UNLABELED)
+
+
+def index_events(events) -> dict:
+    """
+    One pass over a pull request's (action, label, timestamp) events, giving the ordered timestamps of each analysed
+    event type. Label events are keyed by (action, label), so each label's history can be followed on its own.
+    """
+    index = {}
+    for action, label, timestamp in events:
+        if action in LABEL_EVENTS:
+            key = (action, label)
+        elif action in ANALYZED_EVENTS:
+            key = action
+        else:
+            continue
+        index.setdefault(key, []).append(timestamp)
+    # events normally arrive in order already, which makes these sorts a linear check
+    for timestamps in index.values():
+        timestamps.sort()
+    return index
+
+
+def intervals(switched_on: list[int], switched_off: list[int], on_since: int | None = None,
+              until: int | None = None) -> list[tuple[int, int]]:
+    """
+    The (start, end) periods a state held, switched on and off at the given times. on_since starts it already on;
+    until closes a period still open at the end, which is otherwise dropped.
+    """
+    # at equal times the switch off comes first, so an off/on pair at one moment leaves no gap
+    changes = sorted([(moment, True) for moment in switched_on] + [(moment, False) for moment in switched_off])
+    periods = []
+    started_at = on_since
+    for moment, on in changes:
+        if on and started_at is None:
+            started_at = moment
+        elif not on and started_at is not None:
+            periods.append((started_at, moment))
+            started_at = None
+    if started_at is not None and until is not None and until >= started_at:
+        periods.append((started_at, until))
+    return periods
+
+
+def event_timings(pull_request, ended_at: int | None) -> dict:
+    """
+    Draft, review request and label timings from a PullRequestRecord's events, as epoch microseconds:
+        - ready_for_review_at: created_at, or the first ready_for_review when the pull request was opened as a draft
+        - draft_intervals: every period spent as a draft
+        - review_requested_at: the first review request
+        - label_intervals: per label, every period it was applied, up to ended_at for labels never removed
+    """
+    index = index_events(pull_request.events())
+    created_at = pull_request.created_at
+    ready = index.get(READY_FOR_REVIEW, [])
+    drafted = index.get(CONVERT_TO_DRAFT, [])
+    if ready or drafted:
+        # a pull request whose first draft change is becoming ready was opened as a draft
+        opened_as_draft = bool(ready) and (not drafted or ready[0] <= drafted[0])
+    else:
+        opened_as_draft = pull_request.draft
+
+    labels = {key[1] for key in index if isinstance(key, tuple)}
+    return {
+        "ready_for_review_at": ready[0] if opened_as_draft and ready else created_at,
+        "draft_intervals": intervals(drafted, ready, created_at if opened_as_draft else None, ended_at),
+        "review_requested_at": index[REVIEW_REQUESTED][0] if REVIEW_REQUESTED in index else None,
+        "label_intervals": {
+            label: intervals(index.get((LABELED, label), []), index.get((UNLABELED, label), []), until=ended_at)
+            for label in sorted(labels)
+        },
+    }
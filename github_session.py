@@ -0,0 +1,276 @@
+﻿import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from github import Consts, Github
+from github.Requester import Requester, RequestsResponse
+
+from instrumentation import Timer, count
+
+DEFAULT_HTTP_CACHE = "data/http_cache.sqlite"
+MAX_RETRIES = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# Calls are only spaced out once less than this share of the quota is left
+PACING_THRESHOLD = 0.2
+# Request headers that change the response body, so each combination is cached separately
+VARIANT_HEADERS = ("Accept", "Authorization")
+# URL path segments replaced by placeholders, so API timings group by endpoint rather than by pull request
+ENDPOINT_PATTERNS = [
+    (re.compile(r"/repos/[^/]+/[^/]+"), "/repos/{owner}/{repo}"),
+    (re.compile(r"/orgs/[^/]+"), "/orgs/{org}"),
+    (re.compile(r"/\d+(?=/|$)"), "/{number}"),
+]
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _shared_session(protocol, retry, pool_size):
+    with _sessions_lock:
+        if protocol not in _sessions:
+            session = requests.Session()
+            session.auth = Requester.noopAuth
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=retry if retry is not None else requests.adapters.DEFAULT_RETRIES,
+                pool_connections=pool_size or requests.adapters.DEFAULT_POOLSIZE,
+                pool_maxsize=pool_size or requests.adapters.DEFAULT_POOLSIZE,
+            )
+            session.mount(f"{protocol}://", adapter)
+            _sessions[protocol] = session
+        return _sessions[protocol]
+
+
+class CachedResponse:
+    # mimics RequestsResponse for a body replayed from the response cache after a 304
+    def __init__(self, headers, text):
+        self.status = 200
+        self.headers = headers
+        self.text = text
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.text
+
+
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_HTTP_CACHE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            -- responses were once keyed by URL alone; they are only a cache, so they are dropped
+            DROP TABLE IF EXISTS responses;
+            CREATE TABLE IF NOT EXISTS response_variants (
+                url TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                body TEXT NOT NULL,
+                PRIMARY KEY (url, variant)
+            );
+        """)
+
+    def get(self, url: str, request_headers: dict) -> tuple[str, dict, str] | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT etag, headers, body FROM response_variants WHERE url = ? AND variant = ?",
+                (url, variant(request_headers))
+            ).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def put(self, url: str, request_headers: dict, etag: str, headers: dict, body: str):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO response_variants VALUES (?, ?, ?, ?, ?)",
+                (url, variant(request_headers), etag, json.dumps(headers), body)
+            )
+            self.connection.commit()
+
+
+def variant(request_headers: dict) -> str:
+    # a digest, so tokens in the Authorization header never reach the cache file
+    values = [f"{name}: {request_headers.get(name, '')}" for name in VARIANT_HEADERS]
+    return hashlib.sha256("\n".join(values).encode()).hexdigest()
+
+
+class Quota:
+    """The pacing state of one rate limit resource, such as GitHub's REST "core" or "graphql" quota."""
+    __slots__ = ("limit", "remaining", "reset_at", "next_request_at")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.next_request_at = 0.0
+
+
+class RequestScheduler:
+    def __init__(self, response_cache: ResponseCache | None = None, max_retries: int = MAX_RETRIES):
+        self.response_cache = response_cache
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        # resource -> Quota; GitHub limits REST, GraphQL and search calls separately
+        self.quotas = {}
+
+    def quota(self, resource: str) -> Quota:
+        with self.lock:
+            if resource not in self.quotas:
+                self.quotas[resource] = Quota()
+            return self.quotas[resource]
+
+    def send(self, session: requests.Session, verb: str, url: str, headers: dict, **kwargs) -> requests.Response:
+        request_headers = headers
+        cached = self.response_cache.get(url, request_headers) if self.response_cache and verb == "GET" else None
+        if cached:
+            headers = {**headers, "If-None-Match": cached[0]}
+
+        endpoint = api_endpoint(verb, url)
+        resource = api_resource(url)
+        for attempt in range(self.max_retries + 1):
+            with Timer("api rate limit wait"):
+                self.wait(resource)
+            with Timer(f"api {endpoint}"):
+                response = session.request(verb, url, headers=headers, **kwargs)
+            count("api_calls")
+            self.record(response.headers, resource)
+
+            delay = self.retry_delay(response, attempt)
+            if delay is None:
+                break
+            count("api_rate_limited_retries")
+            print(f"Rate limited on {url} ({response.status_code}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        if response.status_code == 304 and cached:
+            count("http_cache_hits")
+            return CachedResponse(cached[1], cached[2])
+
+        if self.response_cache and verb == "GET" and response.status_code == 200 and "ETag" in response.headers:
+            self.response_cache.put(
+                url, request_headers, response.headers["ETag"], dict(response.headers), response.text
+            )
+        return response
+
+    def wait(self, resource: str = "core"):
+        quota = self.quota(resource)
+        with self.lock:
+            now = time.time()
+            start_at = max(now, quota.next_request_at)
+            if quota.remaining == 0 and quota.reset_at:
+                start_at = max(start_at, quota.reset_at)
+            quota.next_request_at = start_at + pacing_interval(quota, start_at)
+            if quota.remaining:
+                # count the call now so concurrent callers pace against the same budget
+                quota.remaining -= 1
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def record(self, headers, resource: str = "core"):
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        # GitHub names the quota a response was counted against, which settles any doubt about the guess
+        quota = self.quota(headers.get("X-RateLimit-Resource", resource))
+        with self.lock:
+            quota.limit = int(headers.get("X-RateLimit-Limit", 0)) or quota.limit
+            quota.remaining = int(headers["X-RateLimit-Remaining"])
+            quota.reset_at = float(headers.get("X-RateLimit-Reset", 0)) or quota.reset_at
+
+    def retry_delay(self, response: requests.Response, attempt: int) -> float | None:
+        if response.status_code not in (403, 429) or attempt >= self.max_retries:
+            return None
+
+        jitter = random.uniform(0, BASE_BACKOFF)
+        if "Retry-After" in response.headers:
+            return float(response.headers["Retry-After"]) + jitter
+        if response.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response.headers:
+            return max(float(response.headers["X-RateLimit-Reset"]) - time.time(), 0.0) + jitter
+        if response.status_code == 403 and "rate limit" not in response.text.lower():
+            # a plain permission error, not worth retrying
+            return None
+        return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+def pacing_interval(quota: Quota, now: float) -> float:
+    if quota.remaining is None or quota.reset_at is None or quota.limit is None:
+        return 0.0
+    if quota.remaining > quota.limit * PACING_THRESHOLD:
+        return 0.0
+    return max(quota.reset_at - now, 0.0) / max(quota.remaining, 1)
+
+
+def api_resource(url: str) -> str:
+    # the rate limit resource a request is counted against, until its response says otherwise
+    path = urlsplit(url).path
+    if path.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in path:
+        return "search"
+    return "core"
+
+
+def api_endpoint(verb: str, url: str) -> str:
+    path = urlsplit(url).path
+    for pattern, placeholder in ENDPOINT_PATTERNS:
+        path = pattern.sub(placeholder, path)
+    return f"{verb} {path}"
+
+
+class PooledHTTPSConnection:
+    # PyGithub keeps the pending request on its connection object between request() and getresponse(),
+    # so one shared connection is not safe across threads. Injected connection classes are created per
+    # request instead, and here they all borrow one pooled session so keep-alive is preserved.
+    protocol = "https"
+    default_port = 443
+    scheduler = None
+
+    def __init__(self, host, port=None, strict=False, timeout=None, retry=None, pool_size=None, **kwargs):
+        self.host = host
+        self.port = port if port else self.default_port
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+        self.session = _shared_session(self.protocol, retry, pool_size)
+
+    def request(self, verb, url, input, headers, stream=False):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+        self.stream = stream
+
+    def getresponse(self):
+        response = self.scheduler.send(
+            self.session,
+            self.verb,
+            f"{self.protocol}://{self.host}:{self.port}{self.url}",
+            self.headers,
+            data=self.input,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+        )
+        return response if isinstance(response, CachedResponse) else RequestsResponse(response)
+
+    def close(self):
+        pass
+
+
+class PooledHTTPConnection(PooledHTTPSConnection):
+    protocol = "http"
+    default_port = 80
+
+
+def connect(token, pool_size, scheduler: RequestScheduler, base_url: str = Consts.DEFAULT_BASE_URL):
+    PooledHTTPSConnection.scheduler = scheduler
+    Requester.injectConnectionClasses(PooledHTTPConnection, PooledHTTPSConnection)
+    # Pacing and rate-limit retries are left to the scheduler, which sees every response
+    return Github(token, base_url=base_url, pool_size=pool_size, retry=None, seconds_between_requests=None)
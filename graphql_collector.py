@@ -0,0 +1,242 @@
+﻿import re
+from datetime import datetime, timezone, date
+from typing import Collection, Iterator
+
+import requests
+
+from github_session import RequestScheduler
+from raw_data import NO_LABEL, NO_TIME, UNKNOWN_USER
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+PAGE_SIZE = 100
+
+# GraphQL timeline item types and the REST issue event names the raw schema uses for them
+TIMELINE_EVENTS = {
+    "AssignedEvent": "assigned",
+    "AutoMergeDisabledEvent": "auto_merge_disabled",
+    "AutoMergeEnabledEvent": "auto_merge_enabled",
+    "BaseRefChangedEvent": "base_ref_changed",
+    "ClosedEvent": "closed",
+    "ConvertToDraftEvent": "convert_to_draft",
+    "DemilestonedEvent": "demilestoned",
+    "HeadRefDeletedEvent": "head_ref_deleted",
+    "HeadRefForcePushedEvent": "head_ref_force_pushed",
+    "LabeledEvent": "labeled",
+    "LockedEvent": "locked",
+    "MentionedEvent": "mentioned",
+    "MergedEvent": "merged",
+    "MilestonedEvent": "milestoned",
+    "ReadyForReviewEvent": "ready_for_review",
+    "ReferencedEvent": "referenced",
+    "RenamedTitleEvent": "renamed",
+    "ReopenedEvent": "reopened",
+    "ReviewDismissedEvent": "review_dismissed",
+    "ReviewRequestRemovedEvent": "review_request_removed",
+    "ReviewRequestedEvent": "review_requested",
+    "SubscribedEvent": "subscribed",
+    "UnassignedEvent": "unassigned",
+    "UnlabeledEvent": "unlabeled",
+    "UnlockedEvent": "unlocked",
+}
+LABEL_EVENTS = ("LabeledEvent", "UnlabeledEvent")
+
+
+def _item_type(type_name):
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", type_name).upper()
+
+
+def _timeline_fields(type_names):
+    fields = ["__typename"]
+    for type_name in type_names:
+        label = " label { name }" if type_name in LABEL_EVENTS else ""
+        fields.append(f"... on {type_name} {{ actor {{ login }} createdAt{label} }}")
+    return " ".join(fields)
+
+
+def _timeline_connection(type_names):
+    item_types = ", ".join(_item_type(type_name) for type_name in type_names)
+    return f", itemTypes: [{item_types}]", _timeline_fields(type_names)
+
+
+# Nested connections fetched with every pull request: name -> (extra arguments, node fields)
+CONNECTIONS = {
+    "assignees": ("", "login"),
+    "labels": ("", "name"),
+    "reviews": ("", "author { login } submittedAt state"),
+    "timelineItems": _timeline_connection(TIMELINE_EVENTS),
+    "commits": ("", "commit { author { user { login } date } committedDate }"),
+}
+
+
+def _connection_selection(name, page_size, cursor="", connections=CONNECTIONS):
+    arguments, fields = connections[name]
+    return f"{name}(first: {page_size}{cursor}{arguments}) {{ pageInfo {{ hasNextPage endCursor }} nodes {{ {fields} }} }}"
+
+
+def timeline_connections(event_types=None):
+    # the server only sends the timeline items asked for, so narrowing them shrinks every response
+    if event_types is None:
+        return CONNECTIONS
+    type_names = [type_name for type_name, action in TIMELINE_EVENTS.items() if action in event_types]
+    return {**CONNECTIONS, "timelineItems": _timeline_connection(type_names)}
+
+
+def pull_requests_query(connections=CONNECTIONS):
+    return PULL_REQUESTS_TEMPLATE % "\n        ".join(
+        _connection_selection(name, PAGE_SIZE, connections=connections) for name in connections
+    )
+
+
+PULL_REQUESTS_TEMPLATE = """
+query($owner: String!, $name: String!, $pageSize: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $pageSize, after: $cursor, states: MERGED, orderBy: {field: CREATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        id number title author { login } createdAt mergedAt closedAt state isDraft
+        additions deletions changedFiles comments { totalCount }
+        %s
+      }
+    }
+  }
+}
+"""
+PULL_REQUESTS_QUERY = pull_requests_query()
+
+CONNECTION_PAGE_QUERY = """
+query($id: ID!, $cursor: String) {
+  node(id: $id) {
+    ... on PullRequest {
+      %s
+    }
+  }
+}
+"""
+
+
+class GraphQLClient:
+    def __init__(self, token: str, url: str = GRAPHQL_URL, scheduler: RequestScheduler | None = None):
+        self.url = url
+        self.scheduler = scheduler or RequestScheduler()
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"bearer {token}"
+
+    def query(self, query: str, variables: dict) -> dict:
+        response = self.scheduler.send(self.session, "POST", self.url, {}, json={"query": query, "variables": variables})
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            raise RuntimeError(f"GraphQL query failed: {payload['errors']}")
+        return payload["data"]
+
+
+def fetch_pull_request_data(client: GraphQLClient, repo_name: str, end: date, start: date,
+                            page_size: int = PAGE_SIZE, skip: set[int] = frozenset(),
+                            event_types: Collection[str] | None = None) -> Iterator[dict]:
+    owner, name = repo_name.split("/")
+    connections = timeline_connections(event_types)
+    query = pull_requests_query(connections)
+    cursor = None
+    while True:
+        page = client.query(query, {
+            "owner": owner,
+            "name": name,
+            "pageSize": page_size,
+            "cursor": cursor,
+        })["repository"]["pullRequests"]
+
+        for node in page["nodes"]:
+            merged_at = parse_time(node["mergedAt"])
+            if merged_at > end:
+                continue
+
+            if merged_at < start:
+                print(f"Exiting at PR #{node['number']} (merged at {node['createdAt']})")
+                return
+
+            if node["number"] in skip:
+                continue
+
+            print(f"Processing PR #{node['number']} (merged at {node['createdAt']})")
+            yield build_pull_request_data(client, repo_name, node, connections)
+
+        if not page["pageInfo"]["hasNextPage"]:
+            return
+        cursor = page["pageInfo"]["endCursor"]
+
+
+def connection_nodes(client: GraphQLClient, pull_request: dict, name: str,
+                     connections: dict = CONNECTIONS) -> list[dict]:
+    connection = pull_request[name]
+    nodes = list(connection["nodes"])
+    page_info = connection["pageInfo"]
+    while page_info["hasNextPage"]:
+        query = CONNECTION_PAGE_QUERY % _connection_selection(name, PAGE_SIZE, ", after: $cursor", connections)
+        connection = client.query(query, {"id": pull_request["id"], "cursor": page_info["endCursor"]})["node"][name]
+        nodes.extend(connection["nodes"])
+        page_info = connection["pageInfo"]
+    return nodes
+
+
+def build_pull_request_data(client: GraphQLClient, repo_name: str, node: dict,
+                            connections: dict = CONNECTIONS) -> dict[str, any]:
+    return {
+        "repo": repo_name,
+        "number": node["number"],
+        "title": node["title"],
+        "author": login(node["author"]),
+        "created_at": to_iso(node["createdAt"]),
+        "merged_at": to_iso(node["mergedAt"]) if node["mergedAt"] else NO_TIME,
+        "closed_at": to_iso(node["closedAt"]) if node["closedAt"] else NO_TIME,
+        "state": "open" if node["state"] == "OPEN" else "closed",
+        "assignees": [assignee["login"] for assignee in connection_nodes(client, node, "assignees")],
+        "labels": [label["name"] for label in connection_nodes(client, node, "labels")],
+        "draft": node["isDraft"],
+        "additions": node["additions"],
+        "deletions": node["deletions"],
+        "changed_files": node["changedFiles"],
+        "comments": node["comments"]["totalCount"],
+        "reviews": extract_reviews(connection_nodes(client, node, "reviews")),
+        "events": extract_events(connection_nodes(client, node, "timelineItems", connections)),
+        "commits": extract_commits(connection_nodes(client, node, "commits")),
+    }
+
+
+def extract_reviews(nodes: list[dict]) -> list[dict]:
+    return [{
+        "user": login(review["author"]),
+        "submitted_at": to_iso(review["submittedAt"]),
+        "state": review["state"],
+    } for review in nodes if review["submittedAt"]]
+
+
+def extract_events(nodes: list[dict]) -> list[dict]:
+    return [{
+        "actor": login(event.get("actor")),
+        "action": TIMELINE_EVENTS[event["__typename"]],
+        "timestamp": to_iso(event["createdAt"]),
+        "label": event["label"]["name"] if event.get("label") else NO_LABEL
+    } for event in nodes if event["__typename"] in TIMELINE_EVENTS]
+
+
+def extract_commits(nodes: list[dict]) -> list[dict]:
+    # a commit without a git author is kept, as the REST engine keeps it, under the unknown user
+    return [{
+        "author": login(commit["commit"]["author"]["user"]) if commit["commit"]["author"] else UNKNOWN_USER,
+        "timestamp": to_iso(
+            commit["commit"]["author"]["date"] if commit["commit"]["author"] else commit["commit"]["committedDate"]
+        )
+    } for commit in nodes]
+
+
+def login(user: dict | None) -> str:
+    return user["login"] if user else UNKNOWN_USER
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+def to_iso(value: str) -> str:
+    return parse_time(value).isoformat()
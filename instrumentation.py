@@ -0,0 +1,176 @@
+﻿import argparse
+import cProfile
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+DEFAULT_SUMMARY_DIR = "data/instrumentation"
+
+# Off unless a script runs with --instrument or --profile. Every hook checks this first, so an uninstrumented run
+# pays one global lookup per timed call.
+_enabled = False
+_lock = threading.Lock()
+# name -> [calls, seconds]
+_timers = {}
+_counters = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def add_time(name: str, seconds: float):
+    with _lock:
+        totals = _timers.get(name)
+        if totals is None:
+            _timers[name] = [1, seconds]
+        else:
+            totals[0] += 1
+            totals[1] += seconds
+
+
+def count(name: str, amount: int = 1):
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+
+class Timer:
+    """Adds the time spent in the with block to the named timer. Safe to use from several threads."""
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        if _enabled:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started is not None:
+            add_time(self.name, time.perf_counter() - self.started)
+
+
+def timed(name: str | None = None):
+    """Decorator timing every call of a function, under name or the function's qualified name."""
+    def decorate(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_time(label, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summary(stage: str, wall_seconds: float) -> dict:
+    with _lock:
+        timers = sorted(_timers.items(), key=lambda item: -item[1][1])
+        counters = dict(sorted(_counters.items()))
+    return {
+        "stage": stage,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "wall_seconds": round(wall_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        # worker processes (analyzer and chart workers) are only visible here, as their timers stay in the worker
+        "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "timers": {
+            name: {"calls": calls, "seconds": round(seconds, 4), "mean_ms": round(seconds * 1000 / calls, 3)}
+            for name, (calls, seconds) in timers
+        },
+        "counters": counters,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser, stage: str):
+    parser.add_argument('--instrument', nargs='?', const=f"{DEFAULT_SUMMARY_DIR}/{stage}.json",
+                        help="Write stage timers, call counters and peak memory to this JSON file")
+    parser.add_argument('--profile', help="Write a cProfile dump, or a pyinstrument HTML report for a .html file")
+
+
+@contextmanager
+def instrumented(stage: str, summary_file: str | None = None, profile_file: str | None = None):
+    """Runs the with block with timers and counters on, writing the summary and profile when it ends."""
+    if not summary_file and not profile_file:
+        yield
+        return
+
+    reset()
+    enable()
+    profiler = start_profiler(profile_file) if profile_file else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - started
+        disable()
+        if profiler:
+            stop_profiler(profiler, profile_file)
+            print(f"Profile written to {profile_file}")
+        if summary_file:
+            Path(summary_file).parent.mkdir(parents=True, exist_ok=True)
+            with open(summary_file, "w") as file_stream:
+                json.dump(summary(stage, wall_seconds), file_stream, indent=2)
+            print(f"Instrumentation summary written to {summary_file}")
+
+
+def start_profiler(profile_file: str):
+    # both profilers follow the main thread only; collector threads show up in the API timers instead
+    if profile_file.endswith(".html"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise SystemExit("HTML profiles need pyinstrument: pip install pyinstrument")
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler, profile_file: str):
+    Path(profile_file).parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+    else:
+        profiler.stop()
+        Path(profile_file).write_text(profiler.output_html())
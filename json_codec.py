@@ -0,0 +1,33 @@
+﻿import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson is an optional, faster drop-in for reading raw data and writing metrics. Both backends write the same compact
+# UTF-8 JSON, so files and stored rows do not depend on which one wrote them.
+
+
+def loads(data: str | bytes):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dumps(value) -> str:
+    if orjson:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def load(file_stream):
+    return loads(file_stream.read())
+
+
+def dump(value, file_stream, indent: bool = False):
+    # file_stream is opened in binary mode
+    if orjson:
+        file_stream.write(orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)))
+    elif indent:
+        file_stream.write(json.dumps(value, indent=2, ensure_ascii=False).encode())
+    else:
+        file_stream.write(dumps(value).encode())
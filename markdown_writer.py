@@ -0,0 +1,64 @@
+﻿import io
+from itertools import chain
+from typing import Iterable, TextIO
+
+from instrumentation import timed
+
+NO_DATA = "No data\n"
+
+
+@timed()
+def write_table(file_stream: TextIO, rows: Iterable[dict], padded: bool = True) -> int:
+    """
+    Writes rows (dicts sharing the first row's keys) as a markdown table and returns how many were written.
+
+    Unpadded tables go straight to the file row by row. Padded tables match py_markdown_table's layout: cells are
+    formatted and column widths measured in a single pass, then the table is written once the widths are known.
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        file_stream.write(NO_DATA)
+        return 0
+
+    columns = list(first_row)
+    if not padded:
+        file_stream.write(format_row(columns))
+        file_stream.write(format_row("-" * len(column) for column in columns))
+        count = 0
+        for row in chain((first_row,), rows):
+            file_stream.write(format_row(str(row[column]) for column in columns))
+            count += 1
+        return count
+
+    widths = [len(column) for column in columns]
+    cells = []
+    for row in chain((first_row,), rows):
+        values = [str(row[column]) for column in columns]
+        for index, value in enumerate(values):
+            if len(value) > widths[index]:
+                widths[index] = len(value)
+        cells.append(values)
+
+    file_stream.write(format_row(map(_centre, columns, widths)))
+    file_stream.write(format_row("-" * width for width in widths))
+    for values in cells:
+        file_stream.write(format_row(map(_centre, values, widths)))
+    return len(cells)
+
+
+def render_table(rows: Iterable[dict], padded: bool = True) -> str:
+    buffer = io.StringIO()
+    write_table(buffer, rows, padded)
+    # py_markdown_table returned tables without the trailing newline
+    return buffer.getvalue().rstrip("\n")
+
+
+def format_row(values: Iterable[str]) -> str:
+    return "|" + "|".join(values) + "|\n"
+
+
+def _centre(value: str, width: int) -> str:
+    # any odd space goes before the value, as py_markdown_table's default "centerleft" weight does
+    padding = width - len(value)
+    return " " * ((padding + 1) // 2) + value + " " * (padding // 2)
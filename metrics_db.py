@@ -0,0 +1,197 @@
+﻿import os
+import sqlite3
+from contextlib import closing
+from datetime import date, timedelta
+from pathlib import Path
+
+from instrumentation import timed
+from json_codec import dumps, load, loads
+
+DEFAULT_METRICS_DB = "data/metrics.db"
+DEFAULT_METRICS_JSON = "data/metrics.json"
+FORMATS = {"sqlite": DEFAULT_METRICS_DB, "json": DEFAULT_METRICS_JSON}
+
+
+@timed()
+def write_metrics_db(metrics: dict, path: str = DEFAULT_METRICS_DB):
+    """
+    Metrics partitioned by team: one row per pull request and one per team section (per_day, per_week, rolling, ...),
+    each holding compact JSON, so a report for one team reads only that team's rows. Pull requests are indexed by
+    team, author and label.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # built beside the target and swapped in, so readers never see a half-written file
+    building = f"{path}.tmp"
+    if os.path.exists(building):
+        os.remove(building)
+
+    connection = sqlite3.connect(building)
+    with connection:
+        connection.executescript("""
+            -- no type on key, so integer PR numbers and "owner/name#number" strings both round-trip unchanged
+            CREATE TABLE pull_requests (
+                key NOT NULL,
+                team TEXT NOT NULL,
+                author TEXT NOT NULL,
+                merged_at TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE pull_request_labels (
+                key NOT NULL,
+                label TEXT NOT NULL
+            );
+            CREATE TABLE teams (
+                team TEXT NOT NULL,
+                section TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (team, section)
+            );
+        """)
+        connection.executemany(
+            "INSERT INTO pull_requests VALUES (?, ?, ?, ?, ?)",
+            (
+                (key, metric["team"], metric["author"], metric["merged_at"], dumps(metric))
+                for key, metric in metrics["pull_requests"].items()
+            )
+        )
+        connection.executemany(
+            "INSERT INTO pull_request_labels VALUES (?, ?)",
+            (
+                (key, label)
+                for key, metric in metrics["pull_requests"].items()
+                for label in metric.get("labels", [])
+            )
+        )
+        connection.executemany(
+            "INSERT INTO teams VALUES (?, ?, ?)",
+            (
+                (team, section, dumps(data))
+                for team, sections in metrics["teams"].items()
+                for section, data in sections.items()
+            )
+        )
+        # the team -> pull request index, with merge time, author and label for narrower selections
+        connection.execute("CREATE INDEX pull_requests_team ON pull_requests (team, merged_at)")
+        connection.execute("CREATE INDEX pull_requests_author ON pull_requests (author, merged_at)")
+        connection.execute("CREATE INDEX pull_request_labels_label ON pull_request_labels (label, key)")
+    connection.close()
+    os.replace(building, path)
+
+
+def is_json(path: str) -> bool:
+    return path.endswith(".json")
+
+
+@timed()
+def load_team_metrics(path: str, team: str, sections: list[str] | None = None) -> dict:
+    if is_json(path):
+        team_metrics = load_json(path)["teams"][team]
+        return {section: data for section, data in team_metrics.items() if sections is None or section in sections}
+
+    with closing(connect_read_only(path)) as connection:
+        if not connection.execute("SELECT 1 FROM teams WHERE team = ? LIMIT 1", (team,)).fetchone():
+            raise KeyError(team)
+        rows = connection.execute("SELECT section, data FROM teams WHERE team = ?", (team,))
+        # sections that were not asked for are never parsed
+        return {section: loads(data) for section, data in rows if sections is None or section in sections}
+
+
+@timed()
+def load_pull_requests(path: str, team: str, since: date | None = None, until: date | None = None,
+                       author: str | None = None, label: str | None = None) -> dict:
+    """A team's pull requests, optionally only those merged from since to until (inclusive), by author or labelled."""
+    filters = (since, until, author, label)
+    if is_json(path):
+        metrics = load_json(path)
+        pull_requests = metrics["pull_requests"]
+        # JSON object keys are always strings, while the index keeps integer keys of raw data without a repo
+        keys = map(str, metrics["team_pull_requests"].get(team, []))
+        return {key: pull_requests[key] for key in keys if matches(pull_requests[key], *filters)}
+
+    clause, parameters = filter_clause(*filters)
+    with closing(connect_read_only(path)) as connection:
+        rows = connection.execute(
+            f"SELECT key, data FROM pull_requests WHERE team = ?{clause} ORDER BY rowid", (team, *parameters)
+        )
+        # keys read back as JSON object keys would be
+        return {str(key): loads(data) for key, data in rows}
+
+
+def filter_clause(since=None, until=None, author=None, label=None) -> tuple[str, list]:
+    clause = ""
+    parameters = []
+    # merge times are ISO strings, so date bounds compare as text
+    if since:
+        clause += " AND merged_at >= ?"
+        parameters.append(since.isoformat())
+    if until:
+        clause += " AND merged_at < ?"
+        parameters.append((until + timedelta(days=1)).isoformat())
+    if author:
+        clause += " AND author = ?"
+        parameters.append(author)
+    if label:
+        clause += " AND key IN (SELECT key FROM pull_request_labels WHERE label = ?)"
+        parameters.append(label)
+    return clause, parameters
+
+
+def matches(metric: dict, since=None, until=None, author=None, label=None) -> bool:
+    merged_on = metric["merged_at"][:10] if metric["merged_at"] else None
+    return (
+        (not since or (merged_on and merged_on >= since.isoformat()))
+        and (not until or (merged_on and merged_on <= until.isoformat()))
+        and (not author or metric["author"] == author)
+        and (not label or label in metric.get("labels", []))
+    )
+
+
+@timed()
+def load_all_team_metrics(path: str, sections: list[str] | None = None) -> dict[str, dict]:
+    """Every team's sections in one pass, for building all teams' outputs together."""
+    if is_json(path):
+        return {
+            team: {section: data for section, data in team_metrics.items() if sections is None or section in sections}
+            for team, team_metrics in load_json(path)["teams"].items()
+        }
+
+    all_team_metrics = {}
+    with closing(connect_read_only(path)) as connection:
+        for team, section, data in connection.execute("SELECT team, section, data FROM teams ORDER BY rowid"):
+            team_metrics = all_team_metrics.setdefault(team, {})
+            if sections is None or section in sections:
+                team_metrics[section] = loads(data)
+    return all_team_metrics
+
+
+@timed()
+def load_pull_requests_by_team(path: str, since: date | None = None, until: date | None = None,
+                               author: str | None = None, label: str | None = None) -> dict[str, dict]:
+    filters = (since, until, author, label)
+    pull_requests_by_team = {}
+    if is_json(path):
+        for key, metric in load_json(path)["pull_requests"].items():
+            if matches(metric, *filters):
+                pull_requests_by_team.setdefault(metric["team"], {})[key] = metric
+        return pull_requests_by_team
+
+    clause, parameters = filter_clause(*filters)
+    with closing(connect_read_only(path)) as connection:
+        rows = connection.execute(
+            f"SELECT key, team, data FROM pull_requests WHERE 1 = 1{clause} ORDER BY rowid", parameters
+        )
+        for key, team, data in rows:
+            pull_requests_by_team.setdefault(team, {})[str(key)] = loads(data)
+    return pull_requests_by_team
+
+
+def connect_read_only(path: str) -> sqlite3.Connection:
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+@timed()
+def load_json(path: str) -> dict:
+    with open(path, "rb") as file_stream:
+        return load(file_stream)
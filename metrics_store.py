@@ -0,0 +1,128 @@
+﻿import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from json_codec import dumps, loads
+
+DEFAULT_STORE = "data/metrics.sqlite"
+BUCKET_KEY = ["team", "period", "bucket"]
+
+
+class MetricsStore:
+    """
+    Per-PR metrics keyed by PR key and a hash of the raw record, plus running totals, counts and quantile sketch bins
+    for every team bucket. Bucket values are integers (durations in hundredths of an hour), so adding and
+    subtracting a pull request's contribution is exact.
+    """
+
+    def __init__(self, metric_names: list[str], path: str = DEFAULT_STORE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.metric_names = list(metric_names)
+        self.connection = sqlite3.connect(path)
+        self.create_tables()
+
+    def create_tables(self):
+        columns = ", ".join(f"{name} INTEGER NOT NULL" for name in self.metric_names)
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS settings (
+                fingerprint TEXT NOT NULL
+            );
+            -- no type on key, so integer PR numbers and "owner/name#number" strings both round-trip unchanged
+            CREATE TABLE IF NOT EXISTS pull_requests (
+                key PRIMARY KEY,
+                hash TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                team TEXT NOT NULL,
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                {columns},
+                PRIMARY KEY (team, period, bucket)
+            );
+            CREATE TABLE IF NOT EXISTS sketches (
+                team TEXT NOT NULL,
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                bin INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (team, period, bucket, metric, bin)
+            );
+        """)
+
+    def prepare(self, fingerprint: str) -> bool:
+        # Team membership, calendars and metric rules feed every stored value, so any change to them starts afresh
+        row = self.connection.execute("SELECT fingerprint FROM settings").fetchone()
+        if row and row[0] == fingerprint:
+            return False
+
+        # the tables are rebuilt rather than emptied, as the bucket columns follow the metric names
+        self.connection.executescript("""
+            DROP TABLE settings;
+            DROP TABLE pull_requests;
+            DROP TABLE buckets;
+            DROP TABLE sketches;
+        """)
+        self.create_tables()
+        with self.connection:
+            self.connection.execute("INSERT INTO settings VALUES (?)", (fingerprint,))
+        return row is not None
+
+    def hashes(self) -> dict:
+        return dict(self.connection.execute("SELECT key, hash FROM pull_requests"))
+
+    def metrics(self, keys=None) -> dict:
+        if keys is None:
+            rows = self.connection.execute("SELECT key, data FROM pull_requests")
+            return {key: loads(data) for key, data in rows}
+
+        metrics = {}
+        for key in keys:
+            row = self.connection.execute("SELECT data FROM pull_requests WHERE key = ?", (key,)).fetchone()
+            if row:
+                metrics[key] = loads(row[0])
+        return metrics
+
+    def update(self, removed_keys: list, changed: list[tuple], bucket_deltas: pd.DataFrame, sketch_deltas: pd.Series):
+        # One transaction, so an interrupted run leaves the previous state intact
+        names = ["count", *self.metric_names]
+        updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in names)
+        placeholders = ", ".join("?" for _ in BUCKET_KEY + names)
+        with self.connection:
+            self.connection.executemany("DELETE FROM pull_requests WHERE key = ?", [(key,) for key in removed_keys])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pull_requests VALUES (?, ?, ?)",
+                [(key, content_hash, dumps(metric)) for key, content_hash, metric in changed]
+            )
+            self.connection.executemany(
+                f"INSERT INTO buckets VALUES ({placeholders}) "
+                f"ON CONFLICT (team, period, bucket) DO UPDATE SET {updates}",
+                [
+                    (*bucket, *values)
+                    for bucket, values in zip(bucket_deltas.index, bucket_deltas[names].to_numpy().tolist())
+                ]
+            )
+            self.connection.execute("DELETE FROM buckets WHERE count = 0")
+            self.connection.executemany(
+                "INSERT INTO sketches VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (team, period, bucket, metric, bin) DO UPDATE SET count = count + excluded.count",
+                [(*sketch_bin, count) for sketch_bin, count in zip(sketch_deltas.index, sketch_deltas.tolist())]
+            )
+            self.connection.execute("DELETE FROM sketches WHERE count = 0")
+
+    def bucket_sums(self) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT * FROM buckets ORDER BY team, period, bucket", self.connection, index_col=BUCKET_KEY
+        )
+
+    def bucket_sketches(self) -> pd.Series:
+        return pd.read_sql_query(
+            "SELECT * FROM sketches ORDER BY team, period, bucket, metric, bin", self.connection,
+            index_col=[*BUCKET_KEY, "metric", "bin"]
+        )["count"]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,162 @@
+﻿import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from queue import Queue
+from threading import Thread
+from typing import Callable, Iterator
+
+from github import Consts
+
+import collector
+from analyzer import DEFAULT_WORKERS, analyze, load_approval_rules, load_calendars, load_teams, save_metrics
+from dashboard import write_dashboard
+from github_session import DEFAULT_HTTP_CACHE
+from graphql_collector import GRAPHQL_URL, PAGE_SIZE
+from instrumentation import Timer, add_arguments, instrumented
+from metrics_db import is_json
+from metrics_store import DEFAULT_STORE
+from pr_cache import DEFAULT_CACHE
+from raw_data import read_raw_data
+from reporter import write_team_reports
+from team_outputs import write_index
+from visualizer import CHART_SECTIONS, plot_all_team_charts
+
+DEFAULT_OUTPUT_DIR = "data/reports"
+# Pull requests fetched but not yet analysed; collection waits when the analyzer falls this far behind
+RECORD_BUFFER = 1000
+END_OF_RECORDS = object()
+
+
+def main(pull_requests: Iterator[dict], teams: dict, output_dir: str = DEFAULT_OUTPUT_DIR, calendars=None,
+         approval_rules=None, analyzer_workers: int = DEFAULT_WORKERS, store_path: str | None = None,
+         metrics_snapshot: str | None = None, report_page_size: int | None = None, padded: bool = True,
+         charts: bool = True, chart_workers: int = 1, dashboard_file: str | None = None):
+    """
+    Analyses pull_requests as they arrive and writes every team's report and charts, and optionally the dashboard,
+    from the metrics in memory. metrics_snapshot also saves the metrics, as analyzer.py would.
+    """
+    # collection runs while the analysis waits on it, so this covers both
+    with Timer("collect and analyze"):
+        metrics = analyze(pull_requests, teams, calendars, analyzer_workers, store_path, approval_rules)
+    if metrics_snapshot:
+        save_metrics(metrics, "json" if is_json(metrics_snapshot) else "sqlite", metrics_snapshot)
+
+    all_team_metrics = metrics["teams"]
+    pull_requests_by_team = {
+        team: {key: metrics["pull_requests"][key] for key in keys}
+        for team, keys in metrics["team_pull_requests"].items()
+    }
+    chart_metrics = {
+        team: {section: team_metrics[section] for section in CHART_SECTIONS}
+        for team, team_metrics in all_team_metrics.items()
+    }
+
+    # charts rendered in worker processes are drawn while the reports are written; serial charts stay on this
+    # thread, as pyplot is not thread-safe
+    with ThreadPoolExecutor(max_workers=1) as background:
+        drawing = background.submit(plot_all_team_charts, output_dir, chart_metrics, chart_workers) \
+            if charts and chart_workers > 1 else None
+        with Timer("reports"):
+            write_team_reports(output_dir, all_team_metrics, pull_requests_by_team, report_page_size, padded)
+        if dashboard_file:
+            with Timer("dashboard"):
+                write_dashboard(dashboard_file, all_team_metrics)
+        with Timer("charts"):
+            if drawing:
+                drawing.result()
+            elif charts:
+                plot_all_team_charts(output_dir, chart_metrics)
+
+    write_index(output_dir, list(all_team_metrics))
+
+
+def stream_collection(collect: Callable[[Queue], None]) -> Iterator[dict]:
+    """Runs collect on a background thread and yields each pull request it puts on the queue, in arrival order."""
+    records = Queue(maxsize=RECORD_BUFFER)
+    failures = []
+
+    def run():
+        try:
+            collect(records)
+        except BaseException as error:
+            failures.append(error)
+        finally:
+            records.put(END_OF_RECORDS)
+
+    # a daemon, so a failed analysis never waits on a collection blocked on the full queue
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    while (record := records.get()) is not END_OF_RECORDS:
+        yield record
+    thread.join()
+    if failures:
+        raise failures[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument('--repo')
+    sources.add_argument('--repos', nargs='+')
+    sources.add_argument('--org')
+    sources.add_argument('--input')
+    parser.add_argument('--include', nargs='*', default=[])
+    parser.add_argument('--exclude', nargs='*', default=[])
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--workers', type=int, default=collector.DEFAULT_WORKERS)
+    parser.add_argument('--repo-concurrency', type=int, default=collector.DEFAULT_REPO_CONCURRENCY)
+    parser.add_argument('--engine', choices=collector.ENGINES, default="rest")
+    parser.add_argument('--graphql-url', default=GRAPHQL_URL)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE)
+    parser.add_argument('--api-url', default=Consts.DEFAULT_BASE_URL)
+    parser.add_argument('--http-cache', nargs='?', const=DEFAULT_HTTP_CACHE)
+    parser.add_argument('--events', choices=collector.EVENT_SETS, default="all")
+    parser.add_argument('--raw-snapshot')
+    parser.add_argument('--teams', required=True)
+    parser.add_argument('--calendars')
+    parser.add_argument('--approval-rules')
+    parser.add_argument('--analyzer-workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE)
+    parser.add_argument('--metrics-snapshot')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--report-page-size', type=int)
+    parser.add_argument('--unpadded', action='store_true')
+    parser.add_argument('--no-charts', action='store_true')
+    parser.add_argument('--chart-workers', type=int, default=1)
+    parser.add_argument('--dashboard')
+    add_arguments(parser, "pipeline")
+    args = parser.parse_args()
+
+    if args.input:
+        pull_requests = read_raw_data(args.input)
+    else:
+        if not (args.start and args.end):
+            parser.error("--start and --end are required when collecting")
+        start = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc)
+        end = datetime.fromisoformat(args.end).replace(tzinfo=timezone.utc)
+        repo_names = [args.repo] if args.repo else collector.read_repo_names(args.repos) if args.repos else None
+        # the raw snapshot, when asked for, is partitioned by repository as collector.py --output-dir writes it
+        pull_requests = stream_collection(lambda records: collector.main(
+            repo_names, start, end, args.workers, args.engine, args.graphql_url, args.page_size, args.cache,
+            args.api_url, args.http_cache, None, False, args.raw_snapshot, args.org, args.include, args.exclude,
+            args.repo_concurrency, records, collector.EVENT_SETS[args.events]
+        ))
+
+    with instrumented("pipeline", args.instrument, args.profile):
+        main(
+            pull_requests,
+            load_teams(args.teams),
+            args.output_dir,
+            load_calendars(args.calendars) if args.calendars else None,
+            load_approval_rules(args.approval_rules) if args.approval_rules else None,
+            args.analyzer_workers,
+            args.store,
+            args.metrics_snapshot,
+            args.report_page_size,
+            not args.unpadded,
+            not args.no_charts,
+            args.chart_workers,
+            args.dashboard,
+        )
@@ -0,0 +1,83 @@
+﻿import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from instrumentation import count
+from json_codec import dumps, loads
+
+DEFAULT_CACHE = "data/cache.sqlite"
+
+
+class PullRequestCache:
+    def __init__(self, path: str = DEFAULT_CACHE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pull_requests (
+                repo TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                merged_at TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (repo, number)
+            );
+            CREATE TABLE IF NOT EXISTS syncs (
+                repo TEXT PRIMARY KEY,
+                synced_at TEXT NOT NULL,
+                covered_from TEXT NOT NULL,
+                covered_to TEXT NOT NULL
+            );
+        """)
+
+    def get(self, repo: str, number: int, updated_at: datetime) -> dict | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM pull_requests WHERE repo = ? AND number = ? AND updated_at = ?",
+                (repo, number, updated_at.isoformat())
+            ).fetchone()
+        count("pr_cache_hits" if row else "pr_cache_misses")
+        return loads(row[0]) if row else None
+
+    def put(self, repo: str, pull_request_data: dict, updated_at: datetime):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pull_requests VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    repo,
+                    pull_request_data["number"],
+                    updated_at.isoformat(),
+                    pull_request_data["created_at"],
+                    pull_request_data["merged_at"],
+                    dumps(pull_request_data),
+                )
+            )
+            self.connection.commit()
+
+    def records(self, repo: str, start: datetime, end: datetime) -> list[dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT merged_at, data FROM pull_requests WHERE repo = ? AND merged_at != '' ORDER BY created_at DESC",
+                (repo,)
+            ).fetchall()
+        return [loads(data) for merged_at, data in rows if start <= datetime.fromisoformat(merged_at) <= end]
+
+    def last_sync(self, repo: str) -> tuple[datetime, datetime, datetime] | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT synced_at, covered_from, covered_to FROM syncs WHERE repo = ?", (repo,)
+            ).fetchone()
+        return tuple(datetime.fromisoformat(value) for value in row) if row else None
+
+    def mark_synced(self, repo: str, synced_at: datetime, covered_from: datetime, covered_to: datetime):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)",
+                (repo, synced_at.isoformat(), covered_from.isoformat(), covered_to.isoformat())
+            )
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,95 @@
+﻿import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from event_index import ANALYZED_EVENTS
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_epoch(value: str | None) -> int | None:
+    """An ISO timestamp as microseconds since the epoch, or None when missing. Naive timestamps are taken as UTC."""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // MICROSECOND
+
+
+def to_iso(value: int | None) -> str | None:
+    return (EPOCH + value * MICROSECOND).isoformat() if value is not None else None
+
+
+class PullRequestRecord:
+    """
+    The parts of a raw pull request the analyzer reads, parsed once. Timestamps are epoch microseconds, reviews,
+    events and commits are parallel arrays rather than a dict each, and repeated names are interned, so hundreds of
+    thousands of records fit in a fraction of the memory their raw dicts take.
+    """
+    __slots__ = (
+        "repo", "number", "author", "created_at", "merged_at", "closed_at", "draft", "labels",
+        "additions", "deletions", "changed_files", "comments",
+        "review_times", "review_users", "review_states",
+        "event_times", "event_actions", "event_labels",
+        "commit_times",
+    )
+
+    def __init__(self, repo: str | None, number: int, author: str, created_at: int, merged_at: int | None,
+                 closed_at: int | None, draft: bool, labels: tuple[str, ...], additions: int, deletions: int,
+                 changed_files: int, comments: int, review_times: array, review_users: tuple[str, ...],
+                 review_states: tuple[str, ...], event_times: array, event_actions: tuple[str, ...],
+                 event_labels: tuple[str, ...], commit_times: array):
+        self.repo = repo
+        self.number = number
+        self.author = author
+        self.created_at = created_at
+        self.merged_at = merged_at
+        self.closed_at = closed_at
+        self.draft = draft
+        self.labels = labels
+        self.additions = additions
+        self.deletions = deletions
+        self.changed_files = changed_files
+        self.comments = comments
+        self.review_times = review_times
+        self.review_users = review_users
+        self.review_states = review_states
+        self.event_times = event_times
+        self.event_actions = event_actions
+        self.event_labels = event_labels
+        self.commit_times = commit_times
+
+    @classmethod
+    def from_raw(cls, pull_request: dict) -> "PullRequestRecord":
+        # reviews never submitted and events the analyzer does not read are dropped here
+        reviews = [review for review in pull_request["reviews"] if review.get("submitted_at")]
+        events = [event for event in pull_request.get("events", []) if event["action"] in ANALYZED_EVENTS]
+        return cls(
+            repo=pull_request.get("repo"),
+            number=pull_request["number"],
+            author=sys.intern(pull_request["author"]),
+            created_at=to_epoch(pull_request["created_at"]),
+            merged_at=to_epoch(pull_request.get("merged_at")),
+            closed_at=to_epoch(pull_request.get("closed_at")),
+            draft=bool(pull_request.get("draft")),
+            labels=tuple(sys.intern(label) for label in pull_request.get("labels", [])),
+            additions=pull_request.get("additions", 0),
+            deletions=pull_request.get("deletions", 0),
+            changed_files=pull_request.get("changed_files", 0),
+            comments=pull_request.get("comments", 0),
+            review_times=array("q", [to_epoch(review["submitted_at"]) for review in reviews]),
+            review_users=tuple(sys.intern(review["user"]) for review in reviews),
+            review_states=tuple(sys.intern(review["state"]) for review in reviews),
+            event_times=array("q", [to_epoch(event["timestamp"]) for event in events]),
+            event_actions=tuple(sys.intern(event["action"]) for event in events),
+            event_labels=tuple(sys.intern(event.get("label") or "") for event in events),
+            commit_times=array("q", [to_epoch(commit["timestamp"]) for commit in pull_request.get("commits", [])]),
+        )
+
+    def reviews(self):
+        return zip(self.review_times, self.review_users, self.review_states)
+
+    def events(self):
+        return zip(self.event_actions, self.event_labels, self.event_times)
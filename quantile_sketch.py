@@ -0,0 +1,84 @@
+﻿import math
+
+import numpy as np
+import pandas as pd
+
+# Durations are sketched in log-spaced bins (as in DDSketch), so any quantile read back from a sketch is within
+# RELATIVE_ACCURACY of the true value. A sketch is just a count per bin: merging adds counts and removing a value
+# subtracts one, so sketches combine across buckets, teams and runs exactly. Sketches are written out as
+# "bin:count" pairs in bin order, e.g. "-1:2 57:1 233:4", which keeps them to one short string per metric.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# Bin for zero-length durations; every other bin index is >= 0 since values are at least one hundredth of an hour
+ZERO_BIN = -1
+PERCENTILES = {"p50": 0.50, "p75": 0.75, "p90": 0.90, "p95": 0.95}
+
+
+def bin_indexes(hundredths: pd.Series) -> pd.Series:
+    """Bin of each duration given in hundredths of an hour; missing durations stay missing."""
+    positive = hundredths.where(hundredths > 0)
+    bins = np.ceil(np.log(positive) / math.log(GAMMA))
+    return bins.where(hundredths.isna() | (hundredths > 0), ZERO_BIN)
+
+
+def bin_values(indexes):
+    """Hours each bin stands for: the point of least relative error across the bin."""
+    indexes = np.asarray(indexes, dtype="float64")
+    return np.where(indexes == ZERO_BIN, 0.0, np.round(2 * GAMMA ** indexes / (GAMMA + 1) / 100, 2))
+
+
+def encode_sketch(bins: dict[int, int]) -> str:
+    return " ".join(f"{index}:{count}" for index, count in sorted(bins.items()) if count)
+
+
+def decode_sketch(sketch: str) -> dict[int, int]:
+    bins = {}
+    for pair in sketch.split():
+        index, count = pair.split(":")
+        bins[int(index)] = int(count)
+    return bins
+
+
+def merge_sketches(*sketches: str) -> str:
+    """Combines sketches as written in metrics.json, e.g. one metric's sketch from several weeks or teams."""
+    merged = {}
+    for sketch in sketches:
+        for index, count in decode_sketch(sketch).items():
+            merged[index] = merged.get(index, 0) + count
+    return encode_sketch(merged)
+
+
+def sketch_quantile(sketch: str, quantile: float) -> float | None:
+    bins = sorted(decode_sketch(sketch).items())
+    total = sum(count for _, count in bins)
+    if total == 0:
+        return None
+
+    rank = quantile * (total - 1)
+    seen = 0
+    for index, count in bins:
+        seen += count
+        if seen > rank:
+            return float(bin_values(index))
+
+
+def sketch_percentiles(counts: pd.Series) -> pd.DataFrame:
+    """
+    PERCENTILES of many sketches at once. counts is indexed by the sketch key levels followed by "bin"; the result
+    has one row per sketch and one column per percentile.
+    """
+    keys = counts.index.names[:-1]
+    rows = counts.rename("count").reset_index()
+    rows["sketch"] = rows.groupby(keys, sort=False).ngroup()
+    rows = rows.iloc[np.lexsort((rows["bin"].to_numpy(), rows["sketch"].to_numpy()))]
+
+    seen = rows.groupby("sketch")["count"].cumsum()
+    total = rows.groupby("sketch")["count"].transform("sum")
+    first_rows = rows.drop_duplicates("sketch").set_index("sketch")[keys]
+
+    percentiles = {}
+    for name, quantile in PERCENTILES.items():
+        # the first bin, in order, whose cumulative count passes the quantile's rank
+        reached = rows[seen > quantile * (total - 1)].drop_duplicates("sketch").set_index("sketch")["bin"]
+        percentiles[name] = pd.Series(bin_values(reached), index=reached.index)
+    return pd.DataFrame(percentiles).join(first_rows).set_index(keys)
@@ -0,0 +1,71 @@
+﻿import os
+from pathlib import Path
+from typing import Iterator
+
+from instrumentation import Timer
+from json_codec import dumps, load, loads
+
+DEFAULT_RAW_FILE = "data/raw.jsonl"
+DEFAULT_RAW_DIR = "data/raw"
+# Placeholders both collection engines write for a missing user, time or label
+UNKNOWN_USER = "unknown"
+NO_TIME = ''
+NO_LABEL = ''
+
+
+class RawDataWriter:
+    # Writes one pull request per line and flushes after each, so a crash loses at most the record in flight
+    def __init__(self, path: str = DEFAULT_RAW_FILE, resume: bool = False):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.processed = self.checkpoint() if resume and Path(path).exists() else set()
+        self.count = len(self.processed)
+        self.file_stream = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def checkpoint(self) -> set[int]:
+        processed = set()
+        complete = 0
+        with open(self.path, 'rb') as file_stream:
+            for line in file_stream:
+                if not line.endswith(b"\n"):
+                    break
+                processed.add(loads(line)["number"])
+                complete += len(line)
+        # drop a trailing record that was only partly written
+        os.truncate(self.path, complete)
+        return processed
+
+    def write(self, pull_request_data: dict):
+        self.file_stream.write(dumps(pull_request_data) + "\n")
+        self.file_stream.flush()
+        self.count += 1
+
+    def close(self):
+        self.file_stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_raw_data(path: str) -> Iterator[dict]:
+    if os.path.isdir(path):
+        # one partition per repository, as written by a multi-repo collection
+        for partition in sorted(Path(path).glob("*.jsonl")):
+            yield from read_raw_data(str(partition))
+        return
+
+    if not path.endswith(".jsonl"):
+        with open(path, 'rb') as file_stream, Timer("raw data parse"):
+            pull_requests = load(file_stream)
+        yield from pull_requests
+        return
+
+    with open(path, 'rb') as file_stream:
+        for line in file_stream:
+            if line.strip():
+                with Timer("raw data parse"):
+                    pull_request = loads(line)
+                yield pull_request
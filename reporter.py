@@ -1,18 +1,60 @@
 ﻿import argparse
-import json
-from datetime import datetime
+from datetime import date, time
+from functools import lru_cache
+from itertools import chain, islice
+from pathlib import Path
 
-from py_markdown_table.markdown_table import markdown_table
+from instrumentation import add_arguments, instrumented, timed
+from markdown_writer import render_table, write_table
+from metrics_db import load_all_team_metrics, load_pull_requests, load_pull_requests_by_team, load_team_metrics
+from team_outputs import team_directory, write_index
 
 WORKING_HOURS = 8
-
-
-def main(input_file: str, output_file: str, team: str):
-    metrics = load_metrics(input_file)
-
-    monthly_table = build_monthly_table(metrics["teams"][team]["per_month"])
-    weekly_table = build_weekly_table(metrics["teams"][team]["per_week"])
-    pull_request_table = build_pull_request_table(metrics["pull_requests"])
+# Distribution columns added to the monthly and weekly tables
+PERCENTILE_COLUMNS = {
+    "first_commit_to_production": "First Commit To Production",
+    "feedback_delay": "Feedback Delay",
+    "code_review_duration": "Code Review Duration",
+}
+REPORT_SECTIONS = ["per_month", "per_week", "rolling", "week_over_week", "reviewer_load"]
+REPORT_FILE = "report.md"
+# Timestamps and durations repeat a lot across a PR table, so their formatting is cached
+FORMAT_CACHE_SIZE = 65536
+
+
+def main(input_file: str, output_file: str, team: str, page_size: int | None = None, padded: bool = True,
+         pull_request_filters: dict | None = None):
+    # pull_request_filters (since, until, author, label) narrow the pull request table; the aggregates stay team-wide
+    team_metrics = load_team_metrics(input_file, team, REPORT_SECTIONS)
+    pull_requests = load_pull_requests(input_file, team, **(pull_request_filters or {}))
+    write_report(output_file, team, team_metrics, pull_requests, page_size, padded)
+
+
+def main_all_teams(input_file: str, output_dir: str, page_size: int | None = None, padded: bool = True,
+                   pull_request_filters: dict | None = None):
+    # the metrics are read once and every team's report is written to its own directory
+    all_team_metrics = load_all_team_metrics(input_file, REPORT_SECTIONS)
+    pull_requests_by_team = load_pull_requests_by_team(input_file, **(pull_request_filters or {}))
+    write_team_reports(output_dir, all_team_metrics, pull_requests_by_team, page_size, padded)
+    write_index(output_dir, list(all_team_metrics))
+
+
+def write_team_reports(output_dir: str, all_team_metrics: dict, pull_requests_by_team: dict,
+                       page_size: int | None = None, padded: bool = True):
+    for team, team_metrics in all_team_metrics.items():
+        output_file = team_directory(output_dir, team) / REPORT_FILE
+        write_report(str(output_file), team, team_metrics, pull_requests_by_team.get(team, {}), page_size, padded)
+        print(f"Report for {team} written to {output_file}")
+
+
+@timed()
+def write_report(output_file: str, team: str, team_metrics: dict, pull_requests: dict,
+                 page_size: int | None = None, padded: bool = True):
+    monthly_table = build_monthly_table(team_metrics["per_month"])
+    weekly_table = build_weekly_table(team_metrics["per_week"])
+    rolling_table = build_rolling_table(team_metrics.get("rolling", {}))
+    week_over_week_table = build_week_over_week_table(team_metrics.get("week_over_week", {}))
+    reviewer_load_table = build_reviewer_load_table(team_metrics.get("reviewer_load", {}))
     with open(output_file, 'w') as file_stream:
         file_stream.write(f"# {team} PR Metrics Report\n\n")
 
@@ -22,8 +64,23 @@ def main(input_file: str, output_file: str, team: str):
         file_stream.write("## Weekly Stats\n")
         file_stream.write(weekly_table + "\n")
 
+        file_stream.write("## Rolling Averages\n")
+        file_stream.write(rolling_table + "\n")
+
+        file_stream.write("## Week over Week\n")
+        file_stream.write(week_over_week_table + "\n")
+
+        file_stream.write("## Reviewer Load\n")
+        file_stream.write(reviewer_load_table + "\n")
+
         file_stream.write("## Pull Requests\n")
-        file_stream.write(pull_request_table + "\n")
+        # the pull request table can run to thousands of rows, so it is streamed rather than built in memory
+        rows = pull_request_rows(pull_requests)
+        if page_size:
+            for page_file, count in write_pull_request_pages(output_file, team, rows, page_size, padded):
+                file_stream.write(f"- [{page_file}]({page_file}) ({count} pull requests)\n")
+        else:
+            write_table(file_stream, rows, padded)
 
         # f.write("## Overall Stats\n")
         # for key, value in metrics['overall'].items():
@@ -65,21 +122,73 @@ def build_duration_row(label, metrics):
             "Avg Feedback Delay (Hrs)": format_duration(averages["feedback_delay"]),
             "Avg Code Review Duration (Hrs)": format_duration(averages["code_review_duration"]),
             "Avg Time in Active Development (Hrs)": format_duration(averages["active_development_duration"]),
+            "Avg Time To First Approval (Hrs)": format_duration(averages["time_to_first_approval"]),
+            "Avg Re-review Latency (Hrs)": format_duration(averages["rereview_latency"]),
 
             "Avg Lines Added": averages["lines_added"],
             "Avg Lines Deleted": averages["lines_deleted"],
             "Avg Files Changed": averages["files_changed"],
             "Avg Comment Count": averages["comment_count"],
             "Total Comment Count": totals["comment_count"],
+            "Total Review Rounds": totals["review_rounds"],
         }
+        for metric, title in PERCENTILE_COLUMNS.items():
+            for percentile, value in source["percentiles"][metric].items():
+                row[f"{percentile.upper()} {title} (Hrs)"] = format_duration(value) if value is not None else ""
 
         data.append(row)
-    return markdown_table(data).set_params(row_sep='markdown',
-                                           quote=False).get_markdown()
+    return build_table(data)
 
 
-def build_pull_request_table(metrics):
+def build_rolling_table(metrics):
+    data = list[dict[str, any]]()
+    for window, days in metrics.items():
+        if not days:
+            continue
+        day = max(days)
+        source = days[day]
+        averages = source["averages"]
+
+        data.append({
+            "Window": window,
+            "To": day,
+            "Count": source["count"],
+            "Avg First Commit To Production (Hrs)": format_duration(averages["first_commit_to_production"]),
+            "Avg Feedback Delay (Hrs)": format_duration(averages["feedback_delay"]),
+            "Avg Code Review Duration (Hrs)": format_duration(averages["code_review_duration"]),
+            "Avg Comment Count": averages["comment_count"],
+        })
+    return build_table(data)
+
+
+def build_week_over_week_table(metrics):
     data = list[dict[str, any]]()
+    for week, source in sorted(metrics.items(), reverse=True):
+        averages = source["averages"]
+
+        data.append({
+            "ISO Week": week,
+            "Count": f"{source['count']:+d}",
+            "Avg First Commit To Production (Hrs)": f"{averages['first_commit_to_production']:+d}",
+            "Avg Feedback Delay (Hrs)": f"{averages['feedback_delay']:+d}",
+            "Avg Code Review Duration (Hrs)": f"{averages['code_review_duration']:+d}",
+            "Avg Comment Count": f"{averages['comment_count']:+d}",
+        })
+    return build_table(data)
+
+
+def build_reviewer_load_table(metrics):
+    return build_table([
+        {"Reviewer": user, "Pull Requests Reviewed": load["pull_requests"], "Reviews": load["reviews"]}
+        for user, load in metrics.items()
+    ])
+
+
+def build_pull_request_table(metrics):
+    return build_table(pull_request_rows(metrics))
+
+
+def pull_request_rows(metrics):
     for pr_number, row_source in metrics.items():
         if row_source["approved_at"] is None:
             continue
@@ -88,10 +197,29 @@ def build_pull_request_table(metrics):
             "PR": pr_number,
         }
         format_metrics_row(row, row_source)
-        data.append(row)
+        yield row
+
+
+def write_pull_request_pages(output_file, team, rows, page_size, padded=True):
+    """Splits the pull request table into files of page_size rows beside the report; yields each file and size."""
+    output = Path(output_file)
+    page = 0
+    while True:
+        page_rows = islice(rows, page_size)
+        first_row = next(page_rows, None)
+        if first_row is None:
+            return
 
-    return markdown_table(data).set_params(row_sep='markdown',
-                                           quote=False).get_markdown()
+        page += 1
+        page_file = output.with_name(f"{output.stem}-pull-requests-{page}.md")
+        with open(page_file, 'w') as file_stream:
+            file_stream.write(f"# {team} Pull Requests, page {page}\n\n")
+            count = write_table(file_stream, chain((first_row,), page_rows), padded)
+        yield page_file.name, count
+
+
+def build_table(data):
+    return render_table(data)
 
 
 def format_metrics_row(destination, pull_request):
@@ -101,19 +229,50 @@ def format_metrics_row(destination, pull_request):
     destination["Last Commit"] = to_readable_time(pull_request["last_commit_at"])
     destination["Ready for Review"] = to_readable_time(pull_request["ready_for_review_at"])
     destination["First Feedback"] = to_readable_time(pull_request["first_feedback_at"])
+    destination["First Approval"] = to_readable_time(pull_request["first_approved_at"])
     destination["Approved"] = to_readable_time(pull_request["approved_at"])
     destination["Merged"] = to_readable_time(pull_request["merged_at"])
 
-    destination["First Commit To Production (Hrs)"] = format_duration(pull_request["first_commit_to_production"])
-    destination["Code Complete To Production (Hrs)"] = format_duration(pull_request["code_complete_to_production"])
-    destination["Feedback Delay (Hrs)"] = format_duration(pull_request["feedback_delay"])
-    destination["Code Review Duration (Hrs)"] = format_duration(pull_request["code_review_duration"])
+    # any duration can be missing: pull requests merged without an approval have no approval times, only those
+    # reviewed again after changes were requested have a re-review latency, and so on
+    destination["First Commit To Production (Hrs)"] = format_optional_duration(
+        pull_request["first_commit_to_production"]
+    )
+    destination["Code Complete To Production (Hrs)"] = format_optional_duration(
+        pull_request["code_complete_to_production"]
+    )
+    destination["Feedback Delay (Hrs)"] = format_optional_duration(pull_request["feedback_delay"])
+    destination["Code Review Duration (Hrs)"] = format_optional_duration(pull_request["code_review_duration"])
     # destination["Code Review Duration (Hrs)"] = format_duration(pull_request["code_review_duration_with_feedback"])
-    destination["Time in Active Development (Hrs)"] = format_duration(pull_request["active_development_duration"])
+    destination["Time in Active Development (Hrs)"] = format_optional_duration(
+        pull_request["active_development_duration"]
+    )
+    destination["Time To First Approval (Hrs)"] = format_optional_duration(pull_request["time_to_first_approval"])
+    destination["Re-review Latency (Hrs)"] = format_optional_duration(pull_request["rereview_latency"])
+    destination["Review Rounds"] = pull_request["review_rounds"]
+
+
+def to_readable_time(value: str | None):
+    if value is None:
+        return ""
+    # Formatted as date and time of day separately: PRs share far fewer whole timestamps than days, and there are
+    # only 1440 minutes in a day, so both halves are nearly always cached
+    return f"{readable_date(value[:10])} {readable_time_of_day(value[11:16])}"
+
 
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def readable_date(value: str):
+    return date.fromisoformat(value).strftime('%d/%m/%Y')
 
-def to_readable_time(value: str):
-    return datetime.fromisoformat(value).strftime('%d/%m/%Y %I:%M%p')
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def readable_time_of_day(value: str):
+    return time.fromisoformat(value).strftime('%I:%M%p')
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_optional_duration(value: float | None):
+    return format_duration(value) if value is not None else ""
 
 
 def format_duration(value: float):
@@ -132,17 +291,25 @@ def format_duration(value: float):
     return ' '.join(elements)
 
 
-def load_metrics(input_file):
-    with open(input_file) as file_stream:
-        metrics = json.load(file_stream)
-    return metrics
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', required=True)
-    parser.add_argument('--output', required=True)
-    parser.add_argument('--team', required=True)
+    parser.add_argument('--output', required=True, help="Report file, or the output directory with --all-teams")
+    team_group = parser.add_mutually_exclusive_group(required=True)
+    team_group.add_argument('--team')
+    team_group.add_argument('--all-teams', action='store_true')
+    parser.add_argument('--page-size', type=int, help="Split the pull request table into files of this many rows")
+    parser.add_argument('--unpadded', action='store_true', help="Write the pull request table without column padding")
+    parser.add_argument('--since', type=date.fromisoformat, help="Only list pull requests merged on or after this date")
+    parser.add_argument('--until', type=date.fromisoformat, help="Only list pull requests merged on or before this date")
+    parser.add_argument('--author')
+    parser.add_argument('--label')
+    add_arguments(parser, "reporter")
     args = parser.parse_args()
 
-    main(args.input, args.output, args.team)
+    filters = {"since": args.since, "until": args.until, "author": args.author, "label": args.label}
+    with instrumented("reporter", args.instrument, args.profile):
+        if args.all_teams:
+            main_all_teams(args.input, args.output, args.page_size, not args.unpadded, filters)
+        else:
+            main(args.input, args.output, args.team, args.page_size, not args.unpadded, filters)
@@ -0,0 +1,125 @@
+﻿DEFAULT_RULE = "default"
+DEFAULT_REQUIRED_APPROVALS = 2
+
+
+class ApprovalRule:
+    """When a pull request counts as approved: enough distinct approvers and, optionally, no outstanding changes."""
+
+    def __init__(self, required_approvals: int = DEFAULT_REQUIRED_APPROVALS, changes_requested_blocks: bool = True):
+        if required_approvals < 1:
+            raise ValueError("At least one approval must be required")
+
+        self.required_approvals = required_approvals
+        self.changes_requested_blocks = changes_requested_blocks
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ApprovalRule":
+        return cls(
+            required_approvals=config.get("required_approvals", DEFAULT_REQUIRED_APPROVALS),
+            changes_requested_blocks=config.get("changes_requested_blocks", True),
+        )
+
+    def settings(self) -> dict:
+        return {
+            "required_approvals": self.required_approvals,
+            "changes_requested_blocks": self.changes_requested_blocks,
+        }
+
+    def is_met(self, approved_by: set, changes_requested_by: set) -> bool:
+        return len(approved_by) >= self.required_approvals and \
+            not (self.changes_requested_blocks and changes_requested_by)
+
+
+DEFAULT_APPROVAL_RULE = ApprovalRule()
+
+
+def repo_rules(rules: dict | None) -> dict:
+    # Rules are keyed by "owner/name", with "default" for every other repository and single-repo data
+    return {DEFAULT_RULE: DEFAULT_APPROVAL_RULE, **(rules or {})}
+
+
+def rule_for(rules: dict, repo: str | None) -> ApprovalRule:
+    return rules.get(repo, rules[DEFAULT_RULE]) if repo else rules[DEFAULT_RULE]
+
+
+def review_timeline(reviews, rule: ApprovalRule = DEFAULT_APPROVAL_RULE) -> dict:
+    """
+    Walks a pull request's (submitted_at, user, state) reviews once, in submission order, and returns:
+        - first_reviewed_at: the earliest review of any kind
+        - approved_at: when the rule was last met, if it still holds after the final review
+        - first_approved_at: the first APPROVED review
+        - review_rounds: 1 for the first review, plus one each time a reviewer comes back after changes were requested
+        - changes_requested_at / rereviewed_at: the first changes request that got a re-review from the same reviewer,
+          and that re-review
+        - review_counts: reviews submitted per reviewer
+    """
+    timeline = sorted(reviews, key=lambda entry: entry[0])
+
+    approved_by = set()
+    changes_requested_by = set()
+    # reviewer -> when their still-unanswered changes request was made
+    awaiting_rereview = {}
+    is_met = False
+    approved_at = None
+    first_approved_at = None
+    review_rounds = 1 if timeline else 0
+    new_round_pending = False
+    changes_requested_at = None
+    rereviewed_at = None
+    review_counts = {}
+
+    for submitted_at, user, state in timeline:
+        review_counts[user] = review_counts.get(user, 0) + 1
+        if user in awaiting_rereview:
+            requested_at = awaiting_rereview.pop(user)
+            if rereviewed_at is None:
+                changes_requested_at, rereviewed_at = requested_at, submitted_at
+            if new_round_pending:
+                review_rounds += 1
+                new_round_pending = False
+
+        if state == "APPROVED":
+            approved_by.add(user)
+            changes_requested_by.discard(user)
+            if first_approved_at is None:
+                first_approved_at = submitted_at
+        elif state == "CHANGES_REQUESTED":
+            approved_by.discard(user)
+            changes_requested_by.add(user)
+            awaiting_rereview.setdefault(user, submitted_at)
+            new_round_pending = True
+        elif state == "DISMISSED":
+            approved_by.discard(user)
+            changes_requested_by.discard(user)
+        else:
+            # comments leave the approval state as it was
+            continue
+
+        was_met, is_met = is_met, rule.is_met(approved_by, changes_requested_by)
+        if is_met and not was_met:
+            approved_at = submitted_at
+
+    return {
+        "first_reviewed_at": timeline[0][0] if timeline else None,
+        "approved_at": approved_at if is_met else None,
+        "first_approved_at": first_approved_at,
+        "review_rounds": review_rounds,
+        "changes_requested_at": changes_requested_at,
+        "rereviewed_at": rereviewed_at,
+        "review_counts": review_counts,
+    }
+
+
+def build_reviewer_load(pr_metrics) -> dict[str, dict[str, dict]]:
+    """Per team, how many of its pull requests each reviewer reviewed and how many reviews they submitted."""
+    load = {}
+    for pr_metric in pr_metrics:
+        team_load = load.setdefault(pr_metric["team"], {})
+        for user, count in pr_metric.get("review_counts", {}).items():
+            reviewer = team_load.setdefault(user, {"pull_requests": 0, "reviews": 0})
+            reviewer["pull_requests"] += 1
+            reviewer["reviews"] += count
+    return {
+        team: dict(sorted(team_load.items(), key=lambda item: (-item[1]["reviews"], item[0])))
+        for team, team_load in load.items()
+    }
@@ -0,0 +1,30 @@
+﻿import re
+from pathlib import Path
+
+INDEX_FILE = "index.md"
+
+
+def team_directory(output_dir: str, team: str) -> Path:
+    directory = Path(output_dir) / re.sub(r"[^A-Za-z0-9._-]+", "_", team)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def write_index(output_dir: str, teams: list[str]):
+    # Lists whatever each team directory holds, so the reporter and visualizer can share one output directory
+    # and whichever runs last leaves an index of both
+    lines = ["# PR Metrics\n"]
+    for team in teams:
+        directory = team_directory(output_dir, team)
+        lines.append(f"\n## {team}\n")
+        for output in sorted(directory.iterdir()):
+            if output.name.startswith("."):
+                # bookkeeping such as the chart cache
+                continue
+            lines.append(f"- [{output.name}]({directory.name}/{output.name})\n")
+
+    # with no teams, nothing else has created the directory
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    index = Path(output_dir) / INDEX_FILE
+    index.write_text("".join(lines))
+    print(f"Index written to {index}")
@@ -0,0 +1,42 @@
+﻿from datetime import datetime, timedelta, timezone
+
+CREATED_AT = datetime(2024, 3, 4, 9, 0, tzinfo=timezone.utc)
+
+
+def at(hours: float) -> str:
+    """An ISO timestamp the given number of hours after CREATED_AT, a Monday at 09:00 UTC."""
+    return (CREATED_AT + timedelta(hours=hours)).isoformat()
+
+
+def review(user: str, state: str, hours: float) -> dict:
+    return {"user": user, "submitted_at": at(hours), "state": state}
+
+
+def event(action: str, hours: float, label: str = "") -> dict:
+    return {"actor": "author", "action": action, "timestamp": at(hours), "label": label}
+
+
+def raw_pull_request(number: int = 1, reviews: list[dict] = (), events: list[dict] = (), merged_after: float = 7.0,
+                     draft: bool = False, author: str = "author", repo: str | None = "org/repo", **fields) -> dict:
+    """A raw pull request as collector.py writes it, created at CREATED_AT with one commit just before."""
+    return {
+        "repo": repo,
+        "number": number,
+        "title": f"Change {number}",
+        "author": author,
+        "created_at": at(0),
+        "merged_at": at(merged_after),
+        "closed_at": at(merged_after),
+        "state": "closed",
+        "assignees": [],
+        "labels": [],
+        "draft": draft,
+        "additions": 10,
+        "deletions": 2,
+        "changed_files": 1,
+        "comments": 0,
+        "reviews": list(reviews),
+        "events": list(events),
+        "commits": [{"author": author, "timestamp": at(-1)}],
+        **fields,
+    }
@@ -0,0 +1,90 @@
+﻿import copy
+
+import pytest
+
+from pull_request_factory import event, raw_pull_request, review
+
+import analyzer
+from benchmarks.synthetic_data import DEFAULT_USERS, build_teams, generate_pull_requests
+
+PULL_REQUESTS = 600
+
+
+@pytest.fixture(scope="module")
+def pull_requests():
+    return list(generate_pull_requests(PULL_REQUESTS, seed=11))
+
+
+@pytest.fixture(scope="module")
+def teams():
+    return build_teams(DEFAULT_USERS)
+
+
+def test_workers_output_is_byte_identical(pull_requests, teams, tmp_path, monkeypatch):
+    # small shards, so the work is really spread over several processes
+    monkeypatch.setattr(analyzer, "SHARD_SIZE", 50)
+    analyzer.main(pull_requests, teams, output_format="json", output_file=str(tmp_path / "serial.json"))
+    analyzer.main(pull_requests, teams, workers=3, output_format="json", output_file=str(tmp_path / "workers.json"))
+    assert (tmp_path / "workers.json").read_bytes() == (tmp_path / "serial.json").read_bytes()
+
+
+def test_store_matches_full_run(pull_requests, teams, tmp_path):
+    store = str(tmp_path / "metrics.sqlite")
+    assert analyzer.analyze(pull_requests, teams, store_path=store) == analyzer.analyze(pull_requests, teams)
+
+    # a later run sees edited, removed and new pull requests
+    changed = copy.deepcopy(pull_requests[:-40])
+    for pull_request in changed[:25]:
+        pull_request["comments"] += 3
+        pull_request["reviews"] = pull_request["reviews"][:1]
+    changed += list(generate_pull_requests(20, seed=12))
+    for number, pull_request in enumerate(changed[-20:], start=PULL_REQUESTS + 1):
+        pull_request["number"] = number
+    assert analyzer.analyze(changed, teams, store_path=store) == analyzer.analyze(changed, teams)
+
+
+def test_store_rebuilds_when_teams_change(pull_requests, teams, tmp_path):
+    store = str(tmp_path / "metrics.sqlite")
+    analyzer.analyze(pull_requests, teams, store_path=store)
+    regrouped = {"Everyone": [member for members in teams.values() for member in members]}
+    assert analyzer.analyze(pull_requests, regrouped, store_path=store) == analyzer.analyze(pull_requests, regrouped)
+
+
+def test_sparse_durations_average_over_pull_requests_that_have_them():
+    rereviewed = raw_pull_request(1, reviews=[
+        review("reviewer", "CHANGES_REQUESTED", 1), review("reviewer", "APPROVED", 5), review("other", "APPROVED", 6),
+    ])
+    unapproved = raw_pull_request(2, reviews=[review("reviewer", "COMMENTED", 1)])
+    metrics = analyzer.analyze([rereviewed, unapproved], {"Team": ["author"]})
+    day = metrics["teams"]["Team"]["per_day"]["2024-03-04"]
+    assert day["count"] == 2
+    assert metrics["pull_requests"]["org/repo#2"]["rereview_latency"] is None
+    assert metrics["pull_requests"]["org/repo#2"]["time_to_first_approval"] is None
+    # the first pull request's own durations, not spread over both pull requests
+    assert day["averages"]["rereview_latency"] == 4
+    assert day["averages"]["time_to_first_approval"] == 5
+
+
+def test_draft_and_review_request_averages_skip_pull_requests_without_them():
+    drafted = raw_pull_request(1, draft=True, reviews=[review("reviewer", "APPROVED", 5)], events=[
+        event("ready_for_review", 2), event("review_requested", 3),
+    ])
+    plain = raw_pull_request(2, reviews=[review("reviewer", "APPROVED", 1)])
+    metrics = analyzer.analyze([drafted, plain], {"Team": ["author"]})
+    averages = metrics["teams"]["Team"]["per_day"]["2024-03-04"]["averages"]
+    assert averages["draft_duration"] == 2
+    assert averages["review_request_latency"] == 2
+
+
+def test_unmerged_pull_requests_fall_in_no_bucket():
+    merged = raw_pull_request(1)
+    unmerged = raw_pull_request(2, merged_at=None, closed_at=None, state="open", created_at="2024-11-01T10:00:00+00:00")
+    metrics = analyzer.analyze([merged, unmerged], {"Team": ["author"]})
+    assert set(metrics["pull_requests"]) == {"org/repo#1", "org/repo#2"}
+    assert list(metrics["teams"]["Team"]["per_day"]) == ["2024-03-04"]
+    assert metrics["teams"]["Team"]["per_day"]["2024-03-04"]["count"] == 1
+
+
+def test_only_unmerged_pull_requests():
+    metrics = analyzer.analyze([raw_pull_request(1, merged_at=None, closed_at=None, state="open")], {"Team": ["author"]})
+    assert metrics["teams"] == {}
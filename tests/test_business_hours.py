@@ -0,0 +1,96 @@
+﻿import math
+import random
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from business_duration import businessDuration
+from business_hours import WorkingCalendar
+from pull_request_record import to_epoch
+
+# businessDuration numbers weekdays from Monday as 0, so the analyzer's old [6, 7] setting only ever excluded Sunday
+WEEKEND_DAYS = {"Friday": 4, "Saturday": 5, "Sunday": 6}
+CALENDARS = [
+    {"starttime": time(9, 0), "endtime": time(17, 0), "weekends": ["Sunday"], "holidays": []},
+    {"starttime": time(9, 0), "endtime": time(17, 0), "weekends": ["Saturday", "Sunday"], "holidays": []},
+    {"starttime": time(8, 30), "endtime": time(18, 15), "weekends": ["Saturday", "Sunday"],
+     "holidays": [date(2024, 1, 1), date(2024, 3, 29), date(2024, 4, 1), date(2024, 12, 25), date(2024, 12, 26)]},
+    {"starttime": time(7, 0), "endtime": time(15, 45), "weekends": ["Friday", "Saturday"], "holidays": [date(2024, 2, 14)]},
+]
+
+
+def reference_hours(calendar: dict, start: datetime, end: datetime) -> float:
+    return businessDuration(
+        start,
+        end,
+        starttime=calendar["starttime"],
+        endtime=calendar["endtime"],
+        weekendlist=[WEEKEND_DAYS[day] for day in calendar["weekends"]],
+        holidaylist=calendar["holidays"],
+        unit="hour"
+    )
+
+
+def assert_matches(calendar: dict, intervals: list[tuple[datetime, datetime]]):
+    hours = WorkingCalendar(**calendar).hours_between(
+        [to_epoch(start.isoformat()) for start, _ in intervals],
+        [to_epoch(end.isoformat()) for _, end in intervals]
+    )
+    for (start, end), value in zip(intervals, hours.tolist()):
+        expected = reference_hours(calendar, start, end)
+        if math.isnan(expected):
+            assert math.isnan(value), (start, end)
+        else:
+            assert round(value, 2) == round(expected, 2), (start, end)
+
+
+def random_intervals(rng: random.Random, count: int) -> list[tuple[datetime, datetime]]:
+    first = datetime(2023, 12, 1)
+    intervals = []
+    for _ in range(count):
+        start = first + timedelta(seconds=rng.randrange(0, 400 * 86400))
+        end = start + timedelta(seconds=rng.choice([rng.randrange(0, 86400), rng.randrange(0, 30 * 86400)]))
+        intervals.append((start, end))
+    return intervals
+
+
+def edge_intervals() -> list[tuple[datetime, datetime]]:
+    # Saturday 2024-03-30 and Sunday 2024-03-31 fall between the Good Friday and Easter Monday holidays
+    moments = [
+        datetime(2024, 3, 27, 7, 0),  # Wednesday, before opening
+        datetime(2024, 3, 27, 9, 0),  # at opening
+        datetime(2024, 3, 27, 12, 30),
+        datetime(2024, 3, 27, 17, 0),  # at closing
+        datetime(2024, 3, 27, 21, 45),  # after closing
+        datetime(2024, 3, 29, 11, 0),  # Good Friday
+        datetime(2024, 3, 30, 10, 0),  # Saturday
+        datetime(2024, 3, 31, 18, 0),  # Sunday, after closing
+        datetime(2024, 4, 1, 9, 30),  # Easter Monday
+        datetime(2024, 4, 2, 8, 59, 59),  # Tuesday, just before opening
+        datetime(2024, 4, 2, 17, 0, 1),  # just after closing
+        datetime(2024, 4, 15, 13, 0),  # two weeks on
+    ]
+    # every ordered pair, including equal moments and ends before starts
+    return [(start, end) for start in moments for end in moments]
+
+
+@pytest.mark.parametrize("calendar", CALENDARS)
+def test_random_intervals_match_business_duration(calendar):
+    assert_matches(calendar, random_intervals(random.Random(7), 3000))
+
+
+@pytest.mark.parametrize("calendar", CALENDARS)
+def test_edge_intervals_match_business_duration(calendar):
+    assert_matches(calendar, edge_intervals())
+
+
+def test_end_before_start_is_nan():
+    hours = WorkingCalendar().hours_between([to_epoch("2024-03-27T12:00:00")], [to_epoch("2024-03-27T10:00:00")])
+    assert math.isnan(hours[0])
+
+
+def test_missing_moments_are_nan():
+    hours = WorkingCalendar().hours_between(
+        [None, to_epoch("2024-03-27T10:00:00")], [to_epoch("2024-03-27T12:00:00"), None]
+    )
+    assert all(math.isnan(value) for value in hours)
@@ -0,0 +1,57 @@
+﻿from datetime import datetime, timezone
+
+import pytest
+
+import collector
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.synthetic_data import DEFAULT_REPO, generate_pull_requests
+from graphql_collector import extract_commits
+from raw_data import UNKNOWN_USER
+
+START = datetime(1970, 1, 1, tzinfo=timezone.utc)
+END = datetime(2100, 1, 1, tzinfo=timezone.utc)
+# small pages, so the GraphQL engine follows cursors for pull requests and their connections
+PAGE_SIZE = 7
+
+
+@pytest.fixture(scope="module")
+def fake():
+    pull_requests = list(generate_pull_requests(40, seed=5))
+    # a commit whose email belongs to no account, which GitHub sends without a user
+    pull_requests[3]["commits"][0]["author"] = UNKNOWN_USER
+    fake = FakeGitHub(pull_requests)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def collect(fake, engine, events, output_file):
+    collector.main(
+        [DEFAULT_REPO], START, END, 2, engine, f"{fake.base_url}/graphql", PAGE_SIZE, api_url=fake.base_url,
+        output_file=str(output_file), event_types=collector.EVENT_SETS[events]
+    )
+    return output_file.read_bytes()
+
+
+@pytest.mark.parametrize("events", collector.EVENT_SETS)
+def test_engines_write_identical_records(fake, tmp_path, events):
+    rest = collect(fake, "rest", events, tmp_path / "rest.jsonl")
+    graphql = collect(fake, "graphql", events, tmp_path / "graphql.jsonl")
+
+    assert rest.count(b"\n") == 40
+    assert graphql == rest
+
+
+def test_commit_without_git_author_is_kept():
+    nodes = [
+        {"commit": {"author": {"user": {"login": "alice"}, "date": "2024-03-04T09:00:00Z"},
+                    "committedDate": "2024-03-04T10:00:00Z"}},
+        {"commit": {"author": {"user": None, "date": "2024-03-04T11:00:00Z"}, "committedDate": "2024-03-04T11:00:00Z"}},
+        {"commit": {"author": None, "committedDate": "2024-03-04T12:00:00Z"}},
+    ]
+
+    assert extract_commits(nodes) == [
+        {"author": "alice", "timestamp": "2024-03-04T09:00:00+00:00"},
+        {"author": UNKNOWN_USER, "timestamp": "2024-03-04T11:00:00+00:00"},
+        {"author": UNKNOWN_USER, "timestamp": "2024-03-04T12:00:00+00:00"},
+    ]
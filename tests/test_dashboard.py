@@ -0,0 +1,28 @@
+﻿import dashboard
+
+
+def test_reviewer_series_keeps_the_busiest_reviewers(monkeypatch):
+    monkeypatch.setattr(dashboard, "TOP_REVIEWERS", 2)
+    load = {
+        "alice": {"pull_requests": 4, "reviews": 9},
+        "bob": {"pull_requests": 5, "reviews": 6},
+        "carol": {"pull_requests": 1, "reviews": 1},
+    }
+    assert dashboard.build_reviewer_series(load) == {
+        "reviewers": ["alice", "bob"], "reviews": [9, 6], "pull_requests": [4, 5],
+    }
+
+
+def test_dashboard_embeds_reviewer_load():
+    bucket = {
+        "count": 1,
+        "averages": dict.fromkeys(dashboard.AVERAGED_DURATIONS, 1.5),
+        "percentiles": {metric: {"p50": 1.0, "p90": 2.0} for metric in dashboard.PERCENTILE_DURATIONS},
+    }
+    html = dashboard.build_dashboard({
+        "red": {"per_week": {"2024-03-04": bucket}, "reviewer_load": {"alice": {"pull_requests": 1, "reviews": 2}}},
+        # a team with no merged pull requests has no reviewer load
+        "blue": {},
+    })
+    assert '"reviewers":{"blue":{"reviewers":[],"reviews":[],"pull_requests":[]},' \
+           '"red":{"reviewers":["alice"],"reviews":[2],"pull_requests":[1]}}' in html
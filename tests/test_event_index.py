@@ -0,0 +1,89 @@
+﻿from pull_request_factory import at, event, raw_pull_request, review
+
+from analyzer import pull_request_timings
+from event_index import event_timings
+from pull_request_record import PullRequestRecord, to_epoch
+
+MERGED_AFTER = 7.0
+
+
+def timings(**fields) -> dict:
+    pull_request = PullRequestRecord.from_raw(raw_pull_request(merged_after=MERGED_AFTER, **fields))
+    return event_timings(pull_request, pull_request.merged_at)
+
+
+def epoch(hours: float) -> int:
+    return to_epoch(at(hours))
+
+
+def test_opened_ready_for_review():
+    result = timings(events=[event("review_requested", 1)])
+    assert result["ready_for_review_at"] == epoch(0)
+    assert result["draft_intervals"] == []
+    assert result["review_requested_at"] == epoch(1)
+
+
+def test_opened_as_draft():
+    result = timings(draft=True, events=[event("ready_for_review", 2)])
+    assert result["ready_for_review_at"] == epoch(2)
+    assert result["draft_intervals"] == [(epoch(0), epoch(2))]
+
+
+def test_opened_as_draft_and_never_marked_ready():
+    # no draft events at all, so the record's draft flag says how it was opened; the draft lasts until the merge
+    result = timings(draft=True)
+    assert result["ready_for_review_at"] == epoch(0)
+    assert result["draft_intervals"] == [(epoch(0), epoch(MERGED_AFTER))]
+
+
+def test_draft_ready_draft_ready():
+    result = timings(draft=True, events=[
+        event("ready_for_review", 1), event("convert_to_draft", 3), event("ready_for_review", 5),
+    ])
+    # the first time it became ready is when it was first up for review
+    assert result["ready_for_review_at"] == epoch(1)
+    assert result["draft_intervals"] == [(epoch(0), epoch(1)), (epoch(3), epoch(5))]
+
+
+def test_converted_to_draft_after_opening():
+    # the draft flag reflects the latest state, not how the pull request was opened
+    result = timings(draft=False, events=[event("convert_to_draft", 2), event("ready_for_review", 4)])
+    assert result["ready_for_review_at"] == epoch(0)
+    assert result["draft_intervals"] == [(epoch(2), epoch(4))]
+
+
+def test_events_out_of_order():
+    result = timings(draft=True, events=[
+        event("ready_for_review", 5), event("convert_to_draft", 3), event("ready_for_review", 1),
+    ])
+    assert result["ready_for_review_at"] == epoch(1)
+    assert result["draft_intervals"] == [(epoch(0), epoch(1)), (epoch(3), epoch(5))]
+
+
+def test_first_review_request_counts():
+    result = timings(events=[event("review_requested", 3), event("review_requested", 1)])
+    assert result["review_requested_at"] == epoch(1)
+
+
+def test_review_requested_after_the_first_review():
+    pull_request = PullRequestRecord.from_raw(raw_pull_request(
+        reviews=[review("alice", "COMMENTED", 1), review("bob", "APPROVED", 4)],
+        events=[event("review_requested", 2)],
+    ))
+    assert event_timings(pull_request, pull_request.merged_at)["review_requested_at"] == epoch(2)
+
+    # the review came before anyone was asked, so there is no request latency
+    result = pull_request_timings(pull_request)
+    assert result["review_requested_at"] is None
+    assert result["first_feedback_at"] == epoch(1)
+
+
+def test_label_intervals():
+    result = timings(events=[
+        event("labeled", 1, "bug"), event("unlabeled", 2, "bug"), event("labeled", 3, "bug"),
+        event("labeled", 4, "wip"), event("unlabeled", 5, "wip"),
+    ])
+    assert result["label_intervals"] == {
+        "bug": [(epoch(1), epoch(2)), (epoch(3), epoch(MERGED_AFTER))],
+        "wip": [(epoch(4), epoch(5))],
+    }
@@ -0,0 +1,126 @@
+﻿import pytest
+import requests
+
+import github_session
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.synthetic_data import DEFAULT_REPO, generate_pull_requests
+from github_session import CachedResponse, RequestScheduler, ResponseCache
+
+RATE_LIMIT = 10
+RATE_WINDOW = 3600.0
+
+
+@pytest.fixture
+def fake():
+    fake = FakeGitHub(generate_pull_requests(5, seed=3), rate_limit=RATE_LIMIT, rate_window=RATE_WINDOW)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # the scheduler's waits are recorded rather than slept, and its jitter always takes the upper bound
+    sleeps = []
+    monkeypatch.setattr(github_session.time, "sleep", sleeps.append)
+    monkeypatch.setattr(github_session.random, "uniform", lambda low, high: high)
+    return sleeps
+
+
+def pulls_url(fake) -> str:
+    return f"{fake.base_url}/repos/{DEFAULT_REPO}/pulls"
+
+
+def test_not_modified_response_is_replayed_from_cache(fake, tmp_path):
+    scheduler = RequestScheduler(ResponseCache(str(tmp_path / "http_cache.sqlite")))
+    session = requests.Session()
+    headers = {"Accept": "application/vnd.github+json", "Authorization": "token one"}
+
+    first = scheduler.send(session, "GET", pulls_url(fake), headers)
+    replayed = scheduler.send(session, "GET", pulls_url(fake), headers)
+
+    assert fake.requests == 2
+    assert first.status_code == 200
+    assert isinstance(replayed, CachedResponse)
+    assert replayed.text == first.text
+
+
+def test_cached_response_is_not_replayed_for_other_headers(fake, tmp_path):
+    scheduler = RequestScheduler(ResponseCache(str(tmp_path / "http_cache.sqlite")))
+    session = requests.Session()
+    scheduler.send(session, "GET", pulls_url(fake), {"Accept": "application/vnd.github+json"})
+
+    for headers in ({"Accept": "application/vnd.github.raw+json"},
+                    {"Accept": "application/vnd.github+json", "Authorization": "token two"}):
+        response = scheduler.send(session, "GET", pulls_url(fake), headers)
+        assert not isinstance(response, CachedResponse)
+        assert response.status_code == 200
+    assert fake.requests == 3
+
+
+@pytest.mark.parametrize("status", [403, 429])
+def test_rate_limited_request_waits_retry_after(fake, sleeps, status):
+    fake.throttle(status, status, retry_after=5)
+    response = RequestScheduler().send(requests.Session(), "GET", pulls_url(fake), {})
+
+    assert response.status_code == 200
+    assert fake.requests == 3
+    # Retry-After plus a second of jitter
+    assert sleeps == [6.0, 6.0]
+
+
+def test_rate_limited_request_backs_off_exponentially(fake, sleeps):
+    fake.throttle(429, 403, 429)
+    response = RequestScheduler().send(requests.Session(), "GET", pulls_url(fake), {})
+
+    assert response.status_code == 200
+    assert fake.requests == 4
+    assert sleeps == [1.0, 2.0, 4.0]
+
+
+def test_rate_limited_request_gives_up_after_max_retries(fake, sleeps):
+    fake.throttle(429, 429, 429, 429)
+    response = RequestScheduler(max_retries=2).send(requests.Session(), "GET", pulls_url(fake), {})
+
+    assert response.status_code == 429
+    assert fake.requests == 3
+    assert len(sleeps) == 2
+
+
+def test_requests_are_paced_over_the_last_of_the_quota(fake, sleeps):
+    scheduler = RequestScheduler()
+    session = requests.Session()
+    for _ in range(RATE_LIMIT):
+        assert scheduler.send(session, "GET", pulls_url(fake), {}).status_code == 200
+    assert fake.requests == RATE_LIMIT
+
+    # nothing waits until PACING_THRESHOLD of the quota is left; then the last 2 calls are spread over the window
+    assert RATE_LIMIT * github_session.PACING_THRESHOLD == 2
+    assert sleeps == [pytest.approx(RATE_WINDOW / 2, abs=2)]
+
+    # with the quota spent, the next call waits for its reset
+    quota = scheduler.quotas["core"]
+    assert quota.remaining == 0
+    sleeps.clear()
+    scheduler.wait("core")
+    assert len(sleeps) == 1
+    assert sleeps[0] == pytest.approx(quota.reset_at - github_session.time.time(), abs=1)
+
+
+def test_graphql_quota_is_paced_apart_from_rest(fake, sleeps):
+    scheduler = RequestScheduler()
+    session = requests.Session()
+    for _ in range(RATE_LIMIT):
+        scheduler.send(session, "GET", pulls_url(fake), {})
+    sleeps.clear()
+
+    owner, name = DEFAULT_REPO.split("/")
+    query = {"query": "query { repository(owner: $owner, name: $name) }",
+             "variables": {"owner": owner, "name": name, "pageSize": 1}}
+    response = scheduler.send(session, "POST", f"{fake.base_url}/graphql", {}, json=query)
+
+    assert response.status_code == 200
+    assert sleeps == []
+    assert set(scheduler.quotas) == {"core", "graphql"}
+    assert scheduler.quotas["core"].remaining == 0
+    assert scheduler.quotas["graphql"].remaining == RATE_LIMIT - 1
@@ -0,0 +1,59 @@
+﻿import numpy as np
+import pandas as pd
+import pytest
+
+from quantile_sketch import (PERCENTILES, RELATIVE_ACCURACY, bin_indexes, decode_sketch, encode_sketch,
+                             merge_sketches, sketch_percentiles, sketch_quantile)
+
+
+def durations(size: int, seed: int) -> pd.Series:
+    # hundredths of an hour, long-tailed like cycle times, with some zero-length ones
+    values = np.random.default_rng(seed).lognormal(mean=6, sigma=2, size=size).round()
+    return pd.Series(values).astype("int64")
+
+
+def sketch(hundredths: pd.Series) -> str:
+    return encode_sketch(bin_indexes(hundredths).astype("int64").value_counts().to_dict())
+
+
+def exact_quantile(hundredths: pd.Series, quantile: float) -> float:
+    # the value at the rank sketch_quantile reads
+    return np.sort(hundredths.to_numpy())[int(quantile * (len(hundredths) - 1))] / 100
+
+
+def test_merged_sketch_equals_sketch_of_all_values():
+    parts = [durations(500, seed) for seed in range(3)]
+    assert merge_sketches(*map(sketch, parts)) == sketch(pd.concat(parts))
+
+
+@pytest.mark.parametrize("quantile", [0.01, *PERCENTILES.values(), 0.99])
+def test_merged_sketch_quantile_is_within_relative_accuracy(quantile):
+    parts = [durations(size, seed) for seed, size in enumerate([2000, 300, 50])]
+    merged = merge_sketches(*map(sketch, parts))
+    expected = exact_quantile(pd.concat(parts), quantile)
+
+    # bin values are rounded to hundredths of an hour
+    assert sketch_quantile(merged, quantile) == pytest.approx(expected, rel=RELATIVE_ACCURACY, abs=0.005)
+
+
+def test_zero_durations_have_their_own_bin():
+    hundredths = pd.Series([0, 0, 0, 120])
+    assert decode_sketch(sketch(hundredths)) == {-1: 3, int(bin_indexes(pd.Series([120]))[0]): 1}
+    assert sketch_quantile(sketch(hundredths), 0.5) == 0.0
+
+
+def test_empty_sketch_has_no_quantile():
+    assert merge_sketches() == ""
+    assert sketch_quantile("", 0.5) is None
+
+
+def test_percentiles_of_many_sketches_match_sketch_quantile():
+    parts = {team: durations(400, seed) for seed, team in enumerate(["red", "blue"])}
+    counts = pd.concat({
+        team: bin_indexes(hundredths).astype("int64").value_counts() for team, hundredths in parts.items()
+    }).rename_axis(["team", "bin"])
+
+    percentiles = sketch_percentiles(counts)
+    for team, hundredths in parts.items():
+        for name, quantile in PERCENTILES.items():
+            assert percentiles.loc[team, name] == sketch_quantile(sketch(hundredths), quantile)
@@ -0,0 +1,44 @@
+﻿from pull_request_factory import event, raw_pull_request, review
+
+import analyzer
+import reporter
+from pull_request_record import PullRequestRecord
+
+
+def metrics_row(pull_request: dict) -> dict:
+    row = {}
+    reporter.format_metrics_row(row, analyzer.build_metric(PullRequestRecord.from_raw(pull_request), "Team"))
+    return row
+
+
+def test_unapproved_merged_pull_request():
+    row = metrics_row(raw_pull_request(reviews=[review("reviewer", "COMMENTED", 2)]))
+    assert row["First Approval"] == ""
+    assert row["Approved"] == ""
+    assert row["Time To First Approval (Hrs)"] == ""
+    assert row["Code Review Duration (Hrs)"] != ""
+
+
+def test_unapproved_pull_request_in_team_report(tmp_path):
+    metrics = analyzer.analyze([raw_pull_request(reviews=[review("reviewer", "COMMENTED", 2)])], {"Team": ["author"]})
+    output_file = tmp_path / "report.md"
+    reporter.write_report(str(output_file), "Team", metrics["teams"]["Team"], metrics["pull_requests"])
+    assert "Team PR Metrics Report" in output_file.read_text()
+
+
+def test_pull_request_reviewed_while_draft():
+    pull_request = raw_pull_request(
+        draft=True,
+        reviews=[review("first", "APPROVED", 1), review("second", "APPROVED", 2)],
+        events=[event("ready_for_review", 3)],
+    )
+    metric = analyzer.build_metric(PullRequestRecord.from_raw(pull_request), "Team")
+    # ready for review moves back to the first review, so the review durations are still measured
+    assert metric["ready_for_review_at"] == metric["first_feedback_at"]
+    assert metric["feedback_delay"] == 0
+    assert metric["code_review_duration"] == 1
+    assert metric["draft_duration"] == 3
+
+    row = {}
+    reporter.format_metrics_row(row, metric)
+    assert row["Code Review Duration (Hrs)"] != ""
@@ -0,0 +1,121 @@
+﻿import pytest
+
+from review_timeline import ApprovalRule, build_reviewer_load, repo_rules, review_timeline, rule_for
+
+SINGLE_APPROVAL = ApprovalRule(required_approvals=1)
+
+
+def test_no_reviews():
+    timeline = review_timeline([])
+    assert timeline["first_reviewed_at"] is None
+    assert timeline["approved_at"] is None
+    assert timeline["review_rounds"] == 0
+    assert timeline["review_counts"] == {}
+
+
+def test_reviews_are_walked_in_submission_order():
+    timeline = review_timeline([(30, "bob", "APPROVED"), (10, "alice", "COMMENTED"), (20, "alice", "APPROVED")])
+    assert timeline["first_reviewed_at"] == 10
+    assert timeline["first_approved_at"] == 20
+    assert timeline["approved_at"] == 30
+
+
+def test_approval_needs_the_required_distinct_approvers():
+    reviews = [(10, "alice", "APPROVED"), (20, "alice", "APPROVED"), (30, "bob", "COMMENTED")]
+    assert review_timeline(reviews)["approved_at"] is None
+    assert review_timeline(reviews, SINGLE_APPROVAL)["approved_at"] == 10
+    assert review_timeline([*reviews, (40, "carol", "APPROVED")], ApprovalRule(3))["approved_at"] is None
+    assert review_timeline([*reviews, (40, "carol", "APPROVED"), (50, "bob", "APPROVED")],
+                           ApprovalRule(3))["approved_at"] == 50
+
+
+def test_dismissed_approval_no_longer_counts():
+    reviews = [(10, "alice", "APPROVED"), (20, "bob", "APPROVED"), (30, "alice", "DISMISSED")]
+    timeline = review_timeline(reviews)
+    assert timeline["approved_at"] is None
+    assert timeline["first_approved_at"] == 10
+
+    # approved again from the moment the rule is met once more
+    assert review_timeline([*reviews, (40, "carol", "APPROVED")])["approved_at"] == 40
+
+
+def test_dismissed_changes_request_stops_blocking():
+    reviews = [(10, "alice", "APPROVED"), (20, "bob", "CHANGES_REQUESTED"), (30, "carol", "APPROVED")]
+    assert review_timeline(reviews)["approved_at"] is None
+    assert review_timeline([*reviews, (40, "bob", "DISMISSED")])["approved_at"] == 40
+
+
+def test_changes_request_blocks_only_when_the_rule_says_so():
+    reviews = [(10, "alice", "APPROVED"), (20, "bob", "CHANGES_REQUESTED"), (30, "carol", "APPROVED")]
+    assert review_timeline(reviews, ApprovalRule(2, changes_requested_blocks=False))["approved_at"] == 30
+
+
+def test_changes_request_withdraws_the_reviewers_approval():
+    reviews = [(10, "alice", "APPROVED"), (20, "bob", "APPROVED"), (30, "alice", "CHANGES_REQUESTED")]
+    assert review_timeline(reviews, ApprovalRule(2, changes_requested_blocks=False))["approved_at"] is None
+
+
+def test_comments_leave_the_approval_as_it_was():
+    reviews = [(10, "alice", "APPROVED"), (20, "bob", "APPROVED"), (30, "alice", "COMMENTED")]
+    timeline = review_timeline(reviews)
+    assert timeline["approved_at"] == 20
+    assert timeline["review_counts"] == {"alice": 2, "bob": 1}
+
+
+def test_rereview_after_changes_requested():
+    reviews = [
+        (10, "alice", "CHANGES_REQUESTED"),
+        (15, "bob", "COMMENTED"),
+        (20, "alice", "CHANGES_REQUESTED"),
+        (40, "alice", "APPROVED"),
+    ]
+    timeline = review_timeline(reviews, SINGLE_APPROVAL)
+    # alice's second review answers her first request and starts round 2; her approval answers the second
+    assert (timeline["changes_requested_at"], timeline["rereviewed_at"]) == (10, 20)
+    assert timeline["review_rounds"] == 3
+    assert timeline["approved_at"] == 40
+
+
+def test_rereview_pairs_the_request_with_the_same_reviewer():
+    reviews = [(10, "alice", "CHANGES_REQUESTED"), (20, "bob", "APPROVED"), (30, "alice", "APPROVED")]
+    timeline = review_timeline(reviews)
+    assert (timeline["changes_requested_at"], timeline["rereviewed_at"]) == (10, 30)
+    assert timeline["review_rounds"] == 2
+    assert timeline["approved_at"] == 30
+
+
+def test_unanswered_changes_request_has_no_rereview():
+    timeline = review_timeline([(10, "alice", "CHANGES_REQUESTED"), (20, "bob", "APPROVED")])
+    assert timeline["rereviewed_at"] is None
+    assert timeline["review_rounds"] == 1
+
+
+def test_rule_requires_an_approval():
+    with pytest.raises(ValueError):
+        ApprovalRule(required_approvals=0)
+
+
+def test_rules_fall_back_to_the_default():
+    rules = repo_rules({"org/strict": ApprovalRule(3), "default": SINGLE_APPROVAL})
+    assert rule_for(rules, "org/strict").required_approvals == 3
+    assert rule_for(rules, "org/other") is SINGLE_APPROVAL
+    assert rule_for(rules, None) is SINGLE_APPROVAL
+    assert rule_for(repo_rules(None), "org/other").settings() == ApprovalRule().settings()
+
+
+def test_rule_from_config():
+    rule = ApprovalRule.from_config({"required_approvals": 1, "changes_requested_blocks": False})
+    assert rule.settings() == {"required_approvals": 1, "changes_requested_blocks": False}
+
+
+def test_reviewer_load_is_busiest_first():
+    load = build_reviewer_load([
+        {"team": "red", "review_counts": {"alice": 1, "bob": 3}},
+        {"team": "red", "review_counts": {"alice": 2}},
+        {"team": "blue", "review_counts": {}},
+    ])
+    assert load == {
+        "red": {"bob": {"pull_requests": 1, "reviews": 3}, "alice": {"pull_requests": 2, "reviews": 3}},
+        "blue": {},
+    }
+    assert list(load["red"]) == ["alice", "bob"]
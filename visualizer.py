@@ -1,17 +1,23 @@
 ﻿import argparse
-import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
-Path("charts").mkdir(exist_ok=True)
+from chart_cache import ChartCache
+from instrumentation import add_arguments, instrumented, timed
+from metrics_db import load_all_team_metrics, load_team_metrics
+from team_outputs import team_directory, write_index
 
-
-def load_metrics(path):
-    with open(path) as f:
-        return json.load(f)
+CHART_SECTIONS = ["per_week", "rolling"]
+DEFAULT_WORKERS = 1
+# Bump when a chart's drawing changes, so cached charts are redrawn
+CHART_VERSION = 1
+# Where the older whole-dataset charts below are saved
+LEGACY_CHARTS_DIR = "charts"
 
 
 def plot_first_commit_to_production(df):
@@ -22,6 +28,7 @@ def plot_first_commit_to_production(df):
     # plt.ylabel("Number of PRs")
     # plt.savefig("charts/first_commit_to_production.png")
 
+    Path(LEGACY_CHARTS_DIR).mkdir(exist_ok=True)
     df["merged_at"] = pd.to_datetime(df["merged_at"])
     df = df.sort_values("merged_at")
 
@@ -32,29 +39,54 @@ def plot_first_commit_to_production(df):
     plt.ylabel("Time to Production (mins)")
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig("charts/first_commit_to_production.png")
+    plt.savefig(f"{LEGACY_CHARTS_DIR}/first_commit_to_production.png")
     plt.close()
 
 
-def plot_weekly_comment_count_distribution(metrics: dict, output_dir: str):
-    flat_metrics = {
-        week: {**data["totals"], "week": week}
-        for week, data in metrics.items()
-    }
+def plot_weekly_comment_count_distribution(metrics: dict, output_dir: str, cache: ChartCache | None = None):
+    # only what the chart shows is fingerprinted, so changes elsewhere in the weekly buckets don't redraw it
+    comment_counts = {week: data["totals"]["comment_count"] for week, data in metrics.items()}
+    (cache or ChartCache(output_dir, CHART_VERSION)).render(
+        "weekly_comment_count.png", comment_counts, draw_weekly_comment_count, figsize=(10, 6)
+    )
+
 
+def draw_weekly_comment_count(comment_counts: dict):
     # data_frame = pd.DataFrame(list(metrics.items()), columns=["week", "data"])
-    data_frame = pd.DataFrame(flat_metrics.values())
-    # data_frame.index.name = "week"
-    # data_frame.reset_index(inplace=True)
+    data_frame = pd.DataFrame({"week": list(comment_counts), "comment_count": list(comment_counts.values())})
 
-    plt.figure(figsize=(10, 6))
     sns.barplot(data=data_frame, x="week", y="comment_count")
     plt.title("Total Comments Per Week")
     plt.xlabel("Week")
     plt.ylabel("Comment Count")
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig(f"{output_dir}/weekly_comment_count.png")
+
+
+def plot_rolling_first_commit_to_production(metrics: dict, output_dir: str, cache: ChartCache | None = None):
+    hours = {
+        window: {day: data["averages"]["first_commit_to_production"] for day, data in days.items()}
+        for window, days in metrics.items()
+    }
+    (cache or ChartCache(output_dir, CHART_VERSION)).render(
+        "rolling_first_commit_to_production.png", hours, draw_rolling_first_commit_to_production, figsize=(12, 6)
+    )
+
+
+def draw_rolling_first_commit_to_production(hours: dict):
+    data_frame = pd.DataFrame([
+        {"day": day, "window": window, "hours": value}
+        for window, days in hours.items()
+        for day, value in days.items()
+    ])
+    data_frame["day"] = pd.to_datetime(data_frame["day"])
+
+    sns.lineplot(data=data_frame, x="day", y="hours", hue="window")
+    plt.title("Rolling Average First Commit to Production")
+    plt.xlabel("Day")
+    plt.ylabel("Working Hours")
+    plt.xticks(rotation=45)
+    plt.tight_layout()
 
 
 # plt.figure(figsize=(10, 6))
@@ -66,42 +98,86 @@ def plot_weekly_comment_count_distribution(metrics: dict, output_dir: str):
 
 
 def plot_merge_time_distribution(df):
+    Path(LEGACY_CHARTS_DIR).mkdir(exist_ok=True)
     plt.figure(figsize=(10, 6))
     sns.histplot(df["time_to_merge_hrs"], bins=20, kde=True)
     plt.title("Distribution of Time to Merge (Working Hours)")
     plt.xlabel("Hours")
     plt.ylabel("Number of PRs")
-    plt.savefig("charts/merge_time_distribution.png")
+    plt.savefig(f"{LEGACY_CHARTS_DIR}/merge_time_distribution.png")
+    plt.close()
 
 
 def plot_prs_by_author(df):
+    Path(LEGACY_CHARTS_DIR).mkdir(exist_ok=True)
     plt.figure(figsize=(12, 6))
     sns.barplot(data=df, x="author", y="time_to_merge_hrs", ci=None)
     plt.title("Average Time to Merge by Author")
     plt.ylabel("Hours")
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig("charts/merge_time_by_author.png")
+    plt.savefig(f"{LEGACY_CHARTS_DIR}/merge_time_by_author.png")
+    plt.close()
 
 
 def main(metrics_file: str, output_dir: str, team: str, ):
-    metrics = load_metrics(metrics_file)
-    team_metrics = metrics["teams"][team]
+    team_metrics = load_team_metrics(metrics_file, team, CHART_SECTIONS)
 
     # pull_request_df = pd.DataFrame(metrics.get("pull_requests"))
     # plot_first_commit_to_production(pull_request_df)
     # plot_merge_time_distribution(pull_request_df)
     # plot_prs_by_author(pull_request_df)
 
-    plot_weekly_comment_count_distribution(team_metrics["per_week"], output_dir)
-    print(f"Charts saved to {output_dir}")
+    drawn, unchanged = plot_team_charts(team_metrics, output_dir)
+    print(f"Charts saved to {output_dir} ({drawn} drawn, {unchanged} unchanged)")
+
+
+def main_all_teams(metrics_file: str, output_dir: str, workers: int = DEFAULT_WORKERS):
+    # the metrics are read once; each team's charts go to its own directory, rendered in parallel when asked
+    all_team_metrics = load_all_team_metrics(metrics_file, CHART_SECTIONS)
+    plot_all_team_charts(output_dir, all_team_metrics, workers)
+    write_index(output_dir, list(all_team_metrics))
+
+
+def plot_all_team_charts(output_dir: str, all_team_metrics: dict, workers: int = DEFAULT_WORKERS):
+    teams = list(all_team_metrics)
+    team_dirs = [str(team_directory(output_dir, team)) for team in teams]
+    if workers > 1:
+        # spawned rather than forked, as in the pipeline the reports are written on another thread meanwhile
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(plot_team_charts, all_team_metrics.values(), team_dirs))
+    else:
+        results = [
+            plot_team_charts(team_metrics, team_dir)
+            for team_metrics, team_dir in zip(all_team_metrics.values(), team_dirs)
+        ]
+
+    drawn = sum(result[0] for result in results)
+    unchanged = sum(result[1] for result in results)
+    print(f"Charts for {len(teams)} teams saved to {output_dir} ({drawn} drawn, {unchanged} unchanged)")
+
+
+@timed()
+def plot_team_charts(team_metrics: dict, output_dir: str) -> tuple[int, int]:
+    cache = ChartCache(output_dir, CHART_VERSION)
+    plot_weekly_comment_count_distribution(team_metrics["per_week"], output_dir, cache)
+    plot_rolling_first_commit_to_production(team_metrics["rolling"], output_dir, cache)
+    return cache.drawn, cache.unchanged
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', required=True)
     parser.add_argument('--output-dir', required=True)
-    parser.add_argument('--team', required=True)
+    team_group = parser.add_mutually_exclusive_group(required=True)
+    team_group.add_argument('--team')
+    team_group.add_argument('--all-teams', action='store_true')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    add_arguments(parser, "visualizer")
     args = parser.parse_args()
 
-    main(args.input, args.output_dir, args.team)
+    with instrumented("visualizer", args.instrument, args.profile):
+        if args.all_teams:
+            main_all_teams(args.input, args.output_dir, args.workers)
+        else:
+            main(args.input, args.output_dir, args.team)